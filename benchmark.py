@@ -0,0 +1,977 @@
+# A utility program to measure the performance of the API
+#
+# Usage:
+#     python benchmark.py serializers [--people N] [--notes N] [--repeat N]
+#     python benchmark.py concurrency [--readers N] [--writers N]
+#                                     [--seconds N]
+#     python benchmark.py group-commit [--clients N] [--seconds N]
+#                                      [--people N]
+#     python benchmark.py batch [--items N] [--rounds N]
+#     python benchmark.py http --url URL [--path PATH ...] [--clients N]
+#                              [--seconds N]
+#     python benchmark.py startup [--repeat N]
+#     python benchmark.py metrics [--requests N] [--rounds N]
+#     python benchmark.py suite [--people N] [--notes N] [--skew X]
+#                               [--requests N] [--clients N] [--seconds N]
+#                               [--output FILE]
+#     python benchmark.py compare BASELINE.json CURRENT.json [--threshold PCT]
+#
+# Benchmarks that need a database run against a scratch file in the temp
+# directory (or PEOPLE_DATABASE_URL if it is set), never against people.db
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+SCRATCH_DB = os.path.join(tempfile.gettempdir(), 'people_benchmark.db')
+os.environ.setdefault('PEOPLE_DATABASE_URL', 'sqlite:////' + SCRATCH_DB)
+
+# These have to be imported after PEOPLE_DATABASE_URL is set
+from build_database import (  # noqa: E402
+    WORDS, build_database, generate_people, remove_database
+)
+from config import app, basedir, db  # noqa: E402
+from models import Note, Person, PersonSchema  # noqa: E402
+from serializers import dump_person, get_schema  # noqa: E402
+
+
+def make_people(count, notes_per_person):
+    '''
+    Builds transient Person objects with notes, without touching the database
+
+    Parameters
+    ----------
+    count : int
+        Number of people to build
+    notes_per_person : int
+        Number of notes each person gets
+
+    Returns
+    -------
+    list
+        The Person objects
+    '''
+    now = datetime.utcnow()
+    people = []
+    for i in range(count):
+        person = Person(person_id=i, fname=f'First{i}', lname=f'Last{i}',
+                        timestamp=now, note_count=notes_per_person,
+                        last_note_at=now if notes_per_person else None)
+        for j in range(notes_per_person):
+            person.notes.append(
+                Note(note_id=i * notes_per_person + j, person_id=i,
+                     content=f'Note {j} of person {i}', timestamp=now)
+            )
+        people.append(person)
+
+    return people
+
+
+def report(name, seconds, repeat, items):
+    '''
+    Prints one line of benchmark results
+
+    Parameters
+    ----------
+    name : str
+        Name of the measured variant
+    seconds : float
+        Total time of all the repetitions
+    repeat : int
+        Number of repetitions
+    items : int
+        Number of objects serialized per repetition
+    '''
+    per_call = seconds / repeat
+    print(f'{name:<28} {per_call * 1000:10.3f} ms/call '
+          f'{items / per_call:12.0f} objects/s')
+
+
+def bench_serializers(args):
+    '''
+    Compares building a new PersonSchema for every request (what the handlers
+    used to do) with the cached schema and the plain dict fast path, on the
+    response of a single person (with its notes and note counts)
+    '''
+    people = make_people(args.people, args.notes)
+
+    def new_schema_dump():
+        return PersonSchema(many=True).dump(people)
+
+    def cached_schema_dump():
+        return get_schema(PersonSchema, many=True).dump(people)
+
+    def fast_dump():
+        return [dump_person(person, counts=True) for person in people]
+
+    # Make sure all three produce the same response before timing them
+    assert new_schema_dump() == cached_schema_dump() == fast_dump()
+
+    print(f'{args.people} people x {args.notes} notes, '
+          f'{args.repeat} repetitions')
+    for name, func in (
+        ('PersonSchema().dump', new_schema_dump),
+        ('cached schema dump', cached_schema_dump),
+        ('dump_person', fast_dump),
+    ):
+        seconds = timeit.timeit(func, number=args.repeat)
+        report(name, seconds, args.repeat, args.people)
+
+
+def reset_database(people, notes_per_person, skew=0.0):
+    '''
+    Recreates the benchmark database and fills it with synthetic people
+
+    Parameters
+    ----------
+    people : int
+        Number of people to insert
+    notes_per_person : float
+        Average number of notes per person
+    skew : float, optional
+        How unevenly the notes are spread, see
+        build_database.generate_people() (default is 0)
+    '''
+    # Drop the pooled connections so the current SQLITE_PRAGMAS apply
+    db.engine.dispose()
+    # The configured database, SCRATCH_DB unless PEOPLE_DATABASE_URL names
+    # another one (an in-memory database has no file)
+    if db.engine.url.database:
+        remove_database(db.engine.url.database)
+
+    build_database(generate_people(people, notes_per_person, skew))
+    db.session.remove()
+
+
+def run_mixed_load(readers, writers, seconds, people):
+    '''
+    Runs reader and writer threads against the API for a fixed time
+
+    Readers GET random people, writers POST notes to random people
+
+    Returns
+    -------
+    dict
+        Number of successful reads, writes and failed requests
+    '''
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(write):
+        client = app.test_client()
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            person_id = random.randint(1, people)
+            if write:
+                response = client.post(
+                    f'/api/people/{person_id}/notes',
+                    json={'content': 'benchmark'},
+                )
+            else:
+                response = client.get(f'/api/people/{person_id}')
+            if response.status_code < 400:
+                done += 1
+            else:
+                errors += 1
+        with lock:
+            counts['writes' if write else 'reads'] += done
+            counts['errors'] += errors
+
+    threads = [
+        threading.Thread(target=worker, args=(i < writers,))
+        for i in range(readers + writers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return counts
+
+
+def bench_concurrency(args):
+    '''
+    Compares SQLite's default rollback journal with the WAL settings from
+    config.py under concurrent readers and writers
+    '''
+    # Importing server registers the API routes on the app
+    import server  # noqa: F401
+
+    tuned = dict(app.config['SQLITE_PRAGMAS'])
+    default = dict(tuned, journal_mode='DELETE', synchronous='FULL',
+                   mmap_size=0, cache_size=-2000, busy_timeout=5000)
+
+    print(f'{args.readers} readers, {args.writers} writers, '
+          f'{args.seconds}s per run')
+    for name, pragmas in (('rollback journal', default), ('tuned WAL', tuned)):
+        app.config['SQLITE_PRAGMAS'] = pragmas
+        reset_database(args.people, 3)
+        counts = run_mixed_load(
+            args.readers, args.writers, args.seconds, args.people
+        )
+        print(f'{name:<20} {counts["reads"] / args.seconds:10.0f} reads/s '
+              f'{counts["writes"] / args.seconds:10.0f} writes/s '
+              f'{counts["errors"]:6d} errors')
+
+    app.config['SQLITE_PRAGMAS'] = tuned
+
+
+def bench_group_commit(args):
+    '''
+    Compares the throughput and latency of concurrent note creates written
+    one transaction each and through the group-commit writer
+    '''
+    # Importing server registers the API routes on the app
+    import server  # noqa: F401
+
+    def next_request():
+        person_id = random.randint(1, args.people)
+        return 'POST', f'/api/people/{person_id}/notes', {
+            'content': 'benchmark'
+        }
+
+    synchronous = app.config['SQLITE_PRAGMAS']['synchronous']
+    print(f'{args.clients} clients, {args.seconds}s per run, '
+          f'synchronous={synchronous}')
+    for name, enabled in (('one commit each', False), ('group commit', True)):
+        app.config['GROUP_COMMIT'] = enabled
+        reset_database(args.people, 0)
+        httpd = make_server('127.0.0.1', 0, app, threaded=True,
+                            request_handler=QuietRequestHandler)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        try:
+            latencies, errors = http_load(
+                f'http://127.0.0.1:{httpd.server_port}', next_request,
+                args.clients, args.seconds,
+            )
+        finally:
+            httpd.shutdown()
+        result = summarize(latencies, args.seconds, errors)
+        print(f'{name:<20} {result["requests_per_second"]:10.0f} creates/s '
+              f'p50 {result["p50_ms"]:7.2f} ms '
+              f'p99 {result["p99_ms"]:7.2f} ms '
+              f'{errors:6d} errors')
+
+    app.config['GROUP_COMMIT'] = False
+
+
+def bench_batch(args):
+    '''
+    Measures how many people and notes per second the batch endpoints
+    create, update and delete, in-process through the Flask test client
+    '''
+    # Importing server registers the API routes on the app
+    import server  # noqa: F401
+
+    client = app.test_client()
+    items = args.items
+    timings = {}
+
+    def post(name, url, changes):
+        started = time.perf_counter()
+        response = client.post(url, json=changes)
+        timings.setdefault(name, []).append(time.perf_counter() - started)
+        assert response.status_code == 200, response.get_data()
+        return response.get_json()
+
+    reset_database(args.people, 3)
+    for round_ in range(args.rounds):
+        url = '/api/people:batch'
+        lname = f'Round{round_}'
+        result = post('people create', url, {'create': [
+            {'fname': f'Batch{i}', 'lname': lname} for i in range(items)
+        ]})
+        ids = [item['person']['person_id'] for item in result['create']]
+        post('people update', url, {'update': [
+            {'person_id': person_id, 'fname': f'Renamed{i}', 'lname': lname}
+            for i, person_id in enumerate(ids)
+        ]})
+        post('people delete', url, {'delete': ids})
+
+        url = f'/api/people/{round_ % args.people + 1}/notes:batch'
+        result = post('notes create', url, {'create': [
+            {'content': f'Batch note {i}'} for i in range(items)
+        ]})
+        ids = [item['note']['note_id'] for item in result['create']]
+        post('notes update', url, {'update': [
+            {'note_id': note_id, 'content': 'Updated'} for note_id in ids
+        ]})
+        post('notes delete', url, {'delete': ids})
+
+    print(f'{items} items per batch, median of {args.rounds} rounds')
+    for name, seconds in timings.items():
+        print(f'{name:<16} {items / statistics.median(seconds):10.0f} '
+              f'items/s')
+
+
+def percentile(values, fraction):
+    '''
+    Returns the value below which the given fraction of the values fall
+
+    Parameters
+    ----------
+    values : list
+        The sorted values
+    fraction : float
+        The fraction, e.g. 0.99 for the 99th percentile
+
+    Returns
+    -------
+    float
+        The percentile, or 0 without values
+    '''
+    if not values:
+        return 0
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def http_load(url, next_request, clients, seconds):
+    '''
+    Sends requests to a running server from concurrent keep-alive clients
+
+    Parameters
+    ----------
+    url : str
+        Base URL of the server, e.g. http://localhost:5000
+    next_request : callable
+        Returns the (method, path, body) of the next request to send, body
+        being a JSON-friendly object or None
+    clients : int
+        Number of concurrent clients
+    seconds : float
+        How long to keep sending requests
+
+    Returns
+    -------
+    tuple
+        (sorted latencies in seconds of the successful requests, number of
+        failed requests)
+    '''
+    target = urlsplit(url)
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection(target.hostname, target.port)
+        timings, failed = [], 0
+        while time.perf_counter() < deadline:
+            method, path, body = next_request()
+            headers = {}
+            if body is not None:
+                body = json.dumps(body)
+                headers['Content-Type'] = 'application/json'
+            start = time.perf_counter()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failed += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection(
+                    target.hostname, target.port
+                )
+                continue
+            timings.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            latencies.extend(timings)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+
+    return latencies, errors[0]
+
+
+def bench_http(args):
+    '''
+    Sends GET requests to a running server from concurrent keep-alive
+    clients and reports the throughput and latency percentiles
+
+    Run it once against each way of serving the app (e.g. python server.py
+    and gunicorn with different worker settings) to compare them
+    '''
+    paths = args.path or ['/api/people', '/api/people/1', '/api/notes']
+    latencies, errors = http_load(
+        args.url,
+        lambda: ('GET', random.choice(paths), None),
+        args.clients,
+        args.seconds,
+    )
+
+    print(f'{args.url} {args.clients} clients, {args.seconds}s')
+    print(f'{len(latencies) / args.seconds:10.0f} requests/s '
+          f'p50 {percentile(latencies, 0.50) * 1000:8.2f} ms '
+          f'p99 {percentile(latencies, 0.99) * 1000:8.2f} ms '
+          f'{errors} errors')
+
+
+# Run in a fresh interpreter by bench_startup(): imports the app and serves
+# one request, then prints the seconds both took
+STARTUP_SCRIPT = '''
+import time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+client = server.connex_app.app.test_client()
+assert client.get('/api/people?limit=1').status_code == 200
+print(imported - start, time.perf_counter() - start)
+'''
+
+
+def time_startup(env):
+    '''
+    Starts a fresh interpreter that imports the app and serves one request
+
+    Parameters
+    ----------
+    env : dict
+        Environment of the new process
+
+    Returns
+    -------
+    tuple
+        Seconds until the app was imported, until the first request was
+        served (both measured in the child) and until the process exited
+    '''
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_SCRIPT], cwd=basedir, env=env,
+        check=True, stdout=subprocess.PIPE, universal_newlines=True,
+    ).stdout
+    total = time.perf_counter() - start
+    imported, served = map(float, output.split())
+
+    return imported, served, total
+
+
+def bench_startup(args):
+    '''
+    Compares the cold start of the app with and without the validated copy
+    of swagger.yml kept by spec_cache.py
+    '''
+    reset_database(10, 1)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        env = dict(os.environ, PEOPLE_SPEC_CACHE_DIR=cache_dir)
+        # Fill the cache before the timed runs
+        time_startup(env)
+
+        print(f'median of {args.repeat} starts')
+        for name, spec_cache_dir in (('validate swagger.yml', ''),
+                                     ('cached spec', cache_dir)):
+            env['PEOPLE_SPEC_CACHE_DIR'] = spec_cache_dir
+            runs = [time_startup(env) for _ in range(args.repeat)]
+            imported, served, total = (
+                statistics.median(column) for column in zip(*runs)
+            )
+            print(f'{name:<22} import {imported * 1000:8.1f} ms '
+                  f'first request {served * 1000:8.1f} ms '
+                  f'process {total * 1000:8.1f} ms')
+
+
+def bench_metrics(args):
+    '''
+    Compares the request throughput at different METRICS_SAMPLE_RATE
+    settings to measure the overhead of the instrumentation in metrics.py
+    '''
+    # Importing server registers the API routes on the app
+    import server  # noqa: F401
+
+    reset_database(100, 3)
+    client = app.test_client()
+    paths = ['/api/people', '/api/people/1', '/api/notes?limit=20']
+    rates = (0.0, 0.1, 1.0)
+
+    def run():
+        for i in range(args.requests):
+            client.get(paths[i % len(paths)])
+
+    # Alternate between the rates so drift (CPU frequency, other load)
+    # affects all of them alike, and compare the rates within each round
+    seconds = {rate: [] for rate in rates}
+    run()
+    for _ in range(args.rounds):
+        for rate in rates:
+            app.config['METRICS_SAMPLE_RATE'] = rate
+            start = time.perf_counter()
+            run()
+            seconds[rate].append(time.perf_counter() - start)
+
+    print(f'{args.requests} requests, median of {args.rounds} rounds, '
+          f'overhead vs rate 0 with the range over the rounds')
+    for rate in rates:
+        overheads = [
+            (rate_seconds / base_seconds - 1) * 100
+            for rate_seconds, base_seconds in zip(seconds[rate], seconds[0.0])
+        ]
+        print(f'sample rate {rate:<4} '
+              f'{args.requests / statistics.median(seconds[rate]):10.0f} '
+              f'requests/s {statistics.median(overheads):+6.1f}% '
+              f'({min(overheads):+.1f}% to {max(overheads):+.1f}%)')
+
+
+class Workload:
+    '''
+    Builds the requests of every API operation against the benchmark
+    database
+
+    Attributes
+    ----------
+    people : list
+        Ids of the people in the database
+    notes : list
+        (person_id, note_id) of the notes in the database
+    created_people : list
+        Ids of the people created by people.create, for people.delete
+    created_notes : list
+        (person_id, note_id) of the notes created by notes.create, for
+        notes.delete
+    '''
+    def __init__(self):
+        self.people = [
+            person_id for person_id, in db.session.query(Person.person_id)
+        ]
+        self.notes = [
+            tuple(row)
+            for row in db.session.query(Note.person_id, Note.note_id)
+        ]
+        db.session.remove()
+        self.created_people = []
+        self.created_notes = []
+        # Names must be unique, next() on a count is safe across threads
+        self.counter = itertools.count()
+
+    def name(self):
+        '''
+        Returns a first name nobody has yet
+        '''
+        return f'Bench{next(self.counter)}'
+
+    def operations(self):
+        '''
+        Returns the request builders of the operations, in the order they
+        are run
+
+        Returns
+        -------
+        dict
+            operationId -> function returning (method, path, body)
+        '''
+        def person():
+            return random.choice(self.people)
+
+        def note():
+            return random.choice(self.notes)
+
+        def content():
+            return ' '.join(random.choices(WORDS, k=8))
+
+        def pop(created):
+            # Deletes only run in-process, one at a time
+            return created.pop() if created else (0, 0)
+
+        return {
+            'people.read_all': lambda: ('GET', '/api/people?limit=100', None),
+            'people.read_one': lambda: (
+                'GET', f'/api/people/{person()}', None
+            ),
+            'notes.read_all': lambda: ('GET', '/api/notes?limit=100', None),
+            'notes.read_one': lambda: (
+                'GET', '/api/people/{}/notes/{}'.format(*note()), None
+            ),
+            'notes.search': lambda: (
+                'GET', f'/api/notes/search?q={random.choice(WORDS)}', None
+            ),
+            'people.stats': lambda: (
+                'GET', '/api/people/stats?limit=100', None
+            ),
+            'notes.stats': lambda: ('GET', '/api/notes/stats', None),
+            'changes.read': lambda: ('GET', '/api/changes?limit=100', None),
+            'people.create': lambda: ('POST', '/api/people', {
+                'fname': self.name(), 'lname': 'Benchmark',
+            }),
+            'people.update': lambda: ('PUT', f'/api/people/{person()}', {
+                'fname': self.name(), 'lname': 'Benchmark',
+            }),
+            'people.batch': lambda: ('POST', '/api/people:batch', {
+                'create': [
+                    {'fname': self.name(), 'lname': 'Benchmark'}
+                    for _ in range(10)
+                ],
+            }),
+            'notes.create': lambda: (
+                'POST', f'/api/people/{person()}/notes',
+                {'content': content()},
+            ),
+            'notes.update': lambda: (
+                'PUT', '/api/people/{}/notes/{}'.format(*note()),
+                {'content': content()},
+            ),
+            'notes.batch': lambda: (
+                'POST', f'/api/people/{person()}/notes:batch',
+                {'create': [{'content': content()} for _ in range(10)]},
+            ),
+            'notes.delete': lambda: (
+                'DELETE',
+                '/api/people/{}/notes/{}'.format(*pop(self.created_notes)),
+                None,
+            ),
+            'people.delete': lambda: (
+                'DELETE', f'/api/people/{pop(self.created_people)}', None
+            ),
+        }
+
+    def record(self, operation, response):
+        '''
+        Remembers what a create request made, for the delete requests
+        '''
+        if operation == 'people.create':
+            self.created_people.append(response.get_json()['person_id'])
+        elif operation == 'notes.create':
+            data = response.get_json()
+            self.created_notes.append(
+                (data['person']['person_id'], data['note_id'])
+            )
+
+
+def summarize(latencies, seconds, errors):
+    '''
+    Turns the latencies of a run into its results
+
+    Parameters
+    ----------
+    latencies : list
+        Sorted latencies in seconds of the successful requests
+    seconds : float
+        Duration of the run
+    errors : int
+        Number of failed requests
+
+    Returns
+    -------
+    dict
+        Throughput, latency percentiles in milliseconds and errors
+    '''
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'errors': errors,
+    }
+
+
+def run_in_process(workload, requests, memory_samples):
+    '''
+    Sends every operation's requests through the Flask test client
+
+    Returns
+    -------
+    dict
+        operationId -> results, see summarize(), plus the peak Python memory
+        allocated by one request
+    '''
+    client = app.test_client()
+    results = {}
+    for operation, next_request in workload.operations().items():
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            method, path, body = next_request()
+            start = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            elapsed = time.perf_counter() - start
+            if response.status_code >= 400:
+                errors += 1
+                continue
+            latencies.append(elapsed)
+            workload.record(operation, response)
+        total = time.perf_counter() - started
+        latencies.sort()
+        results[operation] = summarize(latencies, total, errors)
+
+        # Measured apart from the timings, tracing allocations is slow
+        peak = 0
+        if operation.endswith('.delete'):
+            memory_samples = 0
+        for _ in range(memory_samples):
+            method, path, body = next_request()
+            tracemalloc.start()
+            response = client.open(path, method=method, json=body)
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            workload.record(operation, response)
+        results[operation]['peak_alloc_kib'] = peak // 1024
+
+    return results
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    '''
+    Request handler of the benchmark server, which doesn't log every request
+    '''
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def run_over_http(workload, clients, seconds):
+    '''
+    Load tests every operation but the deletes with concurrent clients over
+    HTTP, against the app served by a threaded server in this process
+
+    Returns
+    -------
+    dict
+        operationId -> results, see summarize()
+    '''
+    server = make_server('127.0.0.1', 0, app, threaded=True,
+                         request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f'http://127.0.0.1:{server.server_port}'
+
+    results = {}
+    try:
+        for operation, next_request in workload.operations().items():
+            if operation.endswith('.delete'):
+                continue
+            latencies, errors = http_load(url, next_request, clients, seconds)
+            results[operation] = summarize(latencies, seconds, errors)
+    finally:
+        server.shutdown()
+
+    return results
+
+
+def current_commit():
+    '''
+    Returns the git commit the code being measured comes from, if any
+    '''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=basedir, check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(title, results):
+    '''
+    Prints the results of a run as a table
+    '''
+    print(title)
+    for operation, result in results.items():
+        memory = result.get('peak_alloc_kib')
+        print(f'  {operation:<16} {result["requests_per_second"]:9.0f} req/s '
+              f'p50 {result["p50_ms"]:8.2f} p95 {result["p95_ms"]:8.2f} '
+              f'p99 {result["p99_ms"]:8.2f} ms '
+              f'{result["errors"]:4d} errors'
+              + (f' {memory:6d} KiB peak' if memory is not None else ''))
+
+
+def bench_suite(args):
+    '''
+    Runs every operation of the API in-process and over HTTP against a
+    synthetic database, and saves the results as JSON
+    '''
+    # Importing server registers the API routes on the app
+    import server  # noqa: F401
+
+    reset_database(args.people, args.notes, args.skew)
+    workload = Workload()
+    print(f'{args.people} people, {len(workload.notes)} notes '
+          f'(skew {args.skew})')
+
+    results = {
+        'commit': current_commit(),
+        'time': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'settings': {
+            key: value for key, value in vars(args).items() if key != 'func'
+        },
+        'in_process': run_in_process(
+            workload, args.requests, args.memory_samples
+        ),
+    }
+    print_results('in-process', results['in_process'])
+
+    if args.clients:
+        results['http'] = run_over_http(workload, args.clients, args.seconds)
+        print_results(f'http, {args.clients} clients', results['http'])
+
+    results['max_rss_kib'] = resource.getrusage(
+        resource.RUSAGE_SELF
+    ).ru_maxrss
+    print(f'max RSS {results["max_rss_kib"]} KiB')
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f'results saved to {args.output}')
+
+
+def bench_compare(args):
+    '''
+    Compares two result files of the suite benchmark and flags regressions
+    '''
+    with open(args.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    with open(args.current) as current_file:
+        current = json.load(current_file)
+
+    print(f'{baseline.get("commit")} -> {current.get("commit")}')
+    regressions = 0
+    for mode in ('in_process', 'http'):
+        for operation, new in current.get(mode, {}).items():
+            old = baseline.get(mode, {}).get(operation)
+            if old is None or not old['p50_ms']:
+                continue
+            throughput = (
+                new['requests_per_second'] / old['requests_per_second'] - 1
+            ) * 100
+            latency = (new['p50_ms'] / old['p50_ms'] - 1) * 100
+            flag = ''
+            if latency > args.threshold or throughput < -args.threshold:
+                flag = '  REGRESSION'
+                regressions += 1
+            print(f'{mode:<10} {operation:<16} {throughput:+7.1f}% req/s '
+                  f'{latency:+7.1f}% p50{flag}')
+
+    # A non-zero exit status lets CI fail the build
+    sys.exit(1 if regressions else 0)
+
+
+def main():
+    '''
+    Parses the command line and runs the requested benchmark
+    '''
+    parser = argparse.ArgumentParser(description='Benchmark the people API')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serializers = commands.add_parser(
+        'serializers', help='Compare the serialization paths'
+    )
+    serializers.add_argument('--people', type=int, default=1)
+    serializers.add_argument('--notes', type=int, default=3)
+    serializers.add_argument('--repeat', type=int, default=2000)
+    serializers.set_defaults(func=bench_serializers)
+
+    concurrency = commands.add_parser(
+        'concurrency', help='Compare SQLite settings under concurrent load'
+    )
+    concurrency.add_argument('--readers', type=int, default=8)
+    concurrency.add_argument('--writers', type=int, default=2)
+    concurrency.add_argument('--seconds', type=float, default=5)
+    concurrency.add_argument('--people', type=int, default=1000)
+    concurrency.set_defaults(func=bench_concurrency)
+
+    group = commands.add_parser(
+        'group-commit', help='Compare note creates with and without group '
+                             'commit'
+    )
+    group.add_argument('--clients', type=int, default=32)
+    group.add_argument('--seconds', type=float, default=5)
+    group.add_argument('--people', type=int, default=1000)
+    group.set_defaults(func=bench_group_commit)
+
+    batch = commands.add_parser(
+        'batch', help='Measure the throughput of the batch endpoints'
+    )
+    batch.add_argument('--items', type=int, default=20000)
+    batch.add_argument('--rounds', type=int, default=3)
+    batch.add_argument('--people', type=int, default=1000)
+    batch.set_defaults(func=bench_batch)
+
+    load = commands.add_parser(
+        'http', help='Load test a running server over HTTP'
+    )
+    load.add_argument('--url', default='http://localhost:5000')
+    load.add_argument('--path', action='append',
+                      help='Path to request, may be repeated')
+    load.add_argument('--clients', type=int, default=32)
+    load.add_argument('--seconds', type=float, default=10)
+    load.set_defaults(func=bench_http)
+
+    startup = commands.add_parser(
+        'startup', help='Measure the time to the first served request'
+    )
+    startup.add_argument('--repeat', type=int, default=10)
+    startup.set_defaults(func=bench_startup)
+
+    overhead = commands.add_parser(
+        'metrics', help='Measure the overhead of the request metrics'
+    )
+    overhead.add_argument('--requests', type=int, default=1000)
+    overhead.add_argument('--rounds', type=int, default=15)
+    overhead.set_defaults(func=bench_metrics)
+
+    suite = commands.add_parser(
+        'suite', help='Run every API operation, save the results as JSON'
+    )
+    suite.add_argument('--people', type=int, default=1000)
+    suite.add_argument('--notes', type=float, default=3,
+                       help='Average number of notes per person')
+    suite.add_argument('--skew', type=float, default=1.0,
+                       help='0 spreads the notes evenly, 1 and above give '
+                            'a few people most of them')
+    suite.add_argument('--requests', type=int, default=200,
+                       help='In-process requests per operation')
+    suite.add_argument('--memory-samples', type=int, default=10)
+    suite.add_argument('--clients', type=int, default=8,
+                       help='Concurrent HTTP clients, 0 skips the HTTP runs')
+    suite.add_argument('--seconds', type=float, default=3,
+                       help='Duration of the HTTP run of each operation')
+    suite.add_argument('--output', help='File to save the results to')
+    suite.set_defaults(func=bench_suite)
+
+    compare = commands.add_parser(
+        'compare', help='Compare two result files of the suite benchmark'
+    )
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('--threshold', type=float, default=10,
+                         help='Percentage of change to flag')
+    compare.set_defaults(func=bench_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,29 @@
 # A utility program to create and build the database with the People data
+#
+# Usage:
+#     python build_database.py
+#     python build_database.py --import people.ndjson [--batch-size N]
+#     python build_database.py --import people.csv
+#
+# The second form bulk loads a large file instead of the PEOPLE data, see
+# read_ndjson() and read_csv() for the formats and bulk_load() for how
+#
+# The functions below are also used by benchmark.py to build databases of
+# synthetic people of any size
 
+import argparse
+import csv
+import json
 import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import groupby
 
-from config import db
-from datetime import datetime
-from models import Person, Note
+from bulk import CHUNK_SIZE
+from config import app, db
+from models import CHANGED_AT, Person, Note
 
 # Data to initialize database with
 PEOPLE = [
@@ -41,35 +60,502 @@ PEOPLE = [
     },
 ]
 
-# Delete database file if it exists currently
-# If you have to re-initialize the database to get a clean start, this makes
-# sure you're starting from scratch
-if os.path.exists('people.db'):
-    os.remove('people.db')
+# Words the synthetic notes are made of, so full-text search has something
+# realistic to match
+WORDS = (
+    'cool useful profound obvious easter eggs late delivering blog mini '
+    'application observation really maybe sort well thought anyone seen '
+    'people notes api database query index search timestamp person'
+).split()
 
-# Create the database
-db.create_all()
+# Settings used while bulk loading, see bulk_load()
+# - journal_mode=MEMORY keeps the rollback journal out of the file system
+# - synchronous=OFF never waits for the disk
+# - a 256 MiB page cache holds the indexes while they are built
+BULK_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'cache_size': -262144,
+}
 
-# Iterate over the PEOPLE structure and populate the database
-for person in PEOPLE:
-    p = Person(lname=person.get("lname"), fname=person.get("fname"))
 
-    # Add the notes for the person
-    for note in person.get("notes"):
-        content, timestamp = note
-        # NOTE: Working with the notes collection in Person p is like working
-        #       with any other list in Python. SQLAlchemy takes care of the
-        #       underlying one-to-many relationship
-        p.notes.append(
-            Note(
-                content=content,
-                timestamp=datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S"),
+def generate_people(count, notes_per_person=3, skew=0.0, seed=0):
+    '''
+    Generates synthetic people shaped like the PEOPLE data
+
+    Parameters
+    ----------
+    count : int
+        Number of people to generate
+    notes_per_person : float, optional
+        Average number of notes per person (default is 3)
+    skew : float, optional
+        How unevenly the notes are spread: 0 gives everybody about the same
+        number, 1 and above give a few people most of the notes, like the
+        Zipf distribution of real users (default is 0)
+    seed : int, optional
+        Seed of the random generator, so the same arguments always give the
+        same people (default is 0)
+
+    Returns
+    -------
+    list
+        Dicts with the fname, lname and notes of each person
+    '''
+    generator = random.Random(seed)
+
+    # Hand out every note to a person picked with a weight of 1 / rank^skew
+    weights = [1 / (rank ** skew) for rank in range(1, count + 1)]
+    note_counts = [0] * count
+    total_notes = int(count * notes_per_person)
+    for index in generator.choices(range(count), weights, k=total_notes):
+        note_counts[index] += 1
+
+    start = datetime(2019, 1, 1)
+    people = []
+    for i in range(count):
+        notes = []
+        for _ in range(note_counts[i]):
+            content = ' '.join(generator.choices(WORDS, k=8)).capitalize()
+            timestamp = start + timedelta(
+                seconds=generator.randrange(365 * 24 * 3600)
             )
+            notes.append((content, timestamp.strftime("%Y-%m-%d %H:%M:%S")))
+        # A few hundred last names, so lists have long runs of equal names
+        # like the (lname, person_id) ordering of people.read_all expects
+        people.append({
+            "fname": f"First{i}",
+            "lname": f"Last{i % 500:03d}",
+            "notes": notes,
+        })
+
+    return people
+
+
+def remove_database(path):
+    '''
+    Deletes an SQLite database file if it exists
+
+    In WAL mode (see SQLITE_PRAGMAS in config.py) SQLite keeps path-wal and
+    path-shm next to the database, which must not outlive it
+
+    Parameters
+    ----------
+    path : str
+        Path of the database file
+    '''
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def parse_note(note):
+    '''
+    Reads the content and timestamp of a note of the input data
+
+    Parameters
+    ----------
+    note : tuple or dict
+        (content, timestamp) like in PEOPLE, or a dict with these keys
+
+    Returns
+    -------
+    tuple
+        (content, timestamp as a datetime, or None when missing)
+    '''
+    if isinstance(note, dict):
+        content, timestamp = note.get('content'), note.get('timestamp')
+    else:
+        content, timestamp = note
+
+    # fromisoformat() reads "2019-01-06 22:17:54" like
+    # strptime("%Y-%m-%d %H:%M:%S") does, at a fraction of the cost
+    return content, datetime.fromisoformat(timestamp) if timestamp else None
+
+
+def insert_people(execute, people, batch_size=CHUNK_SIZE, report=None):
+    '''
+    Inserts people and their notes into an empty database
+
+    The rows are written with one executemany() per batch and the person ids
+    are assigned in the order of the input. Only one batch is held in memory,
+    so people can be a generator reading a file of any size
+
+    Parameters
+    ----------
+    execute : callable
+        Runs a statement, e.g. db.session.execute or Connection.execute
+    people : iterable
+        Dicts with the fname, lname and notes of each person, like PEOPLE
+    batch_size : int, optional
+        Number of rows written per executemany() (default is CHUNK_SIZE)
+    report : callable, optional
+        Called with the number of people and notes inserted so far after
+        every batch (default is None)
+
+    Returns
+    -------
+    tuple
+        Number of people and notes inserted
+    '''
+    now = datetime.utcnow()
+    person_rows, note_rows = [], []
+    people_count = notes_count = 0
+
+    def flush():
+        # People first, the notes of the batch point at them
+        if person_rows:
+            execute(Person.__table__.insert(), person_rows)
+        if note_rows:
+            execute(Note.__table__.insert(), note_rows)
+        person_rows.clear()
+        note_rows.clear()
+        if report is not None:
+            report(people_count, notes_count)
+
+    for person in people:
+        people_count += 1
+        person_rows.append({
+            'person_id': people_count,
+            'fname': person.get("fname"),
+            'lname': person.get("lname"),
+            'timestamp': now,
+        })
+        # NOTE: Each note row points at its person through person_id,
+        #       which is what p.notes.append() does for ORM objects
+        for note in person.get("notes") or ():
+            content, timestamp = parse_note(note)
+            notes_count += 1
+            note_rows.append({
+                'person_id': people_count,
+                'content': content,
+                'timestamp': timestamp or now,
+            })
+            if len(note_rows) >= batch_size:
+                flush()
+        if len(person_rows) + len(note_rows) >= batch_size:
+            flush()
+    flush()
+
+    return people_count, notes_count
+
+
+def populate(people):
+    '''
+    Inserts people and their notes into an empty database, see
+    insert_people()
+
+    Parameters
+    ----------
+    people : iterable
+        Dicts with the fname, lname and notes of each person, like PEOPLE
+    '''
+    insert_people(db.session.execute, people)
+
+    # Only when db.session.commit() is called are the rows made permanent
+    db.session.commit()
+
+
+def rebuild_search_index(execute):
+    '''
+    Rebuilds the full-text index of the notes from the note table
+
+    The triggers created with the tables index every note written while they
+    exist, rebuilding also backfills notes that were loaded without them
+
+    Parameters
+    ----------
+    execute : callable
+        Runs a statement, e.g. db.session.execute or Connection.execute
+    '''
+    execute("INSERT INTO note_fts (note_fts) VALUES ('rebuild')")
+
+
+def rebuild_stats(execute):
+    '''
+    Recomputes the note statistics of every person and the row counts of the
+    person and note tables from the tables themselves
+
+    Like the full-text index they are kept up to date by triggers, see
+    NOTE_STATS_DDL and TableVersion in models.py, recomputing backfills the
+    rows loaded without them
+
+    Parameters
+    ----------
+    execute : callable
+        Runs a statement, e.g. db.session.execute or Connection.execute
+    '''
+    # One probe of ix_note_person_id_timestamp per person
+    execute(
+        "UPDATE person SET "
+        "note_count = (SELECT COUNT(*) FROM note "
+        "WHERE note.person_id = person.person_id), "
+        "last_note_at = (SELECT MAX(timestamp) FROM note "
+        "WHERE note.person_id = person.person_id)"
+    )
+    for table in ('person', 'note'):
+        execute(
+            f"UPDATE table_version SET row_count = "
+            f"(SELECT COUNT(*) FROM {table}) WHERE name = '{table}'"
+        )
+
+
+def rebuild_change_log(execute):
+    '''
+    Rewrites the change log with one entry for every person and note
+
+    The triggers log every change made while they exist, see ChangeLog in
+    models.py, rewriting the log also covers the rows loaded without them.
+    The tombstones of deleted rows are dropped, so this is only meant for a
+    database that is being built
+
+    Parameters
+    ----------
+    execute : callable
+        Runs a statement, e.g. db.session.execute or Connection.execute
+    '''
+    execute("DELETE FROM change_log")
+    for table, key in (('person', 'person_id'), ('note', 'note_id')):
+        execute(
+            f"INSERT INTO change_log (table_name, row_id, action, changed_at) "
+            f"SELECT '{table}', {key}, 'upsert', {CHANGED_AT} FROM {table} "
+            f"ORDER BY {key}"
         )
 
-    db.session.add(p)
 
-# At this point no data is added to the database, but is saved within the
-# session object. Only when db.session.commit() is called does the session
-# interact with the database and commit the actions to it.
-db.session.commit()
+def read_ndjson(path):
+    '''
+    Reads people from a newline delimited JSON file, one person per line:
+
+        {"fname": "Doug", "lname": "Farrell",
+         "notes": [{"content": "Cool!", "timestamp": "2019-01-06 22:17:54"}]}
+
+    The notes may also be [content, timestamp] pairs like in PEOPLE
+
+    Parameters
+    ----------
+    path : str
+        Path of the file
+
+    Yields
+    ------
+    dict
+        The next person
+    '''
+    with open(path, encoding='utf-8') as people_file:
+        for line in people_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_csv(path):
+    '''
+    Reads people from a CSV file with one note per row:
+
+        fname,lname,content,timestamp
+        Doug,Farrell,"Cool, a mini-blogging application!",2019-01-06 22:17:54
+
+    The rows of a person must follow each other. A person without notes has
+    a single row with an empty content
+
+    Parameters
+    ----------
+    path : str
+        Path of the file
+
+    Yields
+    ------
+    dict
+        The next person
+    '''
+    with open(path, newline='', encoding='utf-8') as people_file:
+        rows = csv.DictReader(people_file)
+        for (fname, lname), person_rows in groupby(
+            rows, key=lambda row: (row['fname'], row['lname'])
+        ):
+            yield {
+                "fname": fname,
+                "lname": lname,
+                "notes": [
+                    (row['content'], row.get('timestamp'))
+                    for row in person_rows if row['content']
+                ],
+            }
+
+
+def set_pragmas(connection, pragmas):
+    '''
+    Runs PRAGMA statements on a connection
+
+    Parameters
+    ----------
+    connection : Connection
+        The connection to configure
+    pragmas : dict
+        Name and value of each pragma
+    '''
+    for name, value in pragmas.items():
+        connection.execute(f'PRAGMA {name} = {value}')
+
+
+def bulk_load(people, batch_size=10000, report=None):
+    '''
+    Loads a large number of people into the empty tables as fast as SQLite
+    allows
+
+    While loading:
+    - the secondary indexes and the triggers of the person and note tables
+      are dropped, and created again once all the rows are in. Building an
+      index over sorted existing rows is much cheaper than updating it for
+      every insert, and the triggers would otherwise index, version and count
+      every row one at a time (the full-text index and the stats are rebuilt
+      at the end instead)
+    - BULK_PRAGMAS trade durability for speed. A crash in the middle leaves
+      a broken database, which is fine for a file that is being built from
+      scratch anyway
+
+    Parameters
+    ----------
+    people : iterable
+        Dicts with the fname, lname and notes of each person, e.g. from
+        read_ndjson() or read_csv()
+    batch_size : int, optional
+        Number of rows written per executemany() (default is 10000)
+    report : callable, optional
+        Progress callback, see insert_people() (default is None)
+
+    Returns
+    -------
+    tuple
+        Number of people and notes inserted
+    '''
+    with db.engine.connect() as connection:
+        # Indexes backing a UNIQUE constraint have no SQL of their own and
+        # stay, so duplicates are still rejected
+        deferred = connection.execute(
+            "SELECT type, name, sql FROM sqlite_master "
+            "WHERE type IN ('index', 'trigger') AND sql IS NOT NULL "
+            "AND tbl_name IN ('person', 'note')"
+        ).fetchall()
+        for kind, name, _ in deferred:
+            connection.execute(f'DROP {kind.upper()} {name}')
+
+        set_pragmas(connection, BULK_PRAGMAS)
+        with connection.begin():
+            counts = insert_people(
+                connection.execute, people, batch_size, report
+            )
+            # The indexes first, rebuild_stats() probes the note index
+            # once per person. The triggers last, so the rows it updates
+            # aren't versioned one at a time
+            for kind, _, sql in deferred:
+                if kind == 'index':
+                    connection.execute(sql)
+            rebuild_search_index(connection.execute)
+            rebuild_stats(connection.execute)
+            rebuild_change_log(connection.execute)
+            for kind, _, sql in deferred:
+                if kind == 'trigger':
+                    connection.execute(sql)
+            # The versioning triggers didn't see the rows loaded
+            connection.execute(
+                "UPDATE table_version SET version = version + 1, "
+                "modified_at = CURRENT_TIMESTAMP"
+            )
+
+        # Back to the normal settings, journal_mode=WAL is stored in the file
+        set_pragmas(connection, {
+            name: value for name, value in app.config['SQLITE_PRAGMAS'].items()
+            if name in BULK_PRAGMAS
+        })
+
+    return counts
+
+
+def build_database(people=PEOPLE):
+    '''
+    Creates the tables of the configured database and fills them
+
+    Parameters
+    ----------
+    people : list, optional
+        The people to insert (default is PEOPLE)
+    '''
+    # Create the database
+    db.create_all()
+
+    populate(people)
+
+    rebuild_search_index(db.session.execute)
+    rebuild_stats(db.session.execute)
+    rebuild_change_log(db.session.execute)
+    db.session.commit()
+
+
+def print_progress(started):
+    '''
+    Builds a progress callback for bulk_load() printing the rows per second
+
+    Parameters
+    ----------
+    started : float
+        time.perf_counter() when the load started
+
+    Returns
+    -------
+    callable
+        The callback
+    '''
+    def report(people_count, notes_count):
+        elapsed = time.perf_counter() - started
+        rows = people_count + notes_count
+        print(f'\r{people_count:,} people, {notes_count:,} notes, '
+              f'{rows / elapsed:,.0f} rows/s', end='', file=sys.stderr)
+
+    return report
+
+
+def main():
+    '''
+    Parses the command line and builds the database
+    '''
+    parser = argparse.ArgumentParser(
+        description='Create the database, with the PEOPLE data or imported '
+                    'from a CSV or NDJSON file'
+    )
+    parser.add_argument('--import', dest='path',
+                        help='CSV or NDJSON file of people to load instead')
+    parser.add_argument('--format', choices=('csv', 'ndjson'),
+                        help='Format of the file (default from its suffix)')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='Rows written per executemany()')
+    args = parser.parse_args()
+
+    # Delete database file if it exists currently
+    # If you have to re-initialize the database to get a clean start, this
+    # makes sure you're starting from scratch
+    if db.engine.url.database:
+        remove_database(db.engine.url.database)
+
+    if args.path is None:
+        build_database()
+        return
+
+    file_format = args.format or (
+        'csv' if args.path.lower().endswith('.csv') else 'ndjson'
+    )
+    people = (read_csv if file_format == 'csv' else read_ndjson)(args.path)
+
+    db.create_all()
+    started = time.perf_counter()
+    people_count, notes_count = bulk_load(
+        people, args.batch_size, print_progress(started)
+    )
+    elapsed = time.perf_counter() - started
+    print(f'\nLoaded {people_count:,} people and {notes_count:,} notes in '
+          f'{elapsed:.1f}s ({(people_count + notes_count) / elapsed:,.0f} '
+          f'rows/s)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,361 @@
+# This module holds the helpers shared by the batch endpoints in people.py
+# and notes.py, which write many rows with one executemany() per statement
+# inside a single transaction
+
+import sqlite3
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from itertools import islice
+
+from flask import jsonify
+
+from config import db
+from models import Note, Person, SuspendedTrigger, TableVersion
+
+# SQLite limits how many bound parameters one statement may use (999 on
+# older builds), so IN (...) lists are sent in chunks of this size
+CHUNK_SIZE = 500
+
+# SQLite supports INSERT ... RETURNING from 3.35 on
+HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35)
+
+
+def chunked(items, size=CHUNK_SIZE):
+    '''
+    Splits an iterable into lists of at most size items
+
+    Parameters
+    ----------
+    items : iterable
+        The items to split
+    size : int, optional
+        Maximum number of items per chunk (default is CHUNK_SIZE)
+
+    Yields
+    ------
+    list
+        The next chunk of items
+    '''
+    iterator = iter(items)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def in_values(key):
+    '''
+    Builds key IN (:b_values) with an expanding parameter, which is bound
+    to the list of values when the statement runs
+
+    SQLAlchemy then compiles the statement with one parameter rather than
+    with one per value, which is most of the cost of a chunk of 500 values
+
+    Parameters
+    ----------
+    key : Column
+        The column to match against the values
+
+    Returns
+    -------
+    BinaryExpression
+        The condition, to run with the b_values parameter
+    '''
+    return key.in_(db.bindparam('b_values', expanding=True))
+
+
+def select_in(query, key, values):
+    '''
+    Runs a query filtered on key IN (values), in chunks
+
+    Parameters
+    ----------
+    query : Query
+        The query to filter, e.g. db.session.query(Person.person_id)
+    key : Column
+        The column to match against values
+    values : iterable
+        The values to look up
+
+    Returns
+    -------
+    list
+        All the matching rows
+    '''
+    rows = []
+    query = query.filter(in_values(key))
+    for chunk in chunked(set(values)):
+        rows.extend(query.params(b_values=chunk).all())
+
+    return rows
+
+
+def insert_returning(session, table, rows):
+    '''
+    Inserts rows and returns the primary key each of them was given
+
+    executemany() doesn't report the generated keys, so the rows are sent
+    as multi-row INSERT ... RETURNING statements of at most CHUNK_SIZE
+    parameters. RETURNING lists the rows in no guaranteed order, so they
+    are matched back by their values; rows with the same values are
+    interchangeable. Before SQLite 3.35 every row is inserted on its own
+    and reports its lastrowid
+
+    Parameters
+    ----------
+    session : Session
+        The session whose transaction writes the rows
+    table : Table
+        The table to insert into, with a single primary key column
+    rows : list
+        Dicts of the column values of each row, all with the same keys
+
+    Returns
+    -------
+    list
+        The primary key of each row, in the order of rows
+    '''
+    if not rows:
+        return []
+
+    key = table.primary_key.columns.values()[0]
+    if not HAS_RETURNING:
+        statement = table.insert()
+        return [
+            session.execute(statement, row).inserted_primary_key[0]
+            for row in rows
+        ]
+
+    # The statements are run as plain SQL with the values already converted
+    # for SQLite: compiling hundreds of bound parameters per statement costs
+    # more than the inserts. The rows come back in that form too
+    connection = session.connection()
+    names = list(rows[0])
+    converters = [
+        table.c[name].type.dialect_impl(connection.dialect)
+        .bind_processor(connection.dialect)
+        for name in names
+    ]
+    values = [
+        tuple(
+            convert(row[name]) if convert else row[name]
+            for name, convert in zip(names, converters)
+        )
+        for row in rows
+    ]
+    pending = defaultdict(deque)
+    for index, row in enumerate(values):
+        pending[row].append(index)
+
+    keys = [None] * len(rows)
+    placeholders = '(' + ', '.join('?' * len(names)) + ')'
+    for chunk in chunked(values, CHUNK_SIZE // len(names)):
+        statement = (
+            f'INSERT INTO {table.name} ({", ".join(names)}) '
+            f'VALUES {", ".join([placeholders] * len(chunk))} '
+            f'RETURNING {key.name}, {", ".join(names)}'
+        )
+        result = connection.execute(
+            statement, tuple(value for row in chunk for value in row)
+        )
+        for returned in result:
+            keys[pending[tuple(returned[1:])].popleft()] = returned[0]
+
+    return keys
+
+
+def item_error(status, detail):
+    '''
+    Builds the result of a batch item that was not written
+
+    Parameters
+    ----------
+    status : int
+        HTTP status code describing the problem
+    detail : str
+        Human readable description of the problem
+
+    Returns
+    -------
+    dict
+        The item result
+    '''
+    return {'status': status, 'detail': detail}
+
+
+def batch_response(create, update, delete):
+    '''
+    Builds the response of a batch endpoint
+
+    Connexion indents the JSON of the responses it serializes, and indented
+    output makes Python's json module use its pure Python encoder. For the
+    tens of thousands of items a batch may answer with, that costs more than
+    writing them, so the response is serialized here, compact, with the C
+    encoder
+
+    Parameters
+    ----------
+    create : list
+        The results of the items to create
+    update : list
+        The results of the items to update
+    delete : list
+        The results of the items to delete
+
+    Returns
+    -------
+    Response
+        The 200 response
+    '''
+    return jsonify(create=create, update=update, delete=delete)
+
+
+@contextmanager
+def suspended_triggers(session, *names):
+    '''
+    Switches groups of triggers off for the statements run in the block,
+    see SuspendedTrigger in models.py
+
+    The switch is part of the transaction: if the block raises, rolling the
+    transaction back (as the handlers do) also switches the triggers back on
+
+    Parameters
+    ----------
+    session : Session
+        The session whose transaction writes the batch
+    names : str
+        Names of the groups of triggers, e.g. 'note_stats'
+    '''
+    table = SuspendedTrigger.__table__
+    session.execute(table.insert(), [{'name': name} for name in names])
+    yield
+    session.execute(table.delete().where(table.c.name.in_(names)))
+
+
+def bump_versions(session, added):
+    '''
+    Counts the changes of a batch in table_version with one statement per
+    table, in place of the 'table_version' triggers, see TableVersion in
+    models.py
+
+    Parameters
+    ----------
+    session : Session
+        The session whose transaction wrote the rows
+    added : dict
+        Number of rows each changed table gained (negative when it lost
+        rows), by table name. Include the tables whose rows were only
+        updated with 0
+    '''
+    if not added:
+        return
+
+    table = TableVersion.__table__
+    session.execute(
+        table.update()
+        .where(table.c.name == db.bindparam('b_name'))
+        .values(
+            version=table.c.version + 1,
+            modified_at=db.func.current_timestamp(),
+            row_count=table.c.row_count + db.bindparam('b_added'),
+        ),
+        [{'b_name': name, 'b_added': count} for name, count in added.items()],
+    )
+
+
+# The full-text index of the notes, see NOTE_FTS_DDL in models.py. Writing
+# the name of the table into its own column is how FTS5 takes commands
+NOTE_FTS = db.table(
+    'note_fts', db.column('note_fts'), db.column('rowid'), db.column('content')
+)
+
+
+def index_notes(session, key, values):
+    '''
+    Adds notes to the full-text index with one statement per chunk, in
+    place of the 'note_fts' triggers. Call it after inserting or updating
+    them
+
+    Parameters
+    ----------
+    session : Session
+        The session whose transaction wrote the notes
+    key : Column
+        The column of the note table selecting the notes, e.g. note_id
+    values : list
+        The values of key to select
+    '''
+    note_table = Note.__table__
+    statement = NOTE_FTS.insert().from_select(
+        ['rowid', 'content'],
+        db.select([note_table.c.note_id, note_table.c.content])
+        .where(in_values(key)),
+    )
+    for chunk in chunked(values):
+        session.execute(statement, {'b_values': chunk})
+
+
+def unindex_notes(session, key, values):
+    '''
+    Removes notes from the full-text index with one statement per chunk, in
+    place of the 'note_fts' triggers. Call it before deleting or updating
+    them: the index needs the content it was built from
+
+    Parameters
+    ----------
+    session : Session
+        The session whose transaction writes the notes
+    key : Column
+        The column of the note table selecting the notes, e.g. note_id
+    values : list
+        The values of key to select
+    '''
+    note_table = Note.__table__
+    statement = NOTE_FTS.insert().from_select(
+        ['note_fts', 'rowid', 'content'],
+        db.select([
+            db.literal('delete'), note_table.c.note_id, note_table.c.content
+        ]).where(in_values(key)),
+    )
+    for chunk in chunked(values):
+        session.execute(statement, {'b_values': chunk})
+
+
+def update_note_stats(session, added):
+    '''
+    Updates the note_count and last_note_at of people with one statement per
+    batch, in place of the 'note_stats' triggers, see NOTE_STATS_DDL in
+    models.py
+
+    Parameters
+    ----------
+    session : Session
+        The session whose transaction wrote the notes
+    added : dict
+        Number of notes each person gained (negative when they lost notes),
+        by person_id. Include the people whose notes were only updated with
+        0, their newest note may have changed
+    '''
+    if not added:
+        return
+
+    table = Person.__table__
+    note_table = Note.__table__
+    # One probe of ix_note_person_id_timestamp per person
+    newest = (
+        db.select([db.func.max(note_table.c.timestamp)])
+        .where(note_table.c.person_id == table.c.person_id)
+        .as_scalar()
+    )
+    session.execute(
+        table.update()
+        .where(table.c.person_id == db.bindparam('b_person_id'))
+        .values(
+            note_count=table.c.note_count + db.bindparam('b_added'),
+            last_note_at=newest,
+        ),
+        [
+            {'b_person_id': person_id, 'b_added': count}
+            for person_id, count in added.items()
+        ],
+    )
@@ -0,0 +1,400 @@
+# This module holds the read-through cache of serialized people and notes
+# used by the read handlers in people.py and notes.py
+#
+# NOTE: Entries for single people and notes are invalidated precisely when
+#       they change: the SQLAlchemy session events at the bottom of this
+#       module collect the keys of every Person and Note a flush writes and
+#       delete them from the cache once the transaction commits. Handlers
+#       that write with Core statements (the batch endpoints) register their
+#       keys with invalidate_people()/invalidate_notes() themselves
+#
+#       A read that started before a commit can finish after its
+#       invalidation and would store what it read, the old data, for good.
+#       The read handlers therefore take a token() before they query and
+#       hand it to set(), which drops the value if its key was invalidated
+#       in between
+#
+#       List responses are cached under their ETag, which already contains the
+#       versions of the tables they are read from (see conditional.py), so a
+#       write makes the old entries unreachable and they simply age out.
+#       Every process reads those versions from the database, so the list
+#       entries stay right with several processes even in LocalCache; the
+#       entries of single people and notes don't, since a process only
+#       hears of its own commits. The CACHE_ENTRIES setting turns them off
+#       (see entry_cache below)
+#
+# The backend is chosen with the CACHE_BACKEND setting in config.py. A
+# multi-process deployment can plug in a shared store by implementing the
+# CacheBackend interface; LocalCache is the in-process implementation
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from importlib import import_module
+
+from bulk import select_in
+from config import app, db
+from models import Note, Person
+
+
+# Number of items of a list estimate_size() looks at
+SIZE_SAMPLE = 8
+
+
+def estimate_size(value):
+    '''
+    Estimates the length of the JSON encoding of a value
+
+    Encoding a whole list page only to measure it would serialize it a
+    second time on every cache miss, so long lists are measured from an
+    evenly spread sample of SIZE_SAMPLE items
+
+    Parameters
+    ----------
+    value : object
+        Dicts, lists, strings and scalars
+
+    Returns
+    -------
+    int
+        The estimated size in bytes
+    '''
+    if isinstance(value, dict):
+        return 2 + sum(
+            len(key) + 4 + estimate_size(item) for key, item in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        if len(value) > SIZE_SAMPLE:
+            sample = value[::len(value) // SIZE_SAMPLE][:SIZE_SAMPLE]
+            average = sum(map(estimate_size, sample)) / len(sample)
+            return 2 + int(len(value) * (average + 1))
+        return 2 + sum(estimate_size(item) + 1 for item in value)
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, datetime):
+        return 28
+
+    # Numbers, booleans and None
+    return 8
+
+
+class CacheBackend:
+    '''
+    Interface of the cache backends
+
+    Values are dicts of JSON-friendly data and datetimes. Callers must treat
+    the values they get back as read-only, since a backend may hand out the
+    stored object itself
+    '''
+    def get(self, key):
+        '''
+        Returns the value stored for key, or None on a miss
+        '''
+        raise NotImplementedError
+
+    def token(self):
+        '''
+        Returns a token to pass to set() for a value about to be read
+        '''
+        return None
+
+    def set(self, key, value, token=None):
+        '''
+        Stores value for key
+
+        With a token from token(), the value is dropped if key was deleted
+        since the token was taken: it may have been read before the write
+        that deleted it. A shared backend has to check this atomically with
+        the store
+        '''
+        raise NotImplementedError
+
+    def delete(self, keys):
+        '''
+        Removes the values stored for an iterable of keys
+        '''
+        raise NotImplementedError
+
+    def clear(self):
+        '''
+        Removes every value
+        '''
+        raise NotImplementedError
+
+    def stats(self):
+        '''
+        Returns a dict of counters describing the cache
+        '''
+        return {}
+
+
+class NullCache(CacheBackend):
+    '''
+    Backend that doesn't store anything, to turn the cache off
+    '''
+    def get(self, key):
+        return None
+
+    def set(self, key, value, token=None):
+        pass
+
+    def delete(self, keys):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LocalCache(CacheBackend):
+    '''
+    In-process LRU cache with a time to live and a memory cap
+
+    Attributes
+    ----------
+    ttl : float
+        Seconds an entry stays valid
+    max_entries : int
+        Maximum number of entries
+    max_bytes : int
+        Maximum total size of the entries, as estimated by estimate_size()
+
+    Tokens are generations: every delete() counts one, and records it for
+    the keys it deletes. The last max_entries deleted keys are remembered,
+    a token older than the ones forgotten can no longer be checked and its
+    set() is dropped
+    '''
+    def __init__(self, ttl=60, max_entries=10000, max_bytes=64 * 1024 ** 2):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._deleted = OrderedDict()
+        self._forgotten = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0,
+        }
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._counters['misses'] += 1
+                return None
+
+            value, size, expires = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+
+            return value
+
+    def token(self):
+        with self._lock:
+            return self._generation
+
+    def set(self, key, value, token=None):
+        size = estimate_size(value)
+        # Never let one huge value flush the whole cache
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            # Deleted while the value was being read
+            if token is not None and (
+                token < self._forgotten or self._deleted.get(key, -1) > token
+            ):
+                return
+
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self._bytes += size
+
+            # Evict the least recently used entries until we fit again
+            while (len(self._entries) > self.max_entries
+                   or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def delete(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+                self._deleted[key] = self._generation
+                self._deleted.move_to_end(key)
+
+            while len(self._deleted) > self.max_entries:
+                key, generation = self._deleted.popitem(last=False)
+                self._forgotten = generation
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            # Whatever was being read may predate the clear
+            self._generation += 1
+            self._deleted.clear()
+            self._forgotten = self._generation
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._counters, entries=len(self._entries), bytes=self._bytes
+            )
+
+    def _remove(self, key):
+        value, size, expires = self._entries.pop(key)
+        self._bytes -= size
+
+
+def load_backend():
+    '''
+    Creates the backend named by the CACHE_BACKEND setting
+
+    Returns
+    -------
+    CacheBackend
+        The configured backend
+    '''
+    module_name, class_name = app.config['CACHE_BACKEND'].rsplit('.', 1)
+    backend_class = getattr(import_module(module_name), class_name)
+
+    return backend_class(**app.config['CACHE_OPTIONS'])
+
+
+cache = load_backend()
+
+# The backend of the entries of single people and notes, which is cache
+# unless the CACHE_ENTRIES setting turns them off
+entry_cache = cache if app.config['CACHE_ENTRIES'] else NullCache()
+
+
+def person_key(person_id):
+    '''
+    Returns the cache key of a serialized person
+    '''
+    return f'person:{person_id}'
+
+
+def note_key(person_id, note_id):
+    '''
+    Returns the cache key of a serialized note
+    '''
+    return f'note:{person_id}:{note_id}'
+
+
+def list_key(etag):
+    '''
+    Returns the cache key of a list response with the given ETag
+    '''
+    return f'list:{etag}'
+
+
+def pending_keys(session):
+    '''
+    Returns the set of keys to invalidate when the session commits
+    '''
+    return session.info.setdefault('cache_invalidate', set())
+
+
+def invalidate_people(session, person_ids, notes=None):
+    '''
+    Invalidates people, and the notes embedding them, when session commits
+
+    Parameters
+    ----------
+    session : Session
+        The session the people are written with
+    person_ids : iterable
+        Ids of the people written
+    notes : iterable, optional
+        (person_id, note_id) of every note of the people, when the caller
+        has read them already (default is None, they are read here)
+    '''
+    person_ids = set(person_ids)
+    if not person_ids:
+        return
+
+    keys = pending_keys(session)
+    keys.update(person_key(person_id) for person_id in person_ids)
+
+    # Every note embeds its person, so their entries are stale too
+    if notes is None:
+        notes = select_in(
+            session.query(Note.person_id, Note.note_id),
+            Note.person_id,
+            person_ids,
+        )
+    keys.update(note_key(person_id, note_id) for person_id, note_id in notes)
+
+
+def invalidate_notes(session, notes):
+    '''
+    Invalidates notes, and the people embedding them, when session commits
+
+    Parameters
+    ----------
+    session : Session
+        The session the notes are written with
+    notes : iterable
+        (person_id, note_id) of the notes written
+    '''
+    keys = pending_keys(session)
+    for person_id, note_id in notes:
+        keys.add(note_key(person_id, note_id))
+        keys.add(person_key(person_id))
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def collect_written_objects(session, flush_context):
+    '''
+    Records the cache keys of every Person and Note the flush wrote
+    '''
+    people, notes = set(), set()
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Note):
+            # A note moved to another person is stale for both of them
+            history = db.inspect(obj).attrs.person_id.history
+            for person_id in (history.added or [obj.person_id]) + list(
+                history.deleted or []
+            ):
+                notes.add((person_id, obj.note_id))
+        elif isinstance(obj, Person):
+            # Appending to person.notes marks the person dirty too, but only
+            # a change of its own columns makes its notes stale
+            if session.is_modified(obj, include_collections=False):
+                people.add(obj.person_id)
+            else:
+                pending_keys(session).add(person_key(obj.person_id))
+
+    invalidate_notes(session, notes)
+    invalidate_people(session, people)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_committed(session):
+    '''
+    Deletes the entries written by the committed transaction from the cache
+    '''
+    keys = session.info.pop('cache_invalidate', None)
+    if keys:
+        cache.delete(keys)
+
+
+@db.event.listens_for(db.session, 'after_soft_rollback')
+def forget_rolled_back(session, previous_transaction):
+    '''
+    Forgets the keys of a transaction that was rolled back
+    '''
+    session.info.pop('cache_invalidate', None)
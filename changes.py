@@ -0,0 +1,110 @@
+# This module handles the change feed API definition: the people and notes
+# that changed since a client last synced its copy of them
+#
+# NOTE: The feed is read from the change_log table (see ChangeLog in
+#       models.py), which the triggers fill in the same transaction as every
+#       write, including the ones of the batch endpoints. It holds one entry
+#       per changed row, moved to the end of the log on every change, so a
+#       sync reads each row changed since its cursor once, and never the
+#       rows that didn't change
+#
+#       A client starts without a cursor, which returns every row, applies
+#       the changes in order and keeps the cursor of the response for the
+#       next sync. Deleted rows come back as tombstones (action "delete",
+#       data null) and stay in the log, so a client that syncs rarely still
+#       sees the delete
+
+from bulk import select_in
+from conditional import collection_validators, conditional
+from models import ChangeLog, Note, Person
+from pagination import decode_cursor, encode_cursor, next_link, page
+from serializers import dump_note, dump_person, format_timestamp
+
+# The representation of a changed row is the one of the list endpoints, with
+# the counts of a person instead of their notes and the person_id of a note
+# instead of its person
+NOTE_FIELDS = ('note_id', 'person_id', 'content', 'timestamp')
+
+
+def read(since=None, limit=100):
+    '''
+    This function responds to a request for /api/changes with the people and
+    notes changed since a cursor, in the order they changed
+
+    Parameters
+    ----------
+    since : str, optional
+        Cursor of the previous sync, taken from the cursor of its response
+        (default is None, every row)
+    limit : int, optional
+        Maximum number of changes to return (default is 100)
+
+    Returns
+    -------
+    dict
+        The changes and the cursor to pass as since in the next sync, with a
+        Link header pointing at the next page when there are more changes
+        already
+    304
+        If nothing changed since the caller's copy of this page
+    '''
+    etag, last_modified = collection_validators(('person', 'note'))
+    not_modified, headers = conditional(etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    change_id = 0
+    if since is not None:
+        (change_id,) = decode_cursor(since, int)
+
+    # A range of the change_log primary key
+    query = (
+        ChangeLog.query.filter(ChangeLog.change_id > change_id)
+        .order_by(ChangeLog.change_id)
+    )
+    entries, has_more = page(query, limit)
+
+    # The rows that still exist, read with one query per table
+    upserts = {'person': [], 'note': []}
+    for entry in entries:
+        if entry.action == 'upsert':
+            upserts[entry.table_name].append(entry.row_id)
+    people = {
+        person.person_id: person
+        for person in select_in(
+            Person.query, Person.person_id, upserts['person']
+        )
+    }
+    notes = {
+        note.note_id: note
+        for note in select_in(Note.query, Note.note_id, upserts['note'])
+    }
+
+    data = []
+    for entry in entries:
+        dump = None
+        if entry.table_name == 'person' and entry.row_id in people:
+            dump = dump_person(
+                people[entry.row_id], notes=False, counts=True
+            )
+        elif entry.table_name == 'note' and entry.row_id in notes:
+            dump = dump_note(
+                notes[entry.row_id], person=False, fields=NOTE_FIELDS
+            )
+        data.append({
+            'type': entry.table_name,
+            'id': entry.row_id,
+            # A row deleted since its entry was read is reported as
+            # deleted already, its tombstone comes later in the log
+            'action': 'upsert' if dump is not None else 'delete',
+            'changed_at': format_timestamp(entry.changed_at),
+            'data': dump,
+        })
+
+    if entries:
+        change_id = entries[-1].change_id
+    cursor = encode_cursor(change_id)
+    if has_more:
+        headers.update(next_link(since=cursor, limit=limit))
+
+    return {'changes': data, 'cursor': cursor}, 200, headers
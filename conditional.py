@@ -0,0 +1,252 @@
+# This module holds the helpers the read handlers in people.py and notes.py
+# use to answer HTTP conditional requests
+#
+# NOTE: Every response carries an ETag (and a Last-Modified date when we have
+#       one). A client polling the API sends them back in If-None-Match /
+#       If-Modified-Since and, when nothing changed, gets an empty 304 Not
+#       Modified response. The handlers work the validators out from a cheap
+#       query of timestamps or table versions before loading or serializing
+#       anything, so an unchanged poll costs a single small query
+#
+#       Writes take the ETag of the single resources back in If-Match, so a
+#       client only overwrites or deletes the version it read. The ETag is
+#       made of the values it was built from, which precondition() turns
+#       into a filter of the UPDATE or DELETE itself: a write against a
+#       stale version changes no row, with no read or lock beforehand
+
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import Response, abort, request
+from werkzeug.http import http_date, quote_etag
+
+from config import db
+from models import TableVersion
+
+
+def timestamp_token(timestamp):
+    '''
+    Turns a timestamp into a compact string for use in an ETag
+
+    Parameters
+    ----------
+    timestamp : datetime
+        The timestamp, may be None
+
+    Returns
+    -------
+    str
+        Microseconds since the epoch, or 0 for None
+    '''
+    if timestamp is None:
+        return '0'
+
+    delta = timestamp - datetime(1970, 1, 1)
+
+    return str(delta // delta.resolution)
+
+
+def parse_token(token, column):
+    '''
+    Turns a part of an ETag back into the value of a column
+
+    Parameters
+    ----------
+    token : str
+        The part of the ETag
+    column : ColumnElement
+        The column it was built from: a DateTime column turned into a
+        timestamp_token() or an integer column
+
+    Returns
+    -------
+    object
+        The datetime (None for the token of None) or int
+
+    Raises
+    ------
+    ValueError
+        If the token isn't a number
+    '''
+    if not token.isdigit():
+        raise ValueError(f'Invalid ETag token: {token}')
+
+    if isinstance(column.type, db.DateTime):
+        if token == '0':
+            return None
+        return datetime(1970, 1, 1) + timedelta(microseconds=int(token))
+
+    return int(token)
+
+
+def precondition(*columns):
+    '''
+    Turns the If-Match header of a write into a filter on the columns the
+    ETag of the resource is made of
+
+    Parameters
+    ----------
+    *columns : ColumnElement
+        The columns the parts of the ETag were built from, in order, see
+        parse_token()
+
+    Returns
+    -------
+    ColumnElement
+        A filter matching the versions named by If-Match, which matches
+        nothing if none of them is one of our ETags, or None without an
+        If-Match header (or with If-Match: *, which any existing version
+        satisfies)
+    '''
+    if_match = request.if_match
+    if not if_match or if_match.star_tag:
+        return None
+
+    versions = []
+    # If-Match uses the strong comparison, weak ETags never match
+    for etag in if_match.as_set():
+        tokens = etag.split('-')
+        if len(tokens) != len(columns):
+            continue
+        try:
+            values = [
+                parse_token(token, column)
+                for token, column in zip(tokens, columns)
+            ]
+        except ValueError:
+            continue
+        versions.append(db.and_(*[
+            column.is_(None) if value is None else column == value
+            for column, value in zip(columns, values)
+        ]))
+
+    return db.or_(*versions) if versions else db.false()
+
+
+def abort_unchanged(query, matches, message):
+    '''
+    Aborts a write of a single resource that changed no row
+
+    Parameters
+    ----------
+    query : Query
+        Query of the resource
+    matches : ColumnElement
+        The filter precondition() returned for the write, may be None
+    message : str
+        The message of the 404 response
+
+    Raises
+    ------
+    404
+        If the resource doesn't exist
+    412
+        If it exists, but not in a version named by If-Match
+    '''
+    db.session.rollback()
+    if matches is not None and db.session.query(query.exists()).scalar():
+        abort(412, 'The resource changed since the version in If-Match')
+
+    abort(404, message)
+
+
+def table_versions(*tables):
+    '''
+    Reads the versions of tables, see models.TableVersion
+
+    Parameters
+    ----------
+    *tables : str
+        Names of the tables
+
+    Returns
+    -------
+    list
+        (name, version, modified_at) of each table, in the order given
+    '''
+    rows = (
+        db.session.query(
+            TableVersion.name, TableVersion.version, TableVersion.modified_at
+        )
+        .filter(TableVersion.name.in_(tables))
+        .all()
+    )
+    by_name = {row.name: tuple(row) for row in rows}
+
+    return [by_name.get(table, (table, 0, None)) for table in tables]
+
+
+def collection_validators(tables, variant=''):
+    '''
+    Builds the ETag and Last-Modified of a list response
+
+    The ETag covers the full request path, so every page, filter and format
+    of a list gets its own
+
+    Parameters
+    ----------
+    tables : tuple
+        Names of the tables the list is read from
+    variant : str, optional
+        Anything else the response depends on, such as the format chosen from
+        the Accept header (default is empty)
+
+    Returns
+    -------
+    tuple
+        (etag, last_modified)
+    '''
+    versions = table_versions(*tables)
+    key = repr((request.full_path, variant, versions)).encode('utf-8')
+    etag = hashlib.md5(key).hexdigest()
+    modified = [modified_at for _, _, modified_at in versions if modified_at]
+
+    return etag, max(modified) if modified else None
+
+
+def conditional(etag, last_modified=None, vary=None):
+    '''
+    Checks the conditional headers of the request against a resource
+
+    If-None-Match wins over If-Modified-Since when both are sent, as
+    RFC 7232 requires, since the ETag also changes when rows are deleted
+
+    Parameters
+    ----------
+    etag : str
+        The current (unquoted) ETag of the resource
+    last_modified : datetime, optional
+        The UTC time the resource last changed (default is None)
+    vary : str, optional
+        The request headers the response depends on, e.g. 'Accept' when the
+        ETag has a variant per format. Sent as Vary with the 304 too, so
+        caches keep one copy per format (default is None)
+
+    Returns
+    -------
+    tuple
+        (response, headers) where response is a 304 response when the client
+        already has the current version and None otherwise, and headers are
+        the validators to send with the full response
+    '''
+    headers = {'ETag': quote_etag(etag)}
+    if vary is not None:
+        headers['Vary'] = vary
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(last_modified)
+
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified is not None:
+        # HTTP dates only have a resolution of one second
+        fresh = (
+            last_modified.replace(microsecond=0)
+            <= request.if_modified_since.replace(tzinfo=None)
+        )
+    else:
+        fresh = False
+
+    if fresh:
+        return Response(status=304, headers=headers), headers
+
+    return None, headers
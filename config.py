@@ -2,9 +2,15 @@
 # is used by both build_database.py and server.py
 
 import os
+import sqlite3
 import connexion
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+from metrics import MeteredConnection
 
 # This points to the directory the program is running in
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -20,17 +26,173 @@ app = connex_app.app
 # - causes SQLAlchemy to echo SQL statements to the console (useful to debug
 #   problems when building database programs)
 # - Set to False for production environments
+# - To see how many queries a request runs and how long they take without
+#   logging every statement, look at /metrics instead (see metrics.py), and
+#   at slow_queries.log for the statements that were slow
 app.config['SQLALCHEMY_ECHO'] = False
 # SQLALCHEMY_DATABASE_URI
 # - sqlite://// - tells SQLAlchemy to use SQLite as the database
 # - people.db - the database file
+# - PEOPLE_DATABASE_URL overrides it, e.g. to point benchmarks at a scratch
+#   database
 sqlite_url = "sqlite:////" + os.path.join(basedir, "people.db")
-app.config['SQLALCHEMY_DATABASE_URI'] = sqlite_url
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'PEOPLE_DATABASE_URL', sqlite_url
+)
+# SQLALCHEMY_ENGINE_OPTIONS
+# - Without a pool Flask-SQLAlchemy opens a new SQLite connection for every
+#   request, which throws away SQLite's page cache and re-runs the pragmas
+#   below each time. A QueuePool keeps pool_size connections open and allows
+#   max_overflow extra ones under load
+# - check_same_thread=False lets a pooled connection be used by whichever
+#   request thread checks it out next (only one thread uses it at a time)
+# - factory makes the connections count the rows requests fetch, see
+#   metrics.py
+# - In-memory databases get a StaticPool from Flask-SQLAlchemy instead
+if ':memory:' not in app.config['SQLALCHEMY_DATABASE_URI']:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'poolclass': QueuePool,
+        'pool_size': int(os.environ.get('PEOPLE_DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('PEOPLE_DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(os.environ.get('PEOPLE_DB_POOL_TIMEOUT', 30)),
+        'connect_args': {
+            'check_same_thread': False,
+            'factory': MeteredConnection,
+        },
+    }
+# SQLITE_PRAGMAS
+# - Run on every new SQLite connection, see set_sqlite_pragmas() below
+# - journal_mode=WAL lets readers keep reading while a writer commits,
+#   instead of every request queueing behind the database lock
+# - synchronous=NORMAL only fsyncs the WAL at checkpoints, which is safe in
+#   WAL mode (a power cut can lose the last commits, never corrupt the file)
+# - mmap_size reads the database through memory mapped I/O (bytes)
+# - cache_size is the page cache per connection (negative means KiB)
+# - busy_timeout makes a writer wait for the lock (milliseconds) instead of
+#   failing straight away with "database is locked"
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('PEOPLE_SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('PEOPLE_SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.environ.get('PEOPLE_SQLITE_MMAP_SIZE', 268435456)),
+    'cache_size': int(os.environ.get('PEOPLE_SQLITE_CACHE_SIZE', -65536)),
+    'busy_timeout': int(os.environ.get('PEOPLE_SQLITE_BUSY_TIMEOUT', 5000)),
+}
 # SQLALCHEMY_TRACK_MODIFICATIONS = False
 # - Turns off SQLAlchemy event system
 # - The event system generates events useful in event-driven programs but adds
 #   significant overhead (since this isn't an event-driven program, turn off)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# CACHE_BACKEND, CACHE_OPTIONS
+# - The class storing the read-through cache of serialized people and notes
+#   (see cache.py) and the keyword arguments it is created with
+# - cache.LocalCache keeps the entries in each process; point
+#   PEOPLE_CACHE_BACKEND at a class talking to a shared store when running
+#   several processes, or at cache.NullCache to turn the cache off
+# CACHE_ENTRIES
+# - Whether single people and notes are cached, besides the list pages
+# - A process never hears of the writes of the others, so with several
+#   processes LocalCache would serve stale people and notes. gunicorn.conf.py
+#   turns them off (PEOPLE_CACHE_ENTRIES=0) unless PEOPLE_CACHE_BACKEND is
+#   set. The list pages are cached under the table versions in the database
+#   and stay right in every process
+app.config['CACHE_BACKEND'] = os.environ.get(
+    'PEOPLE_CACHE_BACKEND', 'cache.LocalCache'
+)
+app.config['CACHE_ENTRIES'] = (
+    os.environ.get('PEOPLE_CACHE_ENTRIES', '1') == '1'
+)
+app.config['CACHE_OPTIONS'] = {
+    'ttl': float(os.environ.get('PEOPLE_CACHE_TTL', 60)),
+    'max_entries': int(os.environ.get('PEOPLE_CACHE_MAX_ENTRIES', 10000)),
+    'max_bytes': int(os.environ.get('PEOPLE_CACHE_MAX_BYTES', 64 * 1024 ** 2)),
+}
+# EVENTS_BACKEND
+# - The class carrying the note events of /api/notes/stream (see events.py)
+#   to the subscribers of every process
+# - events.LocalBackend only reaches the subscribers of the process the
+#   note was written in; point PEOPLE_EVENTS_BACKEND at a class talking to
+#   a shared channel when running several processes
+# EVENTS_BUFFER
+# - Number of recent events each process keeps, so a reconnecting browser
+#   gets the ones it missed
+# EVENTS_HEARTBEAT
+# - Seconds between the comments sent on an idle stream, which keep proxies
+#   and load balancers from closing it
+# EVENTS_STREAM
+# - Whether /api/notes/stream is served, and the home page subscribes to it
+# - Every open stream holds a connection for as long as the page is shown.
+#   gunicorn.conf.py turns it off (PEOPLE_EVENTS_STREAM=0) when its
+#   workers would spend a process or a thread on each one; the stream then
+#   answers 204, which tells browsers not to reconnect
+app.config['EVENTS_BACKEND'] = os.environ.get(
+    'PEOPLE_EVENTS_BACKEND', 'events.LocalBackend'
+)
+app.config['EVENTS_BUFFER'] = int(os.environ.get('PEOPLE_EVENTS_BUFFER', 1000))
+app.config['EVENTS_HEARTBEAT'] = float(
+    os.environ.get('PEOPLE_EVENTS_HEARTBEAT', 15)
+)
+app.config['EVENTS_STREAM'] = (
+    os.environ.get('PEOPLE_EVENTS_STREAM', '1') == '1'
+)
+# GROUP_COMMIT
+# - Set PEOPLE_GROUP_COMMIT=1 to have the notes created by concurrent
+#   requests written together, one transaction per batch (see
+#   group_commit.py). Off by default, each create commits on its own
+# GROUP_COMMIT_WINDOW_MS
+# - How long the writer waits for more notes after the first one of a batch
+#   (milliseconds), the most a create waits on top of the write itself
+# GROUP_COMMIT_MAX_ITEMS
+# - A batch is written as soon as it has this many notes
+app.config['GROUP_COMMIT'] = os.environ.get('PEOPLE_GROUP_COMMIT', '') == '1'
+app.config['GROUP_COMMIT_WINDOW_MS'] = float(
+    os.environ.get('PEOPLE_GROUP_COMMIT_WINDOW_MS', 2)
+)
+app.config['GROUP_COMMIT_MAX_ITEMS'] = int(
+    os.environ.get('PEOPLE_GROUP_COMMIT_MAX_ITEMS', 100)
+)
+# METRICS_SAMPLE_RATE
+# - Fraction of the requests whose timings, query counts and rows fetched
+#   are recorded for /metrics (see metrics.py). Every request is counted
+# METRICS_SERVER_TIMING
+# - Also send the numbers of sampled requests back in a Server-Timing header
+app.config['METRICS_SAMPLE_RATE'] = float(
+    os.environ.get('PEOPLE_METRICS_SAMPLE_RATE', 0.1)
+)
+app.config['METRICS_SERVER_TIMING'] = (
+    os.environ.get('PEOPLE_METRICS_SERVER_TIMING', '') == '1'
+)
+# SLOW_QUERY_THRESHOLD
+# - Queries taking longer than this many seconds are logged with their
+#   parameters and query plan (see slow_queries.py). 0 logs every query,
+#   None (PEOPLE_SLOW_QUERY_MS set to an empty value) turns the log off
+# SLOW_QUERY_LOG, SLOW_QUERY_LOG_MAX_BYTES, SLOW_QUERY_LOG_BACKUPS
+# - The file the slow queries are written to, the size at which it is
+#   rotated and how many rotated files are kept
+slow_query_ms = os.environ.get('PEOPLE_SLOW_QUERY_MS', '100')
+app.config['SLOW_QUERY_THRESHOLD'] = (
+    float(slow_query_ms) / 1000 if slow_query_ms else None
+)
+app.config['SLOW_QUERY_LOG'] = os.environ.get(
+    'PEOPLE_SLOW_QUERY_LOG', os.path.join(basedir, 'slow_queries.log')
+)
+app.config['SLOW_QUERY_LOG_MAX_BYTES'] = int(
+    os.environ.get('PEOPLE_SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 ** 2)
+)
+app.config['SLOW_QUERY_LOG_BACKUPS'] = int(
+    os.environ.get('PEOPLE_SLOW_QUERY_LOG_BACKUPS', 5)
+)
+# RECORD_TRAFFIC
+# - File the API requests are recorded to for replay.py (see recorder.py),
+#   {pid} in the name is replaced by the id of the process
+# - Empty (the default) doesn't record anything
+app.config['RECORD_TRAFFIC'] = os.environ.get('PEOPLE_RECORD_TRAFFIC', '')
+# SPEC_CACHE_DIR
+# - Where spec_cache.py keeps the validated copy of swagger.yml that
+#   server.py loads at startup instead of validating the spec again
+# - An empty value turns the cache off
+app.config['SPEC_CACHE_DIR'] = os.environ.get(
+    'PEOPLE_SPEC_CACHE_DIR', os.path.join(basedir, '.spec_cache')
+)
 
 # Create the SQLAlchemy db instance
 # This initializes SQLAlchemy by passing the app configuration information
@@ -43,3 +205,24 @@ db = SQLAlchemy(app)
 # This allows Marshmallow to introspect the SQLAlchemy components attached to
 # the app (this is why it is initialized after SQLAlchemy)
 ma = Marshmallow(app)
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    '''
+    Applies the SQLITE_PRAGMAS settings to every new SQLite connection
+
+    Parameters
+    ----------
+    dbapi_connection : sqlite3.Connection
+        The connection that was just opened
+    connection_record : _ConnectionRecord
+        The pool's record of the connection (unused)
+    '''
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
@@ -0,0 +1,260 @@
+# This module pushes the changes to the notes to live dashboards as
+# Server-Sent Events (SSE) on /api/notes/stream
+#
+# NOTE: notes.py publishes an event after each write has committed, and
+#       people.py for the notes deleted with their person. The event goes to
+#       the backend named by the EVENTS_BACKEND setting in config.py, which
+#       hands it to the Broker of every process subscribed to it.
+#       LocalBackend only reaches the process it runs in; a deployment with
+#       several processes plugs in a backend implementing the EventBackend
+#       interface on top of a shared channel (e.g. Redis pub/sub), with one
+#       listener thread per process
+#
+#       The Broker keeps the last EVENTS_BUFFER events of the process in one
+#       ring buffer shared by all its subscribers. A subscriber is only a
+#       generator remembering the id of the last event it sent, blocked on
+#       the broker's condition while there is nothing new. It holds no
+#       database connection, the request's session is released as soon as
+#       the stream starts. With gunicorn's gevent worker class (see
+#       gunicorn.conf.py) the generators are greenlets, so thousands of idle
+#       dashboards cost a few KiB each instead of a thread
+#
+#       Event ids are "<process>-<sequence>". A browser reconnecting with
+#       Last-Event-ID gets the events it missed, as long as it reaches the
+#       same process and they are still in the buffer. Otherwise it gets a
+#       "reset" event, telling it to read the notes again
+
+import json
+import os
+import threading
+import uuid
+from collections import deque
+from importlib import import_module
+
+from flask import Response
+
+from config import app
+
+# Milliseconds a browser waits before reconnecting a dropped stream
+RETRY_MS = 3000
+
+
+class EventBackend:
+    '''
+    Interface of the event backends, which carry the published events to
+    the broker of every process
+    '''
+    def publish(self, kind, data):
+        '''
+        Sends an event to every listener, in every process
+        '''
+        raise NotImplementedError
+
+    def listen(self, deliver):
+        '''
+        Calls deliver(kind, data) with every event published from now on
+        '''
+        raise NotImplementedError
+
+
+class LocalBackend(EventBackend):
+    '''
+    Event backend delivering the events within the current process
+    '''
+    def __init__(self):
+        self._listeners = []
+
+    def publish(self, kind, data):
+        for deliver in self._listeners:
+            deliver(kind, data)
+
+    def listen(self, deliver):
+        self._listeners.append(deliver)
+
+
+class Broker:
+    '''
+    Fans the events of a backend out to the subscribers of this process
+
+    Attributes
+    ----------
+    size : int
+        Number of events kept for subscribers that are behind
+    '''
+    def __init__(self, size):
+        self.size = size
+        self._pid = None
+
+    def _reset(self):
+        '''
+        Starts an empty buffer, in a new process
+
+        The lock is created here rather than in __init__, so a gevent worker
+        forked from a preloading master gets a lock its greenlets can wait
+        on (gevent patches threading after the fork)
+        '''
+        self._process = uuid.uuid4().hex[:8]
+        self._sequence = 0
+        self._frames = deque(maxlen=self.size)
+        self._condition = threading.Condition()
+        # Set last, so a concurrent request never sees the new pid with the
+        # buffer of the parent process, or none at all
+        self._pid = os.getpid()
+
+    def _check_process(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def deliver(self, kind, data):
+        '''
+        Adds an event to the buffer and wakes the subscribers up
+
+        The event is formatted as an SSE frame once here, the subscribers
+        only copy the text
+        '''
+        self._check_process()
+        payload = json.dumps(data, separators=(',', ':'))
+        with self._condition:
+            self._sequence += 1
+            self._frames.append((
+                self._sequence,
+                f'id: {self._process}-{self._sequence}\n'
+                f'event: {kind}\ndata: {payload}\n\n',
+            ))
+            self._condition.notify_all()
+
+    def position(self, last_event_id):
+        '''
+        Finds where a subscriber resumes from
+
+        Parameters
+        ----------
+        last_event_id : str
+            The Last-Event-ID sent by a reconnecting browser, or None
+
+        Returns
+        -------
+        tuple
+            (sequence, resumed) where sequence is the sequence number of the
+            last event the subscriber has, and resumed tells whether it can
+            get the events it missed
+        '''
+        self._check_process()
+        with self._condition:
+            process, _, sequence = (last_event_id or '').partition('-')
+            if process == self._process and sequence.isdigit():
+                sequence = int(sequence)
+                oldest = self._frames[0][0] if self._frames else 1
+                if oldest - 1 <= sequence <= self._sequence:
+                    return sequence, True
+
+            return self._sequence, last_event_id is None
+
+    def wait(self, sequence, timeout):
+        '''
+        Waits for the events after a sequence number
+
+        Parameters
+        ----------
+        sequence : int
+            Sequence number of the last event the subscriber has
+        timeout : float
+            Seconds to wait for an event
+
+        Returns
+        -------
+        tuple
+            (frames, sequence) of the SSE frames of the new events and the
+            sequence number of the last one. frames is empty after the
+            timeout and None when the subscriber fell behind the buffer
+        '''
+        with self._condition:
+            if self._sequence == sequence:
+                self._condition.wait(timeout)
+
+            frames = [
+                frame for number, frame in self._frames if number > sequence
+            ]
+            if frames and self._frames[0][0] > sequence + 1:
+                return None, self._sequence
+
+            return frames, self._sequence
+
+
+def load_backend():
+    '''
+    Creates the backend named by the EVENTS_BACKEND setting
+
+    Returns
+    -------
+    EventBackend
+        The configured backend
+    '''
+    module_name, class_name = app.config['EVENTS_BACKEND'].rsplit('.', 1)
+    backend_class = getattr(import_module(module_name), class_name)
+
+    return backend_class()
+
+
+backend = load_backend()
+broker = Broker(app.config['EVENTS_BUFFER'])
+backend.listen(broker.deliver)
+
+
+def publish(kind, data):
+    '''
+    Publishes an event to every subscriber
+
+    Only call this once the change is committed, so nobody hears of a write
+    that is rolled back
+
+    Parameters
+    ----------
+    kind : str
+        Name of the event, e.g. note.created
+    data : dict
+        JSON-friendly content of the event
+    '''
+    backend.publish(kind, data)
+
+
+def event_stream(last_event_id=None):
+    '''
+    Builds the SSE response of a subscriber
+
+    Parameters
+    ----------
+    last_event_id : str, optional
+        The Last-Event-ID header of a reconnecting browser (default is None)
+
+    Returns
+    -------
+    Response
+        The streaming response, which sends the events as they come and a
+        comment every EVENTS_HEARTBEAT seconds to keep proxies from closing
+        an idle connection
+    '''
+    heartbeat = app.config['EVENTS_HEARTBEAT']
+    sequence, resumed = broker.position(last_event_id)
+
+    def generate():
+        position = sequence
+        yield f'retry: {RETRY_MS}\n\n'
+        if not resumed:
+            yield 'event: reset\ndata: {}\n\n'
+        while True:
+            frames, position = broker.wait(position, heartbeat)
+            if frames is None:
+                yield 'event: reset\ndata: {}\n\n'
+            elif frames:
+                yield ''.join(frames)
+            else:
+                yield ': keep-alive\n\n'
+
+    # Not wrapped in stream_with_context(): the stream doesn't need the
+    # request, and ending it now returns the database connection to the pool
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        # Stops nginx from buffering the events
+        'X-Accel-Buffering': 'no',
+    })
@@ -0,0 +1,113 @@
+# This module holds the helpers used by the list endpoints in people.py and
+# notes.py to turn their filter and fields query parameters into SQL
+#
+# NOTE: The filters compile to comparisons an index can answer:
+#       - a prefix becomes a range, lname >= 'Far' AND lname < 'Fas', which
+#         SQLite reads from ix_person_lname like any other range. LIKE
+#         'Far%' would scan, since SQLite only uses an index for LIKE when
+#         the column is declared COLLATE NOCASE
+#       - since/until become a range of ix_note_timestamp, or of
+#         ix_note_person_id_timestamp together with person_id
+#
+#       The fields parameter limits the columns in the SELECT with
+#       load_only(), so a list of names doesn't read every note's content.
+#       The columns the list is sorted by are always loaded, the cursor of
+#       the next page is built from them
+
+from datetime import datetime
+
+from flask import abort
+
+from config import db
+
+
+def prefix_filter(column, prefix):
+    '''
+    Builds the filter selecting the rows whose column starts with a prefix
+
+    Parameters
+    ----------
+    column : Column
+        The string column to filter on
+    prefix : str
+        The prefix, case sensitive
+
+    Returns
+    -------
+    BooleanClauseList
+        column >= prefix AND column < the first string after every string
+        starting with the prefix
+    '''
+    # Strings starting with the prefix sort before the prefix with its last
+    # character incremented. The largest code point can't be incremented,
+    # the string then only has a lower bound
+    stem = prefix.rstrip(chr(0x10FFFF))
+    if not stem:
+        return column >= prefix
+
+    code = ord(stem[-1]) + 1
+    # Surrogates can't be stored as UTF-8, skip over them
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    upper = stem[:-1] + chr(code)
+
+    return db.and_(column >= prefix, column < upper)
+
+
+def parse_timestamp(value, name):
+    '''
+    Parses the timestamp given to a filter
+
+    Parameters
+    ----------
+    value : str
+        ISO 8601 date or date and time in UTC, e.g. 2019-01-07 or
+        2019-01-07T22:17:54
+    name : str
+        Name of the query parameter, for the error message
+
+    Returns
+    -------
+    datetime
+        The timestamp, or None when value is None
+
+    Raises
+    ------
+    400
+        If the value isn't an ISO 8601 timestamp
+    '''
+    if value is None:
+        return None
+
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f'Invalid {name} timestamp: {value}')
+
+
+def load_columns(model, fields, required=()):
+    '''
+    Names the columns to load for a sparse fieldset
+
+    Parameters
+    ----------
+    model : type
+        The model the list is made of
+    fields : list
+        The fields the caller asked for, or None for all of them
+    required : tuple, optional
+        Columns needed whatever the fields are, such as the sort key
+        (default is empty)
+
+    Returns
+    -------
+    list
+        The model attributes to pass to load_only(), or None to load all
+        of them
+    '''
+    if fields is None:
+        return None
+
+    names = dict.fromkeys(list(required) + list(fields))
+
+    return [getattr(model, name) for name in names]
@@ -0,0 +1,135 @@
+# This module holds the group-commit writer notes.create uses when the
+# GROUP_COMMIT setting is on
+#
+# NOTE: Without it every created note is its own transaction, and SQLite
+#       runs one write transaction at a time, so concurrent creates queue on
+#       the database lock and each pays for its own commit (an fsync with
+#       synchronous=FULL). With it the request threads only queue their
+#       note, and one writer thread per process writes everything queued
+#       within GROUP_COMMIT_WINDOW_MS, or GROUP_COMMIT_MAX_ITEMS notes, in a
+#       single transaction
+#
+#       A request waits for the commit of its batch before it answers, so a
+#       201 means the note is stored exactly as durably as with the direct
+#       write: with synchronous=NORMAL (the default in config.py) a power cut
+#       can still lose the last commits, with synchronous=FULL it can't. The
+#       price is up to GROUP_COMMIT_WINDOW_MS of added latency per create
+#
+#       If the batch fails, every request in it gets the error, nothing of
+#       the batch is written
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from config import app, db
+
+
+class GroupCommitWriter:
+    '''
+    Queues the writes of concurrent requests and hands them in batches to a
+    function writing each batch in one transaction
+
+    Attributes
+    ----------
+    write : callable
+        Called with a list of items in the writer thread, inside an app
+        context. It writes and commits them and returns the result of each
+        item, in the same order
+    window : float
+        Seconds the writer waits for more items after the first one
+    max_items : int
+        Maximum number of items per batch
+    '''
+    def __init__(self, write, window, max_items):
+        self.write = write
+        self.window = window
+        self.max_items = max_items
+        self._state = (None, None)
+
+    def _queue(self):
+        '''
+        Returns the queue of the writer of this process, starting it first in
+        a new process (a forked gunicorn worker doesn't inherit the thread)
+
+        Two requests starting it at the same time each start a writer, which
+        is harmless: the queue of the one that lost stays served by its own
+        thread
+        '''
+        pid, items = self._state
+        if pid != os.getpid():
+            items = queue.Queue()
+            thread = threading.Thread(
+                target=self._run, args=(items,), daemon=True,
+                name='group-commit',
+            )
+            thread.start()
+            self._state = (os.getpid(), items)
+
+        return items
+
+    def submit(self, item):
+        '''
+        Queues an item and waits until its batch is committed
+
+        Parameters
+        ----------
+        item : object
+            What to write, as expected by the write function
+
+        Returns
+        -------
+        object
+            The result the write function returned for the item
+
+        Raises
+        ------
+        Exception
+            Whatever the write function raised for the batch
+        '''
+        future = Future()
+        self._queue().put((item, future))
+
+        return future.result()
+
+    def _collect(self, items):
+        '''
+        Waits for the next batch: the first queued item and whatever else
+        arrives within the window, up to max_items
+        '''
+        batch = [items.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_items:
+            remaining = deadline - time.monotonic()
+            try:
+                # Take what is already queued even once the window is over
+                if remaining > 0:
+                    batch.append(items.get(timeout=remaining))
+                else:
+                    batch.append(items.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self, items):
+        '''
+        Body of the writer thread
+        '''
+        while True:
+            batch = self._collect(items)
+            futures = [future for item, future in batch]
+            with app.app_context():
+                try:
+                    results = self.write([item for item, future in batch])
+                except Exception as error:
+                    db.session.rollback()
+                    for future in futures:
+                        future.set_exception(error)
+                else:
+                    for future, result in zip(futures, results):
+                        future.set_result(result)
+                finally:
+                    db.session.remove()
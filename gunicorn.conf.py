@@ -0,0 +1,178 @@
+# Gunicorn configuration for running the app in production:
+#
+#     gunicorn server:connex_app
+#
+# (gunicorn picks this file up from the working directory by itself)
+#
+# NOTE: With preload_app the master process imports server.py, and with it
+#       config, models and the parsed and validated swagger.yml, once before
+#       forking the workers. The workers start from a copy-on-write copy of
+#       that memory instead of each importing and validating everything
+#       again, so they boot in milliseconds and share most of their pages.
+#       The marshmallow schemas are built in the master too (see
+#       when_ready() below)
+#
+#       Database connections must never cross a fork: two processes writing
+#       through the same SQLite handle corrupt its state. post_worker_init()
+#       therefore throws away whatever the master's engine holds, and each
+#       worker opens its own connections on its first request. It runs after
+#       the gevent worker has monkey-patched threading, so the new pool
+#       waits for a free connection on greenlet-aware locks instead of
+#       blocking the whole worker
+#
+# Reloading:
+# - kill -HUP <master pid> replaces the workers one by one with new ones
+#   forked from the master, while the old ones finish their requests. Since
+#   the app is preloaded this picks up configuration changes, not code changes
+# - To deploy new code without dropping requests, start a new master with
+#   kill -USR2 <master pid>, stop the old workers with kill -WINCH <old master
+#   pid> once the new ones are serving, then kill -QUIT <old master pid>
+
+import gc
+import multiprocessing
+import os
+import resource
+import time
+
+# Time the master started loading, to report the startup time
+started = time.monotonic()
+
+bind = os.environ.get('PEOPLE_BIND', '0.0.0.0:5000')
+
+# One worker per core: the handlers are CPU bound (serialization) between
+# short SQLite calls, so more processes than cores only adds switching
+workers = int(os.environ.get('PEOPLE_WORKERS', multiprocessing.cpu_count()))
+# The in-process cache of a worker (cache.LocalCache) doesn't hear of the
+# writes the other workers handle, and would keep serving the old person or
+# note, and its ETag, until the entry expires. With several workers only the
+# list pages, cached under the table versions every worker reads from the
+# database, are cached, unless PEOPLE_CACHE_BACKEND names a cache they share
+if workers > 1 and 'PEOPLE_CACHE_BACKEND' not in os.environ:
+    os.environ.setdefault('PEOPLE_CACHE_ENTRIES', '0')
+# Threads per worker. More than 1 switches to the gthread worker, which
+# also keeps idle keep-alive connections from holding a whole process
+threads = int(os.environ.get('PEOPLE_THREADS', 1))
+# The worker class, gevent by default (gthread with PEOPLE_THREADS)
+# /api/notes/stream holds a connection open for as long as the dashboard is
+# shown. gevent runs each request in a greenlet, so a worker serves
+# thousands of idle streams. Under sync workers each stream would tie up a
+# whole process (until timeout kills it), under gthread a thread, so with
+# those the home page doesn't subscribe and the stream answers 204, unless
+# PEOPLE_EVENTS_STREAM=1 says otherwise
+worker_class = os.environ.get(
+    'PEOPLE_WORKER_CLASS', 'gthread' if threads > 1 else 'gevent'
+)
+if worker_class not in ('gevent', 'eventlet'):
+    os.environ.setdefault('PEOPLE_EVENTS_STREAM', '0')
+# Connections each gevent worker accepts at once
+worker_connections = int(os.environ.get('PEOPLE_WORKER_CONNECTIONS', 10000))
+
+preload_app = True
+
+# Recycle each worker after this many requests (plus a random jitter, so
+# they don't all restart at once) to bound the growth of its memory, e.g.
+# from the in-process cache or fragmentation
+max_requests = int(os.environ.get('PEOPLE_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('PEOPLE_MAX_REQUESTS_JITTER', 1000))
+
+# Seconds a worker gets to finish its requests on reload or shutdown
+graceful_timeout = 30
+timeout = 30
+keepalive = 5
+
+
+def rss_kib():
+    '''
+    Returns the resident set size of the current process
+
+    Returns
+    -------
+    int
+        Current RSS in KiB on Linux, peak RSS elsewhere
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def pss_kib():
+    '''
+    Returns the proportional set size of the current process
+
+    Pages shared with the master and the other workers are only counted in
+    proportion, so the PSS of all the workers adds up to the memory they
+    really use. Needs Linux 4.14 or later
+
+    Returns
+    -------
+    int
+        PSS in KiB, or None where it isn't available
+    '''
+    try:
+        with open('/proc/self/smaps_rollup') as smaps:
+            for line in smaps:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return None
+
+
+def when_ready(server):
+    '''
+    Finishes loading the app in the master before the workers are forked
+    '''
+    from models import NotePersonSchema, NoteSchema, PersonNoteSchema
+    from models import PersonSchema
+    from serializers import get_schema
+
+    # Build the schemas used by the write handlers, and resolve their nested
+    # schemas, so the workers inherit them ready to use
+    for schema_class in (PersonSchema, NoteSchema):
+        schema = get_schema(schema_class)
+        for field in schema.fields.values():
+            getattr(field, 'schema', None)
+    get_schema(PersonNoteSchema)
+    get_schema(NotePersonSchema)
+
+    # Move everything loaded so far out of the garbage collector's reach: a
+    # collection in a worker would otherwise write to the headers of all
+    # these objects and copy the pages they live on
+    gc.freeze()
+
+    server.log.info(
+        'Master ready in %.0f ms, RSS %d KiB',
+        (time.monotonic() - started) * 1000,
+        rss_kib(),
+    )
+
+
+def pre_fork(server, worker):
+    '''
+    Remembers when a worker started to fork, see post_worker_init()
+    '''
+    worker.booted_at = time.monotonic()
+
+
+def post_worker_init(worker):
+    '''
+    Drops the database pool inherited from the master, and reports the boot
+    time and memory of a worker
+    '''
+    from config import db
+
+    # A new pool, built with the (possibly monkey-patched) threading module
+    # of the worker
+    db.engine.dispose()
+
+    worker.log.info(
+        'Worker %d booted in %.0f ms, RSS %d KiB, PSS %s KiB',
+        worker.pid,
+        (time.monotonic() - worker.booted_at) * 1000,
+        rss_kib(),
+        pss_kib(),
+    )
@@ -0,0 +1,392 @@
+# This module records where the time of each API request goes and serves the
+# numbers on /metrics in the Prometheus text format
+#
+# NOTE: For every sampled request we record, under the operationId of
+#       swagger.yml the request was routed to:
+#       - the wall time of the whole request
+#       - the time spent in the database and the number of queries, from the
+#         SQLAlchemy engine events below
+#       - the number of rows fetched, counted by the SQLite cursor class
+#         config.py makes the connections use
+#       - the time spent turning objects into JSON, from the serializers in
+#         the handlers (see timer()) and the JSON encoder of the app
+#       Only a fraction (METRICS_SAMPLE_RATE in config.py) of the requests is
+#       measured; the request counter is exact. With METRICS_SERVER_TIMING
+#       the same numbers are also sent back in a Server-Timing header, which
+#       browsers show in their dev tools
+#
+#       `python benchmark.py metrics` measures the overhead. In two runs of
+#       15 rounds of 1000 requests the median was +2.2% and -1.3% at a rate
+#       of 0.1, -0.8% and +0.6% at 1.0, while single rounds ranged from -9%
+#       to +15%: smaller than the noise of the measurement
+#
+#       Every process keeps its own numbers, so with several workers each one
+#       answers /metrics for itself
+#
+#       This module must not import config, since config imports it to set
+#       up the database connections
+
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from connexion.apis.flask_utils import flaskify_endpoint
+from connexion.apps.flask_app import FlaskJSONEncoder
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000)
+
+# Flask endpoint names of the API operations, mapped to their operationId
+OPERATIONS = {}
+
+
+class Histogram:
+    '''
+    Prometheus histogram with one series per operation
+
+    Attributes
+    ----------
+    name : str
+        Name of the metric
+    help : str
+        Description of the metric
+    buckets : tuple
+        Upper bounds of the buckets, in increasing order
+    '''
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, operation, value):
+        '''
+        Records one value for an operation
+        '''
+        with self._lock:
+            series = self._series.get(operation)
+            if series is None:
+                # The bucket counts, then the sum and the count
+                series = [0] * (len(self.buckets) + 2)
+                self._series[operation] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        '''
+        Returns the lines of the histogram in the Prometheus text format
+        '''
+        lines = [
+            f'# HELP {self.name} {self.help}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self._lock:
+            series = {key: list(value) for key, value in self._series.items()}
+
+        for operation, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(
+                    f'{self.name}_bucket{{operation="{operation}",'
+                    f'le="{bound}"}} {cumulative}'
+                )
+            lines.append(
+                f'{self.name}_bucket{{operation="{operation}",le="+Inf"}} '
+                f'{values[-1]}'
+            )
+            lines.append(
+                f'{self.name}_sum{{operation="{operation}"}} {values[-2]}'
+            )
+            lines.append(
+                f'{self.name}_count{{operation="{operation}"}} {values[-1]}'
+            )
+
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    'people_api_request_seconds', 'Wall time of sampled requests',
+    SECONDS_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    'people_api_db_seconds', 'Time sampled requests spent in the database',
+    SECONDS_BUCKETS,
+)
+SERIALIZE_SECONDS = Histogram(
+    'people_api_serialize_seconds',
+    'Time sampled requests spent serializing their response',
+    SECONDS_BUCKETS,
+)
+QUERIES = Histogram(
+    'people_api_queries', 'Database queries run by sampled requests',
+    COUNT_BUCKETS,
+)
+ROWS = Histogram(
+    'people_api_rows', 'Database rows fetched by sampled requests',
+    COUNT_BUCKETS,
+)
+HISTOGRAMS = (REQUEST_SECONDS, DB_SECONDS, SERIALIZE_SECONDS, QUERIES, ROWS)
+
+# Number of requests by operation and status code, sampled or not
+request_counts = {}
+request_counts_lock = threading.Lock()
+
+
+class RequestStats:
+    '''
+    What one sampled request has spent so far
+    '''
+    __slots__ = ('start', 'db', 'queries', 'rows', 'serialize')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.serialize = 0.0
+
+
+def current_stats():
+    '''
+    Returns the RequestStats of the current request
+
+    Returns
+    -------
+    RequestStats
+        The stats, or None outside of a request or when the request isn't
+        sampled
+    '''
+    if not has_request_context():
+        return None
+
+    return g.get('metrics')
+
+
+@contextmanager
+def timer(kind='serialize'):
+    '''
+    Adds the time spent in the with block to the current request
+
+    Parameters
+    ----------
+    kind : str, optional
+        The RequestStats attribute to add it to (default is 'serialize')
+    '''
+    stats = current_stats()
+    if stats is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(stats, kind,
+                getattr(stats, kind) + time.perf_counter() - start)
+
+
+class MeteredCursor(sqlite3.Cursor):
+    '''
+    SQLite cursor counting the rows fetched during sampled requests
+    '''
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            count_rows(1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        count_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        count_rows(len(rows))
+        return rows
+
+
+class MeteredConnection(sqlite3.Connection):
+    '''
+    SQLite connection handing out MeteredCursor objects
+    '''
+    def cursor(self, factory=MeteredCursor):
+        return super().cursor(factory)
+
+
+def count_rows(count):
+    '''
+    Adds fetched rows to the current request
+    '''
+    stats = current_stats()
+    if stats is not None:
+        stats.rows += count
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    '''
+    Remembers when a query of a sampled request started
+
+    The time is kept on the execution context of the statement, which goes
+    away with it, so a statement that fails (and never gets to end_query())
+    leaves nothing behind on the pooled connection
+    '''
+    if context is not None and current_stats() is not None:
+        context.metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    '''
+    Adds the time of a finished query to the current request
+    '''
+    stats = current_stats()
+    start = getattr(context, 'metrics_start', None)
+    if stats is None or start is None:
+        return
+
+    stats.db += time.perf_counter() - start
+    stats.queries += 1
+
+
+class TimedJSONEncoder(FlaskJSONEncoder):
+    '''
+    JSON encoder of the app, adding its time to the current request
+    '''
+    def encode(self, o):
+        with timer():
+            return super().encode(o)
+
+
+def register_api(api):
+    '''
+    Learns the Flask endpoint names of the operations of a Connexion API
+
+    Parameters
+    ----------
+    api : FlaskApi
+        The API returned by connex_app.add_api()
+    '''
+    for path in api.specification['paths'].values():
+        for operation in path.values():
+            if isinstance(operation, dict) and 'operationId' in operation:
+                operation_id = operation['operationId']
+                endpoint = flaskify_endpoint(operation_id)
+                OPERATIONS[f'{api.blueprint.name}.{endpoint}'] = operation_id
+
+
+def operation_name():
+    '''
+    Returns the operationId (or endpoint name) the request was routed to
+    '''
+    endpoint = request.endpoint
+    if endpoint is None:
+        return 'unmatched'
+
+    return OPERATIONS.get(endpoint, endpoint)
+
+
+def start_request():
+    '''
+    Decides whether to sample the request, and starts measuring it if so
+    '''
+    if random.random() < current_app.config['METRICS_SAMPLE_RATE']:
+        g.metrics = RequestStats()
+
+
+def finish_request(response):
+    '''
+    Records the numbers of the request that is being answered
+    '''
+    operation = operation_name()
+    key = (operation, response.status_code)
+    with request_counts_lock:
+        request_counts[key] = request_counts.get(key, 0) + 1
+
+    stats = g.pop('metrics', None)
+    if stats is None:
+        return response
+
+    # A streamed response is measured up to its first byte
+    elapsed = time.perf_counter() - stats.start
+    REQUEST_SECONDS.observe(operation, elapsed)
+    DB_SECONDS.observe(operation, stats.db)
+    SERIALIZE_SECONDS.observe(operation, stats.serialize)
+    QUERIES.observe(operation, stats.queries)
+    ROWS.observe(operation, stats.rows)
+
+    if current_app.config['METRICS_SERVER_TIMING']:
+        response.headers['Server-Timing'] = (
+            f'db;dur={stats.db * 1000:.2f};desc="{stats.queries} queries", '
+            f'serialize;dur={stats.serialize * 1000:.2f}, '
+            f'total;dur={elapsed * 1000:.2f}'
+        )
+
+    return response
+
+
+def render():
+    '''
+    Returns all the metrics in the Prometheus text format
+    '''
+    lines = [
+        '# HELP people_api_requests_total Requests answered',
+        '# TYPE people_api_requests_total counter',
+    ]
+    with request_counts_lock:
+        counts = sorted(request_counts.items())
+    for (operation, status), count in counts:
+        lines.append(
+            f'people_api_requests_total{{operation="{operation}",'
+            f'status="{status}"}} {count}'
+        )
+
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_endpoint():
+    '''
+    This function responds to a request for /metrics
+
+    Returns
+    -------
+    Response
+        The metrics in the Prometheus text format
+    '''
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app, api):
+    '''
+    Starts recording the requests of an app
+
+    Parameters
+    ----------
+    app : Flask
+        The Flask app
+    api : FlaskApi
+        The Connexion API registered on it
+    '''
+    register_api(api)
+    app.json_encoder = TimedJSONEncoder
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
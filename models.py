@@ -1,6 +1,6 @@
 from datetime import datetime
 from config import db, ma
-from marshmallow import fields
+from marshmallow import fields, pre_load
 
 # NOTE: Marshmallow is the module that translates SQLAlchemy objects into
 #       Python objects suitable for creating JSON strings
@@ -24,18 +24,40 @@ class Person(db.Model):
         The first name of the person
     timestamp : datetime
         The UTC timestamp of when a person was added/updated to the table
+    note_count : int
+        Number of notes of the person, kept by the triggers of NOTE_STATS_DDL
+    last_note_at : datetime
+        The UTC timestamp of the newest note of the person, None without
+        notes, kept by the triggers of NOTE_STATS_DDL
     notes : list
         List of notes created by a Person
     '''
     __tablename__ = 'person'
+    __table_args__ = (
+        # One person per (lname, fname). people.create relies on this for the
+        # 409 check: the lookup is a single probe of the constraint's index
+        # and two concurrent inserts of the same name can't both succeed
+        db.UniqueConstraint('lname', 'fname', name='uq_person_lname_fname'),
+        # Serves the busiest people of notes.stats, read backwards
+        db.Index('ix_person_note_count', 'note_count'),
+    )
     person_id = db.Column(db.Integer, primary_key=True)
-    lname = db.Column(db.String(32))
-    fname = db.Column(db.String(32))
+    # index=True backs the (lname, person_id) ordering of people.read_all
+    # (SQLite appends the person_id rowid to every index entry)
+    lname = db.Column(db.String(32), index=True)
+    # index=True backs the first name prefix filter of people.read_all
+    fname = db.Column(db.String(32), index=True)
     timestamp = db.Column(
         db.DateTime,
         default=datetime.utcnow,
         onupdate=datetime.utcnow
     )
+    # Denormalized from the notes, so lists of people can show how many
+    # notes each one has without loading them. Only the triggers write them
+    # (PersonSchema dumps but never loads them), in the same statement as
+    # the note that changes them
+    note_count = db.Column(db.Integer, nullable=False, default=0)
+    last_note_at = db.Column(db.DateTime)
     # Set up the relationship between Person and Note
     notes = db.relationship(
         # 'Note' defines what the SQLAlchemy class Person is related to
@@ -48,7 +70,10 @@ class Person(db.Model):
         # Having a reference to the parent in the child can be useful if your
         # code iterates over notes and has to include info about the parent
         # (this happens frequently in display rendering code)
-        backref='person',
+        # The backref is loaded lazily too; handlers that serialize the
+        # person of many notes use joinedload() so it comes back in the same
+        # SELECT as the notes
+        backref=db.backref('person', lazy='select'),
         # cascade determines how to treat Note instances when changes are made
         # to the Person instance
         # e.g. When a Person is deleted, this parameter tells SQLAlchemy to
@@ -63,7 +88,14 @@ class Person(db.Model):
         # with a Person. By default the notes attribute list will contain Note
         # objects in an unknown order. desc() sorts notes in descending order
         # (ascending is the default)
-        order_by='desc(Note.timestamp)'
+        order_by='desc(Note.timestamp)',
+        # lazy='select' means the notes are only loaded the first time the
+        # attribute is used, with one SELECT per Person. That is fine for a
+        # single Person but sends N+1 queries when a list of people is
+        # serialized, so the list handlers override it per query with
+        # selectinload(), which loads the notes of every Person on the page
+        # in one extra SELECT ... WHERE person_id IN (...)
+        lazy='select'
     )
 
 
@@ -87,6 +119,13 @@ class Note(db.Model):
         The UTC timestamp of when a note was added/updated to the table
     '''
     __tablename__ = 'note'
+    __table_args__ = (
+        # Serves every per-person lookup of notes (Person.notes, the cascade
+        # delete in people.delete) and already returns them in timestamp order
+        db.Index('ix_note_person_id_timestamp', 'person_id', 'timestamp'),
+        # Serves the (timestamp, note_id) ordering of notes.read_all
+        db.Index('ix_note_timestamp', 'timestamp'),
+    )
     note_id = db.Column(db.Integer, primary_key=True)
     # Relate the Note class to the Person class using person.person_id
     # This and Person.notes are how SQLAlchemy knows what to do when
@@ -101,6 +140,306 @@ class Note(db.Model):
     )
 
 
+class TableVersion(db.Model):
+    '''
+    Class used to represent the version of a table, which changes every time
+    a row of the table is inserted, updated or deleted
+
+    The versions are kept up to date by the triggers created below, so they
+    also count changes made with Core statements. The batch endpoints
+    suspend the triggers and bump the versions once per batch instead, see
+    bulk.bump_versions(). The list endpoints build their ETags from them,
+    which is far cheaper than looking at the rows themselves
+
+    Parent: db.Model
+
+    Attributes
+    ----------
+    __tablename__ : str
+        A string that states the name of the table
+    name : str
+        The name of the versioned table
+    version : int
+        Number of changes made to the table
+    modified_at : datetime
+        The UTC timestamp of the last change to the table
+    row_count : int
+        Number of rows in the table, so counting them doesn't need a scan
+    '''
+    __tablename__ = 'table_version'
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    modified_at = db.Column(db.DateTime)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChangeLog(db.Model):
+    '''
+    Class used to represent the last change to a row of the person or note
+    table, for clients syncing a copy of the data (see changes.py)
+
+    Every table has at most one entry per row, written by the triggers
+    created below in the same transaction as the change. A new change to a
+    row replaces its entry with one at the end of the log, so reading the
+    log from a position returns each row changed since once, however often
+    it changed. Deleted rows keep their entry as a tombstone
+
+    Parent: db.Model
+
+    Attributes
+    ----------
+    __tablename__ : str
+        A string that states the name of the table
+    change_id : int
+        Position of the change in the log, only ever increases
+    table_name : str
+        The name of the changed table
+    row_id : int
+        The primary key of the changed row
+    action : str
+        'upsert' when the row was inserted or updated, 'delete' when it was
+        deleted
+    changed_at : datetime
+        The UTC timestamp of the change
+    '''
+    __tablename__ = 'change_log'
+    __table_args__ = (
+        # The triggers replace the entry of a row through this constraint
+        db.UniqueConstraint(
+            'table_name', 'row_id', name='uq_change_log_table_name_row_id'
+        ),
+        # AUTOINCREMENT never hands out the id of a replaced entry again,
+        # which the cursors of changes.py rely on
+        {'sqlite_autoincrement': True},
+    )
+    change_id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(32), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    action = db.Column(db.String(8), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False)
+
+
+class SuspendedTrigger(db.Model):
+    '''
+    Class used to represent a group of triggers that is switched off for the
+    rest of the transaction, see bulk.suspended_triggers()
+
+    A batch writing many rows at once inserts the group here before its
+    statements and deletes it again before committing, and then does with
+    one statement per batch what the triggers would do once per row. Only
+    the transaction that inserted the entry ever sees it: SQLite runs one
+    write transaction at a time and the entry is gone by the commit
+
+    Parent: db.Model
+
+    Attributes
+    ----------
+    __tablename__ : str
+        A string that states the name of the table
+    name : str
+        The name of the group of triggers: 'table_version', 'note_fts' or
+        'note_stats'
+    '''
+    __tablename__ = 'suspended_trigger'
+    name = db.Column(db.String(32), primary_key=True)
+
+
+def unless_suspended(name):
+    '''
+    Builds the WHEN clause of a trigger that skips it while its group is
+    suspended, see SuspendedTrigger
+
+    Parameters
+    ----------
+    name : str
+        Name of the group of triggers
+
+    Returns
+    -------
+    str
+        The clause, to put before the BEGIN of the trigger
+    '''
+    return (
+        f"WHEN NOT EXISTS (SELECT 1 FROM suspended_trigger "
+        f"WHERE name = '{name}') "
+    )
+
+
+def table_version_ddl(table):
+    '''
+    Builds the statements that create the row and triggers versioning a table
+
+    Parameters
+    ----------
+    table : str
+        Name of the table to version
+
+    Returns
+    -------
+    list
+        The DDL statements
+    '''
+    statements = [
+        f"INSERT INTO table_version (name, version, modified_at, row_count) "
+        f"VALUES ('{table}', 0, CURRENT_TIMESTAMP, 0)"
+    ]
+    # The triggers also keep row_count, which is how many rows the table had
+    # when it was created (none) plus the inserts minus the deletes
+    for action, rows in (('INSERT', 1), ('UPDATE', 0), ('DELETE', -1)):
+        bump = (
+            f"UPDATE table_version SET version = version + 1, "
+            f"modified_at = CURRENT_TIMESTAMP, row_count = row_count + {rows} "
+            f"WHERE name = '{table}';"
+        )
+        statements.append(
+            f"CREATE TRIGGER {table}_{action.lower()}_version "
+            f"AFTER {action} ON {table} {unless_suspended('table_version')}"
+            f"BEGIN {bump} END"
+        )
+
+    return [db.DDL(statement) for statement in statements]
+
+
+# The current UTC time with microseconds, the way SQLAlchemy stores a
+# DateTime. SQLite's %f only has milliseconds, and SQLAlchemy would read
+# .123 as 123 microseconds
+CHANGED_AT = "strftime('%Y-%m-%d %H:%M:%f', 'now') || '000'"
+
+
+def change_log_ddl(table, key):
+    '''
+    Builds the triggers logging the changes to a table, see ChangeLog
+
+    Parameters
+    ----------
+    table : str
+        Name of the table to log
+    key : str
+        Name of its primary key column
+
+    Returns
+    -------
+    list
+        The DDL statements
+    '''
+    statements = []
+    for action, row, kind in (
+        ('INSERT', 'new', 'upsert'),
+        ('UPDATE', 'new', 'upsert'),
+        ('DELETE', 'old', 'delete'),
+    ):
+        statements.append(
+            f"CREATE TRIGGER {table}_{action.lower()}_change_log "
+            f"AFTER {action} ON {table} BEGIN "
+            f"INSERT OR REPLACE INTO change_log "
+            f"(table_name, row_id, action, changed_at) "
+            f"VALUES ('{table}', {row}.{key}, '{kind}', "
+            f"{CHANGED_AT}); END"
+        )
+
+    # DDL() formats the statements with %, which must then be written %%
+    return [
+        db.DDL(statement.replace('%', '%%')) for statement in statements
+    ]
+
+
+# Full-text index over note.content, used by notes.search
+# - content='note' makes it an external content table: the index only stores
+#   the tokens and reads the text back from the note table by rowid
+# - The triggers keep it in sync with every insert, update and delete of a
+#   note, including the ones done with Core statements
+# - The batch endpoints suspend the triggers (the 'note_fts' group of
+#   SuspendedTrigger) and index or unindex their notes a chunk at a time
+#   instead, see bulk.index_notes(). Row by row, indexing a note costs
+#   several times as much as writing it
+# - build_database.py rebuilds it from the note table, which backfills notes
+#   written while the triggers didn't exist
+NOTE_FTS_ON = unless_suspended('note_fts')
+NOTE_FTS_DDL = [
+    db.DDL(
+        "CREATE VIRTUAL TABLE note_fts USING fts5("
+        "content, content='note', content_rowid='note_id')"
+    ),
+    db.DDL(
+        f"CREATE TRIGGER note_fts_insert AFTER INSERT ON note {NOTE_FTS_ON}"
+        "BEGIN INSERT INTO note_fts (rowid, content) "
+        "VALUES (new.note_id, new.content); END"
+    ),
+    db.DDL(
+        f"CREATE TRIGGER note_fts_delete AFTER DELETE ON note {NOTE_FTS_ON}"
+        "BEGIN INSERT INTO note_fts (note_fts, rowid, content) "
+        "VALUES ('delete', old.note_id, old.content); END"
+    ),
+    db.DDL(
+        "CREATE TRIGGER note_fts_update AFTER UPDATE OF content ON note "
+        f"{NOTE_FTS_ON}BEGIN "
+        "INSERT INTO note_fts (note_fts, rowid, content) "
+        "VALUES ('delete', old.note_id, old.content); "
+        "INSERT INTO note_fts (rowid, content) "
+        "VALUES (new.note_id, new.content); END"
+    ),
+]
+
+# Note statistics of every person, see Person.note_count and last_note_at
+# - They change with the note, so notes.create/update/delete, the batch
+#   endpoints and the cascade of people.delete all keep them right
+# - last_note_at is read back from ix_note_person_id_timestamp, a single
+#   index probe, whenever it may have changed, so deleting or back-dating
+#   the newest note leaves it right
+# - The timestamps are stored as ISO strings, which compare in time order
+# - Updating the person also bumps its table_version, which is what lists
+#   showing the counts need for their ETags
+# - build_database.py recomputes them from the note table, which backfills
+#   notes written while the triggers didn't exist
+# - The batch endpoints suspend the triggers (the 'note_stats' group of
+#   SuspendedTrigger) and update each person they wrote notes of once per
+#   batch instead, see bulk.update_note_stats(). Row by row, the triggers
+#   update the person, and through its own triggers its version and change
+#   log entry, three writes for every note
+NEWEST_NOTE = (
+    "(SELECT MAX(note.timestamp) FROM note "
+    "WHERE note.person_id = person.person_id)"
+)
+NOTE_STATS_ON = unless_suspended('note_stats')
+NOTE_STATS_DDL = [
+    db.DDL(
+        "CREATE TRIGGER note_insert_stats AFTER INSERT ON note "
+        f"{NOTE_STATS_ON}BEGIN "
+        "UPDATE person SET note_count = note_count + 1, "
+        "last_note_at = CASE WHEN last_note_at >= new.timestamp "
+        "THEN last_note_at ELSE new.timestamp END "
+        "WHERE person_id = new.person_id; END"
+    ),
+    db.DDL(
+        "CREATE TRIGGER note_delete_stats AFTER DELETE ON note "
+        f"{NOTE_STATS_ON}BEGIN "
+        "UPDATE person SET note_count = note_count - 1, "
+        f"last_note_at = {NEWEST_NOTE} "
+        "WHERE person_id = old.person_id; END"
+    ),
+    db.DDL(
+        "CREATE TRIGGER note_update_stats "
+        "AFTER UPDATE OF person_id, timestamp ON note "
+        f"{NOTE_STATS_ON}BEGIN "
+        "UPDATE person SET note_count = note_count - 1 "
+        "WHERE person_id = old.person_id; "
+        "UPDATE person SET note_count = note_count + 1 "
+        "WHERE person_id = new.person_id; "
+        f"UPDATE person SET last_note_at = {NEWEST_NOTE} "
+        "WHERE person_id IN (old.person_id, new.person_id); END"
+    ),
+]
+
+# The triggers reference several tables, so they are created once every
+# table of db.create_all() exists
+for statement in (
+    table_version_ddl('person') + table_version_ddl('note') + NOTE_FTS_DDL
+    + NOTE_STATS_DDL + change_log_ddl('person', 'person_id')
+    + change_log_ddl('note', 'note_id')
+):
+    db.event.listen(db.metadata, 'after_create', statement)
+
+
 class PersonSchema(ma.ModelSchema):
     '''
     Defines how the attributes of Person will be converted into JSON-friendly
@@ -132,6 +471,19 @@ class PersonSchema(ma.ModelSchema):
         '''
         model = Person
         sqla_session = db.session
+        # Kept by the triggers in the database, see NOTE_STATS_DDL
+        dump_only = ('note_count', 'last_note_at')
+
+    @pre_load
+    def drop_note_stats(self, data, **kwargs):
+        '''
+        Ignores the note statistics in the data being loaded, so a person
+        read from the API can be sent back as it is
+        '''
+        return {
+            key: value for key, value in data.items()
+            if key not in self.Meta.dump_only
+        }
 
     # RECALL: many = True indicates a one-to-many relationship, so Marshmallow
     #         will serialize all related notes
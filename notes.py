@@ -1,29 +1,320 @@
 # This module handles the Note API definitions. It's similar to people.py
 # except it must handle both person_id and note_id as defined in swagger.yml
 
-from config import db
-from flask import make_response, abort
+from bulk import (
+    batch_response, bump_versions, chunked, in_values, index_notes,
+    insert_returning, item_error, select_in, suspended_triggers, unindex_notes,
+    update_note_stats
+)
+from cache import cache, entry_cache, invalidate_notes, list_key, note_key
+from conditional import (
+    abort_unchanged, collection_validators, conditional, precondition,
+    timestamp_token
+)
+from collections import Counter
+from config import app, db
+from datetime import datetime
+from events import event_stream, publish
+from filters import load_columns, parse_timestamp, prefix_filter
+from flask import make_response, abort, request
+from group_commit import GroupCommitWriter
 from models import Person, Note, NoteSchema
+from metrics import timer
+from pagination import decode_cursor, encode_cursor, next_link, page
+from serializers import (
+    dump_note, format_nested_timestamp, format_timestamp, get_schema
+)
+from sqlalchemy.exc import OperationalError
+from stats import (
+    busiest_people, dump_person_stats, newest_note_timestamp, totals
+)
+from streaming import BATCH_SIZE, NDJSON, ndjson_response, wants_stream
+
+
+def read_all(limit=100, after=None, include=('person',), stream=False,
+             person_id=None, lname=None, fname=None, since=None, until=None,
+             fields=None):
+    '''
+    This function responds to a request for /api/notes with one page of the
+    list of notes, sorted by note timestamp, or with all of them as an NDJSON
+    stream
+
+    Parameters
+    ----------
+    limit : int, optional
+        Maximum number of notes to return (default is 100)
+    after : str, optional
+        Cursor of the last note on the previous page (default is None)
+    include : list, optional
+        Related objects to embed in each note, pass ['none'] to skip the
+        person (default is ['person'])
+    stream : bool, optional
+        Stream every note after the cursor as NDJSON instead of returning one
+        page, also selected by Accept: application/x-ndjson (default is
+        False)
+    person_id : int, optional
+        Only return the notes of this person (default is None)
+    lname : str, optional
+        Only return the notes of the people whose last name starts with this
+        (default is None)
+    fname : str, optional
+        Only return the notes of the people whose first name starts with
+        this (default is None)
+    since : str, optional
+        Only return the notes with a timestamp at or after this ISO 8601 UTC
+        time (default is None)
+    until : str, optional
+        Only return the notes with a timestamp before this ISO 8601 UTC time
+        (default is None)
+    fields : list, optional
+        Only return these fields of each note, e.g. ['note_id', 'timestamp']
+        (default is None, the fields of NoteSchema)
 
+    Returns
+    -------
+    list
+        A JSON list of notes for all people, with a Link header pointing at
+        the next page when there is one
+    304
+        If the list didn't change since the caller's copy
+    '''
+    person = 'person' in include
+    stream = wants_stream(stream)
+    since = parse_timestamp(since, 'since')
+    until = parse_timestamp(until, 'until')
+
+    # The name filters join the people, and the embedded person is then read
+    # from that same join
+    joined = lname is not None or fname is not None
+
+    # Answer the poll of an unchanged list before loading any notes. The
+    # list depends on the people too when it embeds them or filters on
+    # their names
+    tables = ('note', 'person') if person or joined else ('note',)
+    etag, last_modified = collection_validators(
+        tables, variant=NDJSON if stream else 'json'
+    )
+    # The format, and so the ETag, depends on the Accept header
+    not_modified, headers = conditional(etag, last_modified, vary='Accept')
+    if not_modified is not None:
+        return not_modified
+
+    # Was this page served since the tables last changed?
+    key = list_key(etag)
+    entry = None if stream else cache.get(key)
+    if entry is not None:
+        headers.update(entry['headers'])
+        return entry['data'], 200, headers
+
+    # Newest notes first, note_id breaks ties between identical timestamps
+    query = Note.query.order_by(db.desc(Note.timestamp), db.desc(Note.note_id))
+
+    # person_id and the time range are ranges of ix_note_person_id_timestamp
+    # or ix_note_timestamp, which already return the notes newest first
+    if person_id is not None:
+        query = query.filter(Note.person_id == person_id)
+    if since is not None:
+        query = query.filter(Note.timestamp >= since)
+    if until is not None:
+        query = query.filter(Note.timestamp < until)
+
+    if joined:
+        query = query.join(Note.person)
+        if lname is not None:
+            query = query.filter(prefix_filter(Person.lname, lname))
+        if fname is not None:
+            query = query.filter(prefix_filter(Person.fname, fname))
+
+    # Only SELECT the columns the response needs, and the sort key
+    columns = load_columns(
+        Note, fields, ('note_id', 'person_id', 'timestamp')
+    )
+    if columns is not None:
+        query = query.options(db.load_only(*columns))
+
+    # Start right after the last note of the previous page
+    if after is not None:
+        timestamp, note_id = decode_cursor(after, datetime, int)
+        query = query.filter(
+            db.or_(
+                Note.timestamp < timestamp,
+                db.and_(Note.timestamp == timestamp, Note.note_id < note_id),
+            )
+        )
+
+    # Load the person of every note in the same SELECT as the notes instead
+    # of one SELECT per note
+    if person and joined:
+        query = query.options(db.contains_eager(Note.person))
+    elif person:
+        query = query.options(db.joinedload(Note.person))
+
+    # yield_per() fetches the rows from the cursor BATCH_SIZE at a time
+    # instead of loading all of them before the first one is written
+    if stream:
+        return ndjson_response(
+            query.yield_per(BATCH_SIZE),
+            lambda note: dump_note(note, person=person, fields=fields),
+            headers,
+        )
+
+    # Query the database for the page of notes
+    notes, has_more = page(query, limit)
 
-def read_all():
+    # Serialize the list of notes from our data
+    with timer():
+        data = [
+            dump_note(note, person=person, fields=fields) for note in notes
+        ]
+
+    link = {}
+    if has_more:
+        last = notes[-1]
+        cursor = encode_cursor(last.timestamp, last.note_id)
+        link = next_link(after=cursor, limit=limit)
+
+    cache.set(key, {'data': data, 'headers': link})
+    headers.update(link)
+
+    return data, 200, headers
+
+
+# Ranked full-text search of the notes, see NOTE_FTS_DDL in models.py
+# bm25() returns better matches as lower (more negative) numbers
+SEARCH_QUERY = db.text(
+    """
+    SELECT note.note_id, note.person_id, note.content, note.timestamp,
+           -bm25(note_fts) AS score,
+           snippet(note_fts, 0, '<mark>', '</mark>', '...', 16) AS snippet,
+           person.fname, person.lname
+    FROM note_fts
+    JOIN note ON note.note_id = note_fts.rowid
+    LEFT OUTER JOIN person ON person.person_id = note.person_id
+    WHERE note_fts MATCH :q
+    ORDER BY bm25(note_fts), note.note_id
+    LIMIT :limit OFFSET :offset
+    """
+).columns(timestamp=db.DateTime)
+
+
+def search(q, limit=20, offset=0):
     '''
-    This function responds to a request for /api/people/notes with the complete
-    list of notes, sorted by note timestamp
+    This function responds to a request for /api/notes/search with the notes
+    matching a full-text query, best matches first
+
+    Parameters
+    ----------
+    q : str
+        The SQLite FTS5 query, e.g. easter eggs, "easter eggs" or use*
+    limit : int, optional
+        Maximum number of notes to return (default is 20)
+    offset : int, optional
+        Number of matches to skip (default is 0)
 
     Returns
     -------
     list
-        A JSON list of all notes for all people
+        The matching notes with their score and a highlighted snippet of the
+        matching content, with a Link header pointing at the next page when
+        there is one
+    400
+        If the query is not valid FTS5 syntax
     '''
-    # Query the database for all the notes
-    notes = Note.query.order_by(db.desc(Note.timestamp)).all()
+    try:
+        rows = db.session.execute(
+            SEARCH_QUERY, {'q': q, 'limit': limit + 1, 'offset': offset}
+        ).fetchall()
+    except OperationalError:
+        db.session.rollback()
+        abort(400, f'Invalid search query: {q}')
+
+    data = [
+        {
+            'note_id': row.note_id,
+            'content': row.content,
+            'timestamp': format_timestamp(row.timestamp),
+            'score': row.score,
+            'snippet': row.snippet,
+            'person': {
+                'person_id': row.person_id,
+                'fname': row.fname,
+                'lname': row.lname,
+            },
+        }
+        for row in rows[:limit]
+    ]
+
+    if len(rows) <= limit:
+        return data
 
-    # Serialize the list of notes from our data
-    note_schema = NoteSchema(many=True, exclude=['person.notes'])
-    data = note_schema.dump(notes)
+    return data, 200, next_link(offset=offset + limit, limit=limit)
+
+
+def stats(top=10):
+    '''
+    This function responds to a request for /api/notes/stats with the number
+    of notes, the time of the newest one and the people with the most notes
+
+    Parameters
+    ----------
+    top : int, optional
+        Number of people with the most notes to return (default is 10)
+
+    Returns
+    -------
+    dict
+        The totals, see stats.totals(), the newest note's timestamp and the
+        busiest people with their note_count, last_note_at and last_activity
+    304
+        If no person or note changed since the caller's copy
+    '''
+    etag, last_modified = collection_validators(('note', 'person'))
+    not_modified, headers = conditional(etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    # Every number comes from a counter or the end of an index, see stats.py
+    data = totals()
+    data['last_note_at'] = format_timestamp(newest_note_timestamp())
+    data['most_notes'] = [
+        dump_person_stats(row) for row in busiest_people(top)
+    ]
 
-    return data
+    return data, 200, headers
+
+
+def stream():
+    '''
+    This function responds to a request for /api/notes/stream with a stream
+    of Server-Sent Events announcing every note created, updated or deleted
+    from now on, see events.py
+
+    Returns
+    -------
+    Response
+        The text/event-stream response, sending note.created, note.updated
+        and note.deleted events. A reset event means events were missed and
+        the notes should be read again
+    204
+        If the stream is turned off (see EVENTS_STREAM in config.py), which
+        tells browsers to stop reconnecting
+    '''
+    if not app.config['EVENTS_STREAM']:
+        return make_response('', 204)
+
+    return event_stream(request.headers.get('Last-Event-ID'))
+
+
+# The columns the ETag of read_one() is made of, in order, which update()
+# and delete() check the version named by If-Match against. The timestamp of
+# the person is read with a subquery, so the check stays in the statement
+VERSION_COLUMNS = (
+    Note.note_id,
+    Note.timestamp,
+    db.select([Person.timestamp])
+    .where(Person.person_id == Note.person_id)
+    .as_scalar(),
+)
 
 
 def read_one(person_id, note_id):
@@ -43,26 +334,51 @@ def read_one(person_id, note_id):
     -------
     str
         JSON string of note contents
-
+    304
+        If the note and its person didn't change since the caller's copy
     '''
-    # Query the database for the note
-    note = (
-        Note.query.join(Person, Person.person_id == Note.person_id)
-        .filter(Person.person_id == person_id)
-        .filter(Note.note_id == note_id)
-        .one_or_none()
-    )
-
-    # Was a note found?
-    if note is not None:
-        note_schema = NoteSchema()
-        data = note_schema.dump(note)
-
-        return data
-
-    # Otherwise, didn't find the note
-    else:
-        abort(404, f'Note with Id {note_id} not found.')
+    # Serve hot notes straight from the cache, the entry is invalidated as
+    # soon as the note or its person changes
+    key = note_key(person_id, note_id)
+    entry = entry_cache.get(key)
+
+    if entry is None:
+        # Taken before the query, so an invalidation committed while we read
+        # keeps what we read out of the cache
+        token = entry_cache.token()
+
+        # Query the database for the note
+        # contains_eager() fills note.person from the join we already need
+        # for the filter, so serializing the person doesn't send a second
+        # SELECT
+        note = (
+            Note.query.join(Person, Person.person_id == Note.person_id)
+            .options(db.contains_eager(Note.person))
+            .filter(Person.person_id == person_id)
+            .filter(Note.note_id == note_id)
+            .one_or_none()
+        )
+
+        # Otherwise, didn't find the note
+        if note is None:
+            abort(404, f'Note with Id {note_id} not found.')
+
+        # The response embeds the person, so version it by both timestamps
+        timestamps = (note.timestamp, note.person.timestamp)
+        entry = {
+            'etag': '-'.join(
+                [str(note_id)] + [timestamp_token(ts) for ts in timestamps]
+            ),
+            'last_modified': max(filter(None, timestamps), default=None),
+            'data': dump_note(note),
+        }
+        entry_cache.set(key, entry, token)
+
+    not_modified, headers = conditional(entry['etag'], entry['last_modified'])
+    if not_modified is not None:
+        return not_modified
+
+    return entry['data'], 200, headers
 
 
 def create(person_id, note):
@@ -81,6 +397,15 @@ def create(person_id, note):
     201
         On successful creation
     '''
+    # Hand the note to the group-commit writer, which answers once the
+    # batch it went into is committed
+    if app.config['GROUP_COMMIT']:
+        data = note_writer.submit((person_id, note['content']))
+        if data is None:
+            abort(404, f'Person with Id {person_id} not found')
+
+        return data, 201
+
     # Get the parent person
     person = Person.query.filter(Person.person_id == person_id).one_or_none()
 
@@ -90,18 +415,113 @@ def create(person_id, note):
 
     # Create a note schema instance
     schema = NoteSchema()
-    new_note = schema.load(note, session=db.session).data
+    new_note = schema.load(note, session=db.session)
 
     # Add the note to the person and database
     person.notes.append(new_note)
     db.session.commit()
 
     # Serialize and return the newly created note in the response
-    data = schema.dump(new_note)
+    data = get_schema(NoteSchema).dump(new_note)
+    publish('note.created', dict(data, person_id=person_id))
 
     return data, 201
 
 
+def write_notes(notes):
+    '''
+    Writes the notes queued by create() in one transaction, see
+    group_commit.py
+
+    Parameters
+    ----------
+    notes : list
+        (person_id, content) of the notes to create
+
+    Returns
+    -------
+    list
+        The note as create() returns it for each of the notes, or None for
+        the notes of people that don't exist
+    '''
+    now = datetime.utcnow()
+
+    # Which of the people exist? Their names go into the responses
+    rows = select_in(
+        db.session.query(
+            Person.person_id, Person.fname, Person.lname, Person.timestamp
+        ),
+        Person.person_id,
+        {person_id for person_id, content in notes},
+    )
+    owners = {
+        row.person_id: {
+            'fname': row.fname,
+            'lname': row.lname,
+            'person_id': row.person_id,
+            'timestamp': format_nested_timestamp(row.timestamp),
+        }
+        for row in rows
+    }
+
+    insert_rows = [
+        {'person_id': person_id, 'content': content, 'timestamp': now}
+        for person_id, content in notes
+        if person_id in owners
+    ]
+    if not insert_rows:
+        return [None] * len(notes)
+
+    # Inserted with a few statements for the whole batch, which report the
+    # ids the notes got. The notes are indexed, counted and versioned once
+    # for the batch, as batch() does
+    table = Note.__table__
+    with suspended_triggers(
+        db.session, 'table_version', 'note_fts', 'note_stats'
+    ):
+        note_ids = insert_returning(db.session, table, insert_rows)
+        index_notes(db.session, table.c.note_id, note_ids)
+        update_note_stats(
+            db.session, Counter(row['person_id'] for row in insert_rows)
+        )
+        bump_versions(db.session, {'note': len(insert_rows), 'person': 0})
+    results = []
+    note_ids = iter(note_ids)
+    for person_id, content in notes:
+        if person_id not in owners:
+            results.append(None)
+            continue
+        results.append({
+            'content': content,
+            'note_id': next(note_ids),
+            'person': owners[person_id],
+            'timestamp': format_timestamp(now),
+        })
+
+    invalidate_notes(db.session, [
+        (data['person']['person_id'], data['note_id'])
+        for data in results
+        if data is not None
+    ])
+    db.session.commit()
+
+    for data in results:
+        if data is not None:
+            publish('note.created', dict(
+                data, person_id=data['person']['person_id']
+            ))
+
+    return results
+
+
+# Only used when the GROUP_COMMIT setting is on
+note_writer = GroupCommitWriter(
+    write_notes,
+    app.config['GROUP_COMMIT_WINDOW_MS'] / 1000,
+    app.config['GROUP_COMMIT_MAX_ITEMS'],
+)
+
+
 def update(person_id, note_id, note):
     '''
     This function updates an existing note related to the passed in person_id
@@ -119,34 +539,60 @@ def update(person_id, note_id, note):
     -------
     200
         On success
+    404
+        If the person has no note with this id
+    412
+        If the note changed since the version named by If-Match
     '''
-    update_note = (
-        Note.query.filter(Person.person_id == person_id)
+    now = datetime.utcnow()
+    values = {'timestamp': now}
+    if 'content' in note:
+        values['content'] = note['content']
+
+    # A single UPDATE, which changes no row when the person has no such note
+    # or it isn't the version the caller read
+    table = Note.__table__
+    found = db.and_(table.c.note_id == note_id, table.c.person_id == person_id)
+    matches = precondition(*VERSION_COLUMNS)
+    statement = table.update().where(found).values(**values)
+    if matches is not None:
+        statement = statement.where(matches)
+    result = db.session.execute(statement)
+
+    if result.rowcount == 0:
+        abort_unchanged(
+            Note.query.filter(found), matches,
+            f'Note with Id {note_id} not found',
+        )
+
+    # The response embeds the person
+    row = (
+        db.session.query(
+            Note.content, Person.fname, Person.lname, Person.timestamp
+        )
+        .join(Person, Person.person_id == Note.person_id)
         .filter(Note.note_id == note_id)
-        .one_or_none()
+        .one()
     )
+    data = {
+        'content': row.content,
+        'note_id': note_id,
+        'person': {
+            'fname': row.fname,
+            'lname': row.lname,
+            'person_id': person_id,
+            'timestamp': format_nested_timestamp(row.timestamp),
+        },
+        'timestamp': format_timestamp(now),
+    }
+
+    # Core statements bypass the session events of cache.py, so register the
+    # cached entries that become stale ourselves
+    invalidate_notes(db.session, [(person_id, note_id)])
+    db.session.commit()
+    publish('note.updated', dict(data, person_id=person_id))
 
-    # Did we find an existing note?
-    if update_note is not None:
-        # Turn the passed in note into a db object
-        schema = NoteSchema()
-        update = schema.load(note, session=db.session).data
-
-        # Set the id's to the note we want to update
-        update.person_id = update_note.person_id
-        update.note_id = update_note.note_id
-
-        # Merge the new object into the old and commit it to the db
-        db.session.merge(update)
-        db.session.commit()
-
-        # Return updated note in the response
-        data = schema.dump(update_note)
-
-        return data, 200
-    # Otherwise, we didn't find the note
-    else:
-        abort(404, f'Note with Id {note_id} not found')
+    return data, 200
 
 
 def delete(person_id, note_id):
@@ -166,20 +612,204 @@ def delete(person_id, note_id):
         On successful delete
     404
         If not found
+    412
+        If the note changed since the version named by If-Match
     '''
-    # Get the note requested
-    note = (
-        Note.query.filter(Person.person_id == person_id)
-        .filter(Note.note_id == note_id)
+    # A single DELETE, which removes no row when the person has no such note
+    # or it isn't the version the caller read
+    table = Note.__table__
+    found = db.and_(table.c.note_id == note_id, table.c.person_id == person_id)
+    matches = precondition(*VERSION_COLUMNS)
+    statement = table.delete().where(found)
+    if matches is not None:
+        statement = statement.where(matches)
+    result = db.session.execute(statement)
+
+    if result.rowcount == 0:
+        abort_unchanged(
+            Note.query.filter(found), matches,
+            f'Note with Id {note_id} not found',
+        )
+
+    invalidate_notes(db.session, [(person_id, note_id)])
+    db.session.commit()
+    publish('note.deleted', {'note_id': note_id, 'person_id': person_id})
+
+    return make_response(f'Note {note_id} deleted', 200)
+
+
+def batch(person_id, changes):
+    '''
+    This function creates, updates and deletes many notes of a person in one
+    request and one transaction
+
+    Parameters
+    ----------
+    person_id : int
+        Id of the person the notes are related to
+    changes : dict
+        Lists of notes to create, notes to update (with their note_id) and
+        note_ids to delete
+
+    Returns
+    -------
+    200
+        With the status of every item, in the order they were passed in
+    404
+        If the person doesn't exist
+    '''
+    creates = changes.get('create', [])
+    updates = changes.get('update', [])
+    deletes = changes.get('delete', [])
+    now = datetime.utcnow()
+
+    # Was a person found? Its names go into the events of the notes
+    person = (
+        db.session.query(
+            Person.person_id, Person.fname, Person.lname, Person.timestamp
+        )
+        .filter(Person.person_id == person_id)
         .one_or_none()
     )
+    if person is None:
+        abort(404, f'Person with Id {person_id} not found')
+
+    # Which of the notes to update or delete belong to this person?
+    rows = select_in(
+        db.session.query(Note.note_id).filter(Note.person_id == person_id),
+        Note.note_id,
+        [note['note_id'] for note in updates] + deletes,
+    )
+    known_ids = {row.note_id for row in rows}
+
+    insert_rows = [
+        {'person_id': person_id, 'content': note['content'], 'timestamp': now}
+        for note in creates
+    ]
+
+    update_results, update_rows = [], []
+    for note in updates:
+        note_id = note['note_id']
+        if note_id in known_ids:
+            update_rows.append({
+                'b_note_id': note_id,
+                'content': note['content'],
+                'timestamp': now,
+            })
+            update_results.append({
+                'status': 200,
+                'note': dump_written_note(
+                    person_id, note_id, note['content'], now
+                ),
+            })
+        else:
+            update_results.append(item_error(
+                404, f'Note with Id {note_id} not found'
+            ))
+
+    delete_results, delete_ids = [], []
+    for note_id in deletes:
+        if note_id in known_ids:
+            delete_ids.append(note_id)
+            delete_results.append({'status': 200, 'note_id': note_id})
+        else:
+            delete_results.append(item_error(
+                404, f'Note with Id {note_id} not found'
+            ))
+
+    # Write everything in one transaction, one statement per kind of change.
+    # The triggers would index, count and version the notes one at a time,
+    # the batch does it once per statement instead (see bulk.py)
+    table = Note.__table__
+    update_ids = [row['b_note_id'] for row in update_rows]
+    create_results = []
+    with suspended_triggers(
+        db.session, 'table_version', 'note_fts', 'note_stats'
+    ):
+        if insert_rows:
+            note_ids = insert_returning(db.session, table, insert_rows)
+            create_results = [
+                {
+                    'status': 201,
+                    'note': dump_written_note(
+                        person_id, note_id, row['content'], now
+                    ),
+                }
+                for note_id, row in zip(note_ids, insert_rows)
+            ]
+            index_notes(db.session, table.c.note_id, note_ids)
+        if update_rows:
+            unindex_notes(db.session, table.c.note_id, update_ids)
+            db.session.execute(
+                table.update().where(
+                    table.c.note_id == db.bindparam('b_note_id')
+                ),
+                update_rows,
+            )
+            index_notes(db.session, table.c.note_id, update_ids)
+        unindex_notes(db.session, table.c.note_id, delete_ids)
+        statement = table.delete().where(in_values(table.c.note_id))
+        for chunk in chunked(delete_ids):
+            db.session.execute(statement, {'b_values': chunk})
+        if insert_rows or update_rows or delete_ids:
+            added = len(insert_rows) - len(delete_ids)
+            update_note_stats(db.session, {person_id: added})
+            bump_versions(db.session, {'note': added, 'person': 0})
+
+    # Core statements bypass the session events of cache.py, so register the
+    # cached entries that become stale ourselves
+    written_ids = [result['note']['note_id'] for result in create_results]
+    written_ids += update_ids + delete_ids
+    invalidate_notes(
+        db.session, [(person_id, note_id) for note_id in written_ids]
+    )
+    db.session.commit()
 
-    # Did we find a note?
-    if note is not None:
-        db.session.delete(note)
-        db.session.commit()
+    # The same events as the single note handlers publish: the note, with
+    # its person embedded and its person_id at the top level
+    owner = {
+        'fname': person.fname,
+        'lname': person.lname,
+        'person_id': person_id,
+        'timestamp': format_nested_timestamp(person.timestamp),
+    }
+    for kind, results in (
+        ('note.created', create_results), ('note.updated', update_results)
+    ):
+        for result in results:
+            if 'note' in result:
+                publish(kind, dict(
+                    result['note'], person=owner, person_id=person_id
+                ))
+    for note_id in delete_ids:
+        publish('note.deleted', {'note_id': note_id, 'person_id': person_id})
+
+    return batch_response(create_results, update_results, delete_results)
+
+
+def dump_written_note(person_id, note_id, content, timestamp):
+    '''
+    Serializes a note written by batch() without reading it back
 
-        return make_response(f'Note {note_id} deleted', 200)
-    # Otherwise, we didn't find that note
-    else:
-        abort(404, f'Note with Id {note_id} not found')
+    Parameters
+    ----------
+    person_id : int
+        Id of the person the note is related to
+    note_id : int
+        Id of the note
+    content : str
+        Text content of the note
+    timestamp : datetime
+        The timestamp the note was written with
+
+    Returns
+    -------
+    dict
+        JSON-friendly representation of the note
+    '''
+    return {
+        'content': content,
+        'note_id': note_id,
+        'person_id': person_id,
+        'timestamp': format_timestamp(timestamp),
+    }
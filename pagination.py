@@ -0,0 +1,129 @@
+# This module holds the helpers used by the list endpoints in people.py and
+# notes.py to page through their results with opaque keyset (cursor) values
+# instead of LIMIT/OFFSET.
+#
+# NOTE: With OFFSET the database still has to walk over every skipped row, so
+#       deep pages get slower and slower. A keyset cursor remembers the sort
+#       key of the last row that was returned and the next query starts right
+#       after it, which is a single index seek no matter how deep the page is
+
+import base64
+import json
+from datetime import datetime
+from urllib.parse import urlencode
+
+from flask import abort, request
+
+
+def encode_cursor(*values):
+    '''
+    Encodes the sort key values of a row into an opaque cursor string
+
+    Parameters
+    ----------
+    *values
+        The sort key values of the last row of a page (str, int, datetime or
+        None)
+
+    Returns
+    -------
+    str
+        URL safe cursor string
+    '''
+    key = [
+        value.isoformat() if isinstance(value, datetime) else value
+        for value in values
+    ]
+    raw = json.dumps(key, separators=(',', ':')).encode('utf-8')
+
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    '''
+    Decodes a cursor created by encode_cursor() back into its sort key values
+
+    Parameters
+    ----------
+    cursor : str
+        The cursor passed in by the caller
+    *types
+        The expected type of each value in the cursor (str, int or datetime)
+
+    Returns
+    -------
+    list
+        The sort key values, converted to the requested types
+
+    Raises
+    ------
+    400
+        If the cursor is malformed
+    '''
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(cursor + padding))
+
+        if not isinstance(key, list) or len(key) != len(types):
+            raise ValueError('Cursor has the wrong shape')
+
+        values = []
+        for value, type_ in zip(key, types):
+            if value is None:
+                values.append(None)
+            elif type_ is datetime:
+                values.append(datetime.fromisoformat(value))
+            elif isinstance(value, type_):
+                values.append(value)
+            else:
+                raise ValueError('Cursor has the wrong types')
+
+        return values
+    except (ValueError, TypeError):
+        abort(400, f'Invalid cursor: {cursor}')
+
+
+def page(query, limit):
+    '''
+    Runs a keyset ordered query and returns one page of its rows
+
+    One extra row is fetched so we know whether there is a next page without
+    running a separate COUNT query
+
+    Parameters
+    ----------
+    query : Query
+        The filtered and ordered query to page through
+    limit : int
+        Maximum number of rows in the page
+
+    Returns
+    -------
+    tuple
+        (rows, has_more) where rows is a list of at most limit rows
+    '''
+    rows = query.limit(limit + 1).all()
+
+    return rows[:limit], len(rows) > limit
+
+
+def next_link(**params):
+    '''
+    Builds the RFC 8288 Link header pointing at the next page of the current
+    request
+
+    Parameters
+    ----------
+    **params
+        The query parameters that select the next page, e.g. the cursor of
+        the last row on the current page and the page size
+
+    Returns
+    -------
+    dict
+        Response headers containing the Link header
+    '''
+    args = request.args.to_dict()
+    args.update(params)
+
+    return {'Link': f'<{request.base_url}?{urlencode(args)}>; rel="next"'}
@@ -4,14 +4,31 @@
 # This means this file must exist and contain a read() function
 
 # Project modules
+from bulk import (
+    batch_response, bump_versions, chunked, in_values, item_error, select_in,
+    suspended_triggers, unindex_notes
+)
+from cache import cache, entry_cache, invalidate_people, list_key, person_key
+from conditional import (
+    abort_unchanged, collection_validators, conditional, precondition,
+    timestamp_token
+)
 from config import db
+from events import publish
+from filters import load_columns, prefix_filter
 from models import Note, Person, PersonSchema
+from metrics import timer
+from pagination import decode_cursor, encode_cursor, next_link, page
+from serializers import dump_person, format_timestamp, get_schema
+from stats import dump_person_stats, person_stats_query, totals
+from streaming import BATCH_SIZE, NDJSON, ndjson_response, wants_stream
 
 # System modules
 from datetime import datetime
 
 # 3rd party modules
 from flask import make_response, abort
+from sqlalchemy.exc import IntegrityError
 
 
 def get_timestamp():
@@ -47,27 +64,230 @@ def get_timestamp():
 
 
 # Create a handler for our read (GET) people
-def read_all():
+def read_all(limit=100, after=None, include=('notes',), stream=False,
+             lname=None, fname=None, fields=None):
     '''
-    This function responds to a request for /api/people with the complete
-    lists of people
+    This function responds to a request for /api/people with one page of the
+    list of people, or with all of them as an NDJSON stream
+
+    Parameters
+    ----------
+    limit : int, optional
+        Maximum number of people to return (default is 100)
+    after : str, optional
+        Cursor of the last person on the previous page (default is None)
+    include : list, optional
+        Related collections to embed in each person, pass ['counts'] to get
+        the note_count and last_note_at of each person instead of their
+        notes, or ['none'] to skip both (default is ['notes'])
+    stream : bool, optional
+        Stream every person after the cursor as NDJSON instead of returning
+        one page, also selected by Accept: application/x-ndjson (default is
+        False)
 
     Returns
     -------
     str
-        A JSON string of list of people ordered by last name
+        A JSON string of list of people ordered by last name, with a Link
+        header pointing at the next page when there is one
+    304
+        If the list didn't change since the caller's copy
     '''
+    notes = 'notes' in include
+    counts = 'counts' in include
+    stream = wants_stream(stream)
+
+    # Answer the poll of an unchanged list before loading any people
+    # The counts are columns of person, so writing a note bumps the version
+    # of both tables
+    tables = ('person', 'note') if notes else ('person',)
+    etag, last_modified = collection_validators(
+        tables, variant=NDJSON if stream else 'json'
+    )
+    # The format, and so the ETag, depends on the Accept header
+    not_modified, headers = conditional(etag, last_modified, vary='Accept')
+    if not_modified is not None:
+        return not_modified
+
+    # Was this page served since the tables last changed?
+    key = list_key(etag)
+    entry = None if stream else cache.get(key)
+    if entry is not None:
+        headers.update(entry['headers'])
+        return entry['data'], 200, headers
+
+    # Order by (lname, person_id) so every person has a unique position in
+    # the list that a cursor can point at
+    query = Person.query.order_by(Person.lname, Person.person_id)
+
+    # A last name prefix is a range of ix_person_lname, in the order of the
+    # list
+    if lname is not None:
+        query = query.filter(prefix_filter(Person.lname, lname))
+    if fname is not None:
+        query = query.filter(prefix_filter(Person.fname, fname))
+
+    # Only SELECT the columns the response needs, and the sort key
+    required = ('person_id', 'lname')
+    if counts:
+        required += ('note_count', 'last_note_at')
+    columns = load_columns(Person, fields, required)
+    if columns is not None:
+        query = query.options(db.load_only(*columns))
+
+    # Start right after the last person of the previous page
+    if after is not None:
+        lname, person_id = decode_cursor(after, str, int)
+        query = query.filter(after_person(lname, person_id))
+
+    # Load the notes of every person on the page with one extra
+    # SELECT ... WHERE person_id IN (...) instead of one SELECT per person
+    if notes:
+        query = query.options(db.selectinload(Person.notes))
+
+    if stream:
+        return ndjson_response(
+            iter_people(query),
+            lambda person: dump_person(
+                person, notes=notes, counts=counts, fields=fields
+            ),
+            headers,
+        )
+
     # Create list of people from our data
-    people = Person.query.order_by(Person.lname).all()
+    people, has_more = page(query, limit)
 
     # Serialize the data for the response
-    # many = True tells PersonSchema to expect an iterable to serialize
-    person_schema = PersonSchema(many=True)
+    with timer():
+        data = [
+            dump_person(person, notes=notes, counts=counts, fields=fields)
+            for person in people
+        ]
+
+    link = {}
+    if has_more:
+        last = people[-1]
+        cursor = encode_cursor(last.lname, last.person_id)
+        link = next_link(after=cursor, limit=limit)
+
+    cache.set(key, {'data': data, 'headers': link})
+    headers.update(link)
+
+    return data, 200, headers
+
+
+def iter_people(query):
+    '''
+    Yields every person of a query ordered by (lname, person_id)
+
+    The people are fetched BATCH_SIZE at a time with keyset pagination, which
+    unlike yield_per() works together with the selectinload() of the notes
+
+    Parameters
+    ----------
+    query : Query
+        The ordered query to run
+
+    Yields
+    ------
+    Person
+        The next person
+    '''
+    batch_query = query
+    while True:
+        people, has_more = page(batch_query, BATCH_SIZE)
+        yield from people
+
+        if not has_more:
+            return
+
+        last = people[-1]
+        batch_query = query.filter(after_person(last.lname, last.person_id))
+
+
+def after_person(lname, person_id):
+    '''
+    Builds the filter selecting the people that sort after a cursor position
+
+    NULL last names sort before every other last name in SQLite, so they need
+    their own branch of the comparison
+
+    Parameters
+    ----------
+    lname : str
+        Last name of the last person on the previous page
+    person_id : int
+        Id of the last person on the previous page
+
+    Returns
+    -------
+    BinaryExpression
+        The filter to apply to a query ordered by (lname, person_id)
+    '''
+    if lname is None:
+        return db.or_(
+            Person.lname.isnot(None),
+            db.and_(Person.lname.is_(None), Person.person_id > person_id),
+        )
+
+    return db.or_(
+        Person.lname > lname,
+        db.and_(Person.lname == lname, Person.person_id > person_id),
+    )
+
+
+def stats(limit=100, after=None):
+    '''
+    This function responds to a request for /api/people/stats with the
+    number of people and notes, and one page of the note statistics of each
+    person
+
+    Parameters
+    ----------
+    limit : int, optional
+        Maximum number of people to return (default is 100)
+    after : str, optional
+        Cursor of the last person on the previous page (default is None)
+
+    Returns
+    -------
+    dict
+        The totals, see stats.totals(), and the people ordered by person_id
+        with their note_count, last_note_at and last_activity, with a Link
+        header pointing at the next page when there is one
+    304
+        If no person or note changed since the caller's copy
+    '''
+    etag, last_modified = collection_validators(('person', 'note'))
+    not_modified, headers = conditional(etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    # The counts and statistics are kept by triggers, see models.py, so
+    # this reads one row per person on the page and never counts notes
+    query = person_stats_query()
+    if after is not None:
+        (person_id,) = decode_cursor(after, int)
+        query = query.filter(Person.person_id > person_id)
+
+    rows, has_more = page(query, limit)
 
-    # Return an object having a data attribute that Connexion can convert to
-    # JSON
-    data = person_schema.dump(people)
-    return data
+    data = totals()
+    data['per_person'] = [dump_person_stats(row) for row in rows]
+
+    if has_more:
+        cursor = encode_cursor(rows[-1].person_id)
+        headers.update(next_link(after=cursor, limit=limit))
+
+    return data, 200, headers
+
+
+# The columns the ETag of read_one() is made of, in order, which update()
+# and delete() check the version named by If-Match against
+VERSION_COLUMNS = (
+    Person.person_id, Person.timestamp, Person.note_count,
+    Person.last_note_at,
+)
 
 
 # Create handler for our read where an lname parameter is provided
@@ -85,32 +305,65 @@ def read_one(person_id):
     -------
     Person
         Person matching ID
+    304
+        If the person and their notes didn't change since the caller's copy
     '''
-    # Get the person requested
-    # The .outerjoin (left outer join in SQL) is necessary for the case where
-    # a user of the application has created a new Person, which has no notes
-    # related to it. Outer join ensures the SQL query returns a Person, even
-    # if there are no note rows to join with
-    # A join is like an AND operation and returns nothing if a Person exists
-    # but has no Notes
-    # An outer join is an OR operation which returns a Person even if it has
-    # no Notes
-    person = (
-        Person.query.filter(Person.person_id == person_id)
-        .outerjoin(Note)
-        .one_or_none()
-    )
-
-    # Did we find a person?
-    if person is not None:
-        # Serialize the data for the response
-        person_schema = PersonSchema()
-        data = person_schema.dump(person)
-
-        return data
-    # Otherwise, nope, not found
-    else:
-        abort(404, f'Person with Id: {person_id} not found')
+    # Serve hot people straight from the cache, the entry is invalidated as
+    # soon as the person or one of their notes changes
+    key = person_key(person_id)
+    entry = entry_cache.get(key)
+
+    if entry is None:
+        # Taken before the query, so an invalidation committed while we read
+        # keeps what we read out of the cache
+        token = entry_cache.token()
+
+        # Get the person requested, together with their notes in the same
+        # query
+        # joinedload() loads the notes with a left outer join, which is
+        # necessary for the case where a user of the application has created
+        # a new Person, which has no notes related to it. Outer join ensures
+        # the SQL query returns a Person, even if there are no note rows to
+        # join with
+        # A join is like an AND operation and returns nothing if a Person
+        # exists but has no Notes
+        # An outer join is an OR operation which returns a Person even if it
+        # has no Notes
+        person = (
+            Person.query.filter(Person.person_id == person_id)
+            .options(db.joinedload(Person.notes))
+            .one_or_none()
+        )
+
+        # Otherwise, nope, not found
+        if person is None:
+            abort(404, f'Person with Id: {person_id} not found')
+
+        # The response changes whenever the person or any of their notes do,
+        # so version it by the person's timestamp and the count and newest
+        # timestamp of their notes, which the person row keeps
+        entry = {
+            'etag': '-'.join([
+                str(person_id),
+                timestamp_token(person.timestamp),
+                str(person.note_count),
+                timestamp_token(person.last_note_at),
+            ]),
+            'last_modified': max(
+                filter(None, (person.timestamp, person.last_note_at)),
+                default=None,
+            ),
+            # Serialize the data for the response
+            # The same representation create() and update() return
+            'data': dump_person(person, counts=True),
+        }
+        entry_cache.set(key, entry, token)
+
+    not_modified, headers = conditional(entry['etag'], entry['last_modified'])
+    if not_modified is not None:
+        return not_modified
+
+    return entry['data'], 200, headers
 
 
 def create(person):
@@ -143,14 +396,20 @@ def create(person):
     if existing_person is None:
         # Create a person instance using the schema and the passed-in person
         schema = PersonSchema()
-        new_person = schema.load(person, session=db.session).data
+        new_person = schema.load(person, session=db.session)
 
         # Add the person to the database
+        # Another request may have inserted the same person since our check,
+        # in which case the unique constraint on (lname, fname) rejects it
         db.session.add(new_person)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            abort(409, f'Person {fname} {lname} already exists!')
 
         # Serialize and return the newly created person in the response
-        data = schema.dump(new_person)
+        data = get_schema(PersonSchema).dump(new_person)
         return data, 201
     # Otherwise, they exist, that's an error
     else:
@@ -172,32 +431,55 @@ def update(person_id, person):
     -------
     Person
         Updated person structure
+    404
+        If not found
+    409
+        If another person already has the same names
+    412
+        If the person changed since the version named by If-Match
     '''
-    # Get the person requested from the db into session
-    update_person = Person.query.filter(
-        Person.person_id == person_id
-    ).one_or_none()
-
-    # Did we find an existing person?
-    if update_person is not None:
-        # Turn the passed in person into a db object
-        schema = PersonSchema()
-        update = schema.load(person, session=db.session).data
-
-        # Set the id to the person we want to update
-        update.person_id = update_person.person_id
-
-        # Merge the new object into the old and commit it to the db
-        db.session.merge(update)
-        db.session.commit()
+    values = {
+        name: person[name] for name in ('fname', 'lname') if name in person
+    }
+    values['timestamp'] = datetime.utcnow()
+
+    # A single UPDATE, which changes no row when the person doesn't exist or
+    # isn't the version the caller read
+    table = Person.__table__
+    found = table.c.person_id == person_id
+    matches = precondition(*VERSION_COLUMNS)
+    statement = table.update().where(found).values(**values)
+    if matches is not None:
+        statement = statement.where(matches)
+    try:
+        result = db.session.execute(statement)
+    except IntegrityError:
+        db.session.rollback()
+        abort(409, 'Another person already has the same names')
+
+    if result.rowcount == 0:
+        abort_unchanged(
+            Person.query.filter(found), matches,
+            f'Person with Id {person_id} not found',
+        )
+
+    # Read the updated person and their notes for the response, in the
+    # write transaction, before the commit expires them
+    update_person = (
+        Person.query.filter(found)
+        .options(db.joinedload(Person.notes))
+        .one()
+    )
+    data = dump_person(update_person, counts=True)
 
-        # Return the updated person in the response
-        data = schema.dump(update_person)
+    # Core statements bypass the session events of cache.py, so register the
+    # cached entries that become stale ourselves
+    invalidate_people(db.session, [person_id], notes=[
+        (person_id, note['note_id']) for note in data['notes']
+    ])
+    db.session.commit()
 
-        return data, 200
-    # Otherwise, nope, that's an error
-    else:
-        abort(404, f'Person with Id {person_id} not found')
+    return data, 200
 
 
 def delete(person_id):
@@ -215,16 +497,240 @@ def delete(person_id):
         On successful delete
     404
         If not found
+    412
+        If the person changed since the version named by If-Match
     '''
-    # Get the person requested
-    person = Person.query.filter(Person.person_id == person_id).one_or_none()
+    # A single DELETE, which removes no row when the person doesn't exist or
+    # isn't the version the caller read
+    table = Person.__table__
+    found = table.c.person_id == person_id
+    matches = precondition(*VERSION_COLUMNS)
+    statement = table.delete().where(found)
+    if matches is not None:
+        statement = statement.where(matches)
+    result = db.session.execute(statement)
+
+    if result.rowcount == 0:
+        abort_unchanged(
+            Person.query.filter(found), matches,
+            f'Person with Id {person_id} not found',
+        )
+
+    # The ORM cascade doesn't apply to Core deletes, so remove the notes of
+    # the person ourselves, once the cache entries embedding them are known
+    note_table = Note.__table__
+    owned = note_table.c.person_id == person_id
+    notes = db.session.execute(
+        db.select([note_table.c.person_id, note_table.c.note_id]).where(owned)
+    ).fetchall()
+    invalidate_people(db.session, [person_id], notes=notes)
+    db.session.execute(note_table.delete().where(owned))
+    db.session.commit()
+
+    # The same events as notes.delete, for each note deleted with the person
+    for _, note_id in notes:
+        publish('note.deleted', {'note_id': note_id, 'person_id': person_id})
+
+    return make_response(f'Person {person_id} successfully deleted', 200)
+
+
+def batch(changes):
+    '''
+    This function creates, updates and deletes many people in one request and
+    one transaction
+
+    Everything the batch refers to is looked up before anything is written,
+    then each kind of change is sent to the database as a single
+    executemany(), so the cost per person is a fraction of a request to
+    people.create/update/delete
 
-    # Did we find a person?
-    if person is not None:
-        db.session.delete(person)
+    Parameters
+    ----------
+    changes : dict
+        Lists of people to create, people to update (with their person_id)
+        and person_ids to delete
+
+    Returns
+    -------
+    200
+        With the status of every item, in the order they were passed in
+    409
+        If a concurrent request made the batch conflict while it was written
+    '''
+    creates = changes.get('create', [])
+    updates = changes.get('update', [])
+    deletes = changes.get('delete', [])
+    now = datetime.utcnow()
+
+    # Who already owns each of the names used in the batch?
+    keys = {(person['lname'], person['fname']) for person in creates + updates}
+    rows = select_in(
+        db.session.query(Person.person_id, Person.lname, Person.fname),
+        Person.lname,
+        [lname for lname, fname in keys],
+    )
+    owners = {
+        (row.lname, row.fname): row.person_id
+        for row in rows if (row.lname, row.fname) in keys
+    }
+
+    # Which of the people to update or delete exist?
+    rows = select_in(
+        db.session.query(Person.person_id),
+        Person.person_id,
+        [person['person_id'] for person in updates] + deletes,
+    )
+    known_ids = {row.person_id for row in rows}
+
+    # Decide the fate of every item before writing anything
+    create_results, insert_rows = [], []
+    for person in creates:
+        key = (person['lname'], person['fname'])
+        if key in owners:
+            create_results.append(item_error(
+                409, f'Person {key[1]} {key[0]} already exists!'
+            ))
+            continue
+
+        owners[key] = None
+        insert_rows.append(
+            {'lname': key[0], 'fname': key[1], 'timestamp': now}
+        )
+        create_results.append(key)
+
+    update_results, update_rows = [], []
+    for person in updates:
+        person_id = person['person_id']
+        key = (person['lname'], person['fname'])
+        if person_id not in known_ids:
+            update_results.append(item_error(
+                404, f'Person with Id {person_id} not found'
+            ))
+        elif owners.get(key, person_id) != person_id:
+            update_results.append(item_error(
+                409, f'Person {key[1]} {key[0]} already exists!'
+            ))
+        else:
+            owners[key] = person_id
+            update_rows.append({
+                'b_person_id': person_id,
+                'lname': key[0],
+                'fname': key[1],
+                'timestamp': now,
+            })
+            update_results.append({
+                'status': 200,
+                'person': dump_written_person(person_id, key, now),
+            })
+
+    delete_results, delete_ids = [], []
+    for person_id in deletes:
+        if person_id in known_ids:
+            delete_ids.append(person_id)
+            delete_results.append({'status': 200, 'person_id': person_id})
+        else:
+            delete_results.append(item_error(
+                404, f'Person with Id {person_id} not found'
+            ))
+
+    # Write everything in one transaction, one statement per kind of change.
+    # The triggers would version the people and unindex, count and version
+    # the notes of the deleted ones one row at a time, the batch does it once
+    # per statement instead (see bulk.py)
+    # Core statements bypass the session events of cache.py, so register the
+    # cached entries that become stale ourselves
+    invalidate_people(db.session, [row['b_person_id'] for row in update_rows])
+    person_table = Person.__table__
+    note_table = Note.__table__
+    added = {'person': len(insert_rows), 'note': 0}
+    try:
+        with suspended_triggers(
+            db.session, 'table_version', 'note_fts', 'note_stats'
+        ):
+            if insert_rows:
+                db.session.execute(person_table.insert(), insert_rows)
+            if update_rows:
+                db.session.execute(
+                    person_table.update().where(
+                        person_table.c.person_id == db.bindparam('b_person_id')
+                    ),
+                    update_rows,
+                )
+            # The ORM cascade doesn't apply to Core deletes, so remove the
+            # notes of the deleted people ourselves. Their note statistics
+            # go with them. Their ids are read in the write transaction, so
+            # a note added meanwhile can't go without its event
+            deleted_notes = select_in(
+                db.session.query(Note.person_id, Note.note_id),
+                Note.person_id,
+                delete_ids,
+            )
+            invalidate_people(db.session, delete_ids, notes=deleted_notes)
+            unindex_notes(db.session, note_table.c.person_id, delete_ids)
+            delete_notes = note_table.delete().where(
+                in_values(note_table.c.person_id)
+            )
+            delete_people = person_table.delete().where(
+                in_values(person_table.c.person_id)
+            )
+            for chunk in chunked(delete_ids):
+                result = db.session.execute(delete_notes, {'b_values': chunk})
+                added['note'] -= result.rowcount
+                result = db.session.execute(delete_people, {'b_values': chunk})
+                added['person'] -= result.rowcount
+            if insert_rows or update_rows or delete_ids:
+                bump_versions(db.session, added)
         db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        abort(409, 'The batch conflicts with a concurrent change, retry it')
+
+    # The same events as notes.delete, for the notes deleted with a person
+    for person_id, note_id in deleted_notes:
+        publish('note.deleted', {'note_id': note_id, 'person_id': person_id})
+
+    # executemany() doesn't report the generated ids, read them back with the
+    # (lname, fname) unique index
+    created = [key for key in create_results if isinstance(key, tuple)]
+    rows = select_in(
+        db.session.query(Person.person_id, Person.lname, Person.fname),
+        Person.lname,
+        [lname for lname, fname in created],
+    )
+    created_ids = {(row.lname, row.fname): row.person_id for row in rows}
+    create_results = [
+        {
+            'status': 201,
+            'person': dump_written_person(created_ids[result], result, now),
+        }
+        if isinstance(result, tuple) else result
+        for result in create_results
+    ]
 
-        return make_response(f'Person {person_id} successfully deleted', 200)
-    # Otherwise, nope, person to delete not found
-    else:
-        abort(404, f'Person with Id {person_id} not found')
+    return batch_response(create_results, update_results, delete_results)
+
+
+def dump_written_person(person_id, key, timestamp):
+    '''
+    Serializes a person written by batch() without reading it back
+
+    Parameters
+    ----------
+    person_id : int
+        Id of the person
+    key : tuple
+        (lname, fname) of the person
+    timestamp : datetime
+        The timestamp the person was written with
+
+    Returns
+    -------
+    dict
+        JSON-friendly representation of the person
+    '''
+    return {
+        'fname': key[1],
+        'lname': key[0],
+        'person_id': person_id,
+        'timestamp': format_timestamp(timestamp),
+    }
@@ -0,0 +1,136 @@
+# This module holds the WSGI middleware recording the API traffic the
+# server answers, for replay.py to send against another instance later
+#
+# NOTE: Each request to /api is written as one JSON object per line:
+#
+#       {"t": 12.031, "method": "PUT", "path": "/api/people/1?x=1",
+#        "headers": {"Content-Type": "application/json"},
+#        "body": "{\"fname\": \"Doug\", \"lname\": \"Farrell\"}",
+#        "status": 200, "duration_ms": 4.2, "response_length": 311,
+#        "response_sha1": "9c1185a5c5e9fc54612808977ee8f548b2258d31"}
+#
+#       t is the number of seconds since recording started, so replay.py
+#       can send the requests with the same spacing. The duration covers
+#       the whole response, including streamed bodies
+#
+#       Recording is turned on with the RECORD_TRAFFIC setting in config.py.
+#       Several processes (e.g. gunicorn workers) should each get their own
+#       file by putting {pid} in its name
+
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+# Only requests to these paths are recorded
+PREFIX = '/api/'
+
+# Request headers replay.py needs to send the same request again
+HEADERS = (
+    'Content-Type', 'Accept', 'If-None-Match', 'If-Modified-Since',
+    'If-Match',
+)
+
+# Request bodies longer than this are not kept (the request is still
+# recorded, marked with body_truncated, and replay.py skips it)
+MAX_BODY = 64 * 1024
+
+
+class TrafficRecorder:
+    '''
+    WSGI middleware writing every API request and its outcome to a file
+
+    Attributes
+    ----------
+    app : callable
+        The wrapped WSGI application
+    path : str
+        The file the requests are appended to, {pid} is replaced by the id
+        of the process
+    '''
+    def __init__(self, app, path):
+        self.app = app
+        self.path = path
+        self._file = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not path.startswith(PREFIX):
+            return self.app(environ, start_response)
+
+        start = time.perf_counter()
+        record = {
+            't': round(time.time() - self._started, 3),
+            'method': environ['REQUEST_METHOD'],
+            'path': path,
+            'headers': {},
+            'body': None,
+        }
+        if environ.get('QUERY_STRING'):
+            record['path'] += '?' + environ['QUERY_STRING']
+        for name in HEADERS:
+            # WSGI passes Content-Type without the HTTP_ prefix
+            key = name.upper().replace('-', '_')
+            if key != 'CONTENT_TYPE':
+                key = 'HTTP_' + key
+            if environ.get(key):
+                record['headers'][name] = environ[key]
+
+        # Read the body so it can be recorded, and hand the app a copy
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        if length:
+            body = environ['wsgi.input'].read(length)
+            environ['wsgi.input'] = io.BytesIO(body)
+            if length <= MAX_BODY:
+                record['body'] = body.decode('utf-8', 'replace')
+            else:
+                record['body_truncated'] = True
+
+        def recording_start_response(status, headers, exc_info=None):
+            record['status'] = int(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+
+        result = self.app(environ, recording_start_response)
+
+        return self._recorded(result, record, start)
+
+    def _recorded(self, result, record, start):
+        '''
+        Passes the response body through, then writes the record
+        '''
+        digest = hashlib.sha1()
+        length = 0
+        try:
+            for chunk in result:
+                digest.update(chunk)
+                length += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+            record['duration_ms'] = round(
+                (time.perf_counter() - start) * 1000, 3
+            )
+            record['response_length'] = length
+            record['response_sha1'] = digest.hexdigest()
+            self._write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def _write(self, line):
+        '''
+        Appends a line to the file of the current process
+        '''
+        with self._lock:
+            # The file is opened on first use, so a worker forked from a
+            # preloading master (see gunicorn.conf.py) opens its own
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                # Line buffered, so every record is written out as one line
+                self._file = open(
+                    self.path.format(pid=self._pid), 'a', buffering=1
+                )
+            self._file.write(line)
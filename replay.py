@@ -0,0 +1,232 @@
+# A utility program to replay API traffic recorded by recorder.py against a
+# running server, and compare the results with the recording
+#
+# Usage:
+#     python replay.py TRAFFIC.jsonl [--url URL] [--speed X] [--clients N]
+#                      [--show-mismatches N]
+#
+# --speed 1 sends the requests with the spacing they were recorded with,
+# 2 twice as fast, and 0 as fast as the clients can go
+#
+# The report groups the requests by method and path, with the ids in the
+# path replaced by {id}, and shows for each group the recorded and replayed
+# latency percentiles and how many responses differ from the recording in
+# status or body. Responses that depend on the time (timestamps of writes,
+# new ids) differ on every replay, so judge body mismatches per group, and
+# replay against a copy of the database the traffic was recorded on
+
+import argparse
+import hashlib
+import http.client
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# Ids in paths, e.g. /api/people/12/notes/3 -> /api/people/{id}/notes/{id}
+ID = re.compile(r'/\d+(?=/|\?|$)')
+
+
+def load_traffic(path):
+    '''
+    Reads the requests of a traffic file
+
+    Parameters
+    ----------
+    path : str
+        The JSON lines file written by recorder.TrafficRecorder
+
+    Returns
+    -------
+    list
+        The recorded requests that can be replayed, in the order they
+        were sent
+    '''
+    with open(path) as traffic:
+        records = [json.loads(line) for line in traffic if line.strip()]
+
+    records = [
+        record for record in records if not record.get('body_truncated')
+    ]
+    records.sort(key=lambda record: record['t'])
+
+    return records
+
+
+def group_of(record):
+    '''
+    Returns the name of the group a request is reported in
+    '''
+    path = record['path'].split('?')[0]
+
+    return f'{record["method"]} {ID.sub("/{id}", path)}'
+
+
+def percentile(values, fraction):
+    '''
+    Returns the value below which the given fraction of the values fall
+
+    Parameters
+    ----------
+    values : list
+        The sorted values
+    fraction : float
+        The fraction, e.g. 0.99 for the 99th percentile
+
+    Returns
+    -------
+    float
+        The percentile, or 0 without values
+    '''
+    if not values:
+        return 0
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class Replayer:
+    '''
+    Sends recorded requests to a server over keep-alive connections
+
+    Attributes
+    ----------
+    url : str
+        Base URL of the server
+    results : list
+        (record, status, duration_ms, sha1) of every replayed request
+    '''
+    def __init__(self, url):
+        target = urlsplit(url)
+        self.host = target.hostname
+        self.port = target.port
+        self.results = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def connection(self):
+        '''
+        Returns the connection of the current thread
+        '''
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = http.client.HTTPConnection(
+                self.host, self.port
+            )
+        return self._local.connection
+
+    def send(self, record):
+        '''
+        Sends one recorded request and stores its outcome
+        '''
+        body = record.get('body')
+        start = time.perf_counter()
+        try:
+            connection = self.connection()
+            connection.request(
+                record['method'], record['path'],
+                body.encode('utf-8') if body is not None else None,
+                record.get('headers', {}),
+            )
+            response = connection.getresponse()
+            content = response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            self._local.connection = None
+            content, status = b'', None
+        duration = (time.perf_counter() - start) * 1000
+
+        with self._lock:
+            self.results.append(
+                (record, status, duration, hashlib.sha1(content).hexdigest())
+            )
+
+    def replay(self, records, speed, clients):
+        '''
+        Sends the requests, keeping their recorded spacing scaled by speed
+
+        Parameters
+        ----------
+        records : list
+            The recorded requests, in the order they were sent
+        speed : float
+            How much faster than recorded to send them, 0 for no waiting
+        clients : int
+            Maximum number of requests in flight
+        '''
+        start = time.perf_counter()
+        first = records[0]['t'] if records else 0
+        with ThreadPoolExecutor(max_workers=clients) as pool:
+            for record in records:
+                if speed:
+                    delay = (record['t'] - first) / speed
+                    wait = start + delay - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                pool.submit(self.send, record)
+
+
+def report(results, show_mismatches):
+    '''
+    Prints the latency and mismatch report of a replay
+    '''
+    groups = {}
+    for result in results:
+        groups.setdefault(group_of(result[0]), []).append(result)
+
+    print(f'{"request":<40} {"count":>6} {"recorded p50/p95":>18} '
+          f'{"replayed p50/p95":>18} {"p50":>8} {"status":>7} {"body":>6}')
+    examples = []
+    for name, group in sorted(groups.items()):
+        recorded = sorted(record['duration_ms'] for record, *_ in group)
+        replayed = sorted(duration for _, _, duration, _ in group)
+        status_mismatches = body_mismatches = 0
+        for record, status, duration, sha1 in group:
+            if status != record['status']:
+                status_mismatches += 1
+                examples.append(
+                    f'{name}: {record["path"]} status {record["status"]} -> '
+                    f'{status}'
+                )
+            elif sha1 != record['response_sha1']:
+                body_mismatches += 1
+        old, new = percentile(recorded, 0.5), percentile(replayed, 0.5)
+        change = (new / old - 1) * 100 if old else 0
+        print(f'{name:<40} {len(group):6d} '
+              f'{old:8.2f}/{percentile(recorded, 0.95):<9.2f} '
+              f'{new:8.2f}/{percentile(replayed, 0.95):<9.2f} '
+              f'{change:+7.1f}% {status_mismatches:7d} {body_mismatches:6d}')
+
+    for example in examples[:show_mismatches]:
+        print(example)
+
+
+def main():
+    '''
+    Parses the command line and replays the traffic
+    '''
+    parser = argparse.ArgumentParser(
+        description='Replay API traffic recorded by recorder.py'
+    )
+    parser.add_argument('traffic', help='JSON lines file of recorded traffic')
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--speed', type=float, default=1,
+                        help='Speed up factor, 0 sends without waiting')
+    parser.add_argument('--clients', type=int, default=16,
+                        help='Maximum number of requests in flight')
+    parser.add_argument('--show-mismatches', type=int, default=10,
+                        help='Number of status mismatches to list')
+    args = parser.parse_args()
+
+    records = load_traffic(args.traffic)
+    replayer = Replayer(args.url)
+    start = time.perf_counter()
+    replayer.replay(records, args.speed, args.clients)
+    seconds = time.perf_counter() - start
+    print(f'{len(records)} requests replayed in {seconds:.1f}s')
+
+    report(replayer.results, args.show_mismatches)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+# This module holds the serializers used by the handlers in people.py and
+# notes.py to turn Person and Note objects into JSON-friendly dicts.
+#
+# NOTE: Building a ModelSchema is expensive. marshmallow-sqlalchemy
+#       introspects the model on every instantiation and nested schemas given
+#       by name ('PersonNoteSchema', 'NotePersonSchema') are looked up in the
+#       class registry the first time they are used. Doing that on every
+#       request dominated the CPU time of our small responses, so schemas are
+#       built once and cached here, and the read endpoints skip marshmallow
+#       entirely with the plain dump_person()/dump_note() functions below
+
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def get_schema(schema_class, many=False, exclude=(), only=None):
+    '''
+    Returns a cached instance of a schema for serializing data
+
+    The cached instances are shared between requests (and threads), so they
+    must only be used for dump(). ModelSchema.load() stores the instance it
+    is loading into on the schema, so deserializing still needs a schema of
+    its own
+
+    Parameters
+    ----------
+    schema_class : type
+        The marshmallow schema class to instantiate
+    many : bool, optional
+        Whether the schema serializes a list of objects (default is False)
+    exclude : tuple, optional
+        Names of the fields to leave out (default is empty)
+    only : tuple, optional
+        Names of the only fields to include (default is None, all fields)
+
+    Returns
+    -------
+    Schema
+        The shared schema instance for this combination of arguments
+    '''
+    return schema_class(many=many, exclude=exclude, only=only)
+
+
+def format_timestamp(timestamp):
+    '''
+    Formats a timestamp the same way the ModelSchema DateTime fields do
+
+    Parameters
+    ----------
+    timestamp : datetime
+        The timestamp to format, may be None
+
+    Returns
+    -------
+    str
+        ISO 8601 representation of the timestamp, or None
+    '''
+    return timestamp.isoformat() if timestamp is not None else None
+
+
+def format_nested_timestamp(timestamp):
+    '''
+    Formats a timestamp the same way the fields.Str() timestamps of the
+    nested PersonNoteSchema and NotePersonSchema do
+
+    Parameters
+    ----------
+    timestamp : datetime
+        The timestamp to format, may be None
+
+    Returns
+    -------
+    str
+        str() of the timestamp, or None
+    '''
+    return str(timestamp) if timestamp is not None else None
+
+
+# The fields a sparse fieldset (the fields parameter of the list endpoints)
+# can pick, with how to serialize each of them
+PERSON_FIELDS = {
+    'person_id': lambda person: person.person_id,
+    'fname': lambda person: person.fname,
+    'lname': lambda person: person.lname,
+    'timestamp': lambda person: format_timestamp(person.timestamp),
+    'note_count': lambda person: person.note_count,
+    'last_note_at': lambda person: format_timestamp(person.last_note_at),
+}
+NOTE_FIELDS = {
+    'note_id': lambda note: note.note_id,
+    'person_id': lambda note: note.person_id,
+    'content': lambda note: note.content,
+    'timestamp': lambda note: format_timestamp(note.timestamp),
+}
+
+
+def dump_person(person, notes=True, counts=False, fields=None):
+    '''
+    Serializes a Person without going through marshmallow
+
+    With notes and counts the dict is the one PersonSchema().dump() returns,
+    which is what the endpoints of a single person answer with. The list
+    endpoints leave the counts out unless they are asked for
+
+    Parameters
+    ----------
+    person : Person
+        The person to serialize
+    notes : bool, optional
+        Whether to embed the notes of the person (default is True)
+    counts : bool, optional
+        Whether to add the note_count and last_note_at of the person, the
+        compact alternative to embedding the notes (default is False)
+    fields : list, optional
+        Names of PERSON_FIELDS to return instead of the fields PersonSchema
+        returns, only these attributes are read (default is None)
+
+    Returns
+    -------
+    dict
+        JSON-friendly representation of the person
+    '''
+    if fields is None:
+        data = {
+            'fname': person.fname,
+            'lname': person.lname,
+            'person_id': person.person_id,
+            'timestamp': format_timestamp(person.timestamp),
+        }
+    else:
+        data = {name: PERSON_FIELDS[name](person) for name in fields}
+
+    if counts:
+        data['note_count'] = person.note_count
+        data['last_note_at'] = format_timestamp(person.last_note_at)
+
+    if notes:
+        data['notes'] = [
+            {
+                'content': note.content,
+                'note_id': note.note_id,
+                'person_id': note.person_id,
+                'timestamp': format_nested_timestamp(note.timestamp),
+            }
+            for note in person.notes
+        ]
+
+    return data
+
+
+def dump_note(note, person=True, fields=None):
+    '''
+    Serializes a Note into the same dict NoteSchema().dump() returns
+
+    Parameters
+    ----------
+    note : Note
+        The note to serialize
+    person : bool, optional
+        Whether to embed the person the note belongs to (default is True)
+    fields : list, optional
+        Names of NOTE_FIELDS to return instead of the fields NoteSchema
+        returns, only these attributes are read (default is None)
+
+    Returns
+    -------
+    dict
+        JSON-friendly representation of the note
+    '''
+    if fields is None:
+        data = {
+            'content': note.content,
+            'note_id': note.note_id,
+            'timestamp': format_timestamp(note.timestamp),
+        }
+    else:
+        data = {name: NOTE_FIELDS[name](note) for name in fields}
+
+    if person:
+        owner = note.person
+        data['person'] = None if owner is None else {
+            'fname': owner.fname,
+            'lname': owner.lname,
+            'person_id': owner.person_id,
+            'timestamp': format_nested_timestamp(owner.timestamp),
+        }
+
+    return data
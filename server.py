@@ -1,6 +1,10 @@
 from flask import render_template
 
 import config
+import metrics
+import slow_queries
+from recorder import TrafficRecorder
+from spec_cache import add_api
 
 # Create application instance
 # USING FLASK
@@ -9,8 +13,21 @@ import config
 # USING CONNECTION
 connex_app = config.connex_app
 
-# Read the swagger.yml file to configure the endpoints
-connex_app.add_api('swagger.yml')
+# Read the swagger.yml file to configure the endpoints, from the validated
+# copy kept by spec_cache.py when it is up to date
+api = add_api(connex_app)
+
+# Record the timings of the API requests and serve them on /metrics
+metrics.init_app(connex_app.app, api)
+
+# Log the queries slower than SLOW_QUERY_THRESHOLD with their query plans
+slow_queries.init_app(connex_app.app)
+
+# Record the API requests for replay.py when RECORD_TRAFFIC names a file
+if connex_app.app.config['RECORD_TRAFFIC']:
+    connex_app.app.wsgi_app = TrafficRecorder(
+        connex_app.app.wsgi_app, connex_app.app.config['RECORD_TRAFFIC']
+    )
 
 
 # Create URL route for "/"
@@ -24,7 +41,9 @@ def home():
     str
         The rendered template 'home.html'
     '''
-    return render_template('home.html')
+    return render_template(
+        'home.html', live_updates=connex_app.app.config['EVENTS_STREAM']
+    )
 
 
 # Create URL route for '/people'
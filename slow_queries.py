@@ -0,0 +1,221 @@
+# This module logs the SQL queries that take longer than the
+# SLOW_QUERY_THRESHOLD setting in config.py, together with SQLite's plan for
+# them, so slow requests can be explained without SQLALCHEMY_ECHO
+#
+# NOTE: Each slow query is written as one JSON object per line to the
+#       rotating SLOW_QUERY_LOG file, e.g.
+#
+#       {"time": "2020-01-05T10:02:11.512", "duration_ms": 153.2,
+#        "operation": "people.create", "caller": "people.py:301 in create",
+#        "statement": "SELECT ... WHERE person.fname = ? AND ...",
+#        "parameters": ["Kent", "Brockman"], "executemany": false,
+#        "parameter_sets": null, "plan": ["SCAN person"], "full_scan": true,
+#        "temp_btree": false}
+#
+#       full_scan is set when SQLite reads a whole table instead of using an
+#       index, temp_btree when it has to sort or group the rows itself. Both
+#       usually mean an index is missing (see __table_args__ in models.py)
+#
+#       The plan comes from running EXPLAIN QUERY PLAN with the same
+#       parameters on the same connection right after the slow query, which
+#       only costs anything for the queries that are logged
+
+import json
+import logging
+import os
+import sqlite3
+import time
+import traceback
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import app, basedir
+from metrics import operation_name
+
+logger = logging.getLogger('people.slow_queries')
+
+# Statements SQLite can explain
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+# Longer parameter values (e.g. note contents) are cut to this many
+# characters in the log
+MAX_PARAMETER_LENGTH = 200
+
+
+class JSONFormatter(logging.Formatter):
+    '''
+    Formats the slow query records as one JSON object per line
+    '''
+    def format(self, record):
+        entry = {
+            'time': datetime.utcfromtimestamp(record.created).isoformat(
+                timespec='milliseconds'
+            ),
+        }
+        entry.update(record.slow_query)
+
+        return json.dumps(entry, default=str)
+
+
+def explain(dbapi_connection, statement, parameters):
+    '''
+    Asks SQLite how it runs a statement
+
+    Parameters
+    ----------
+    dbapi_connection : sqlite3.Connection
+        The connection the statement ran on
+    statement : str
+        The SQL statement
+    parameters : tuple or dict
+        The parameters it ran with
+
+    Returns
+    -------
+    list
+        The detail column of each step of the plan, or None when the
+        statement can't be explained
+    '''
+    if not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+
+    # A plain cursor, so the plan's rows aren't counted by metrics.py
+    cursor = dbapi_connection.cursor(sqlite3.Cursor)
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    except sqlite3.Error:
+        return None
+    finally:
+        cursor.close()
+
+
+def is_full_scan(step):
+    '''
+    Tells whether a step of a query plan reads a whole table
+
+    SQLite writes "SCAN person" (or "SCAN TABLE person" before 3.36) when it
+    walks a table without an index, and "SCAN person USING INDEX ..." when it
+    walks an index in order, which is what a keyset page wants
+    '''
+    return (
+        step.startswith('SCAN ')
+        and 'USING' not in step
+        and 'VIRTUAL TABLE' not in step
+    )
+
+
+def find_caller():
+    '''
+    Returns where in the project the current query was run from
+
+    Returns
+    -------
+    str
+        "file.py:line in function" of the innermost frame of a project module
+        other than this one, or None
+    '''
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        # Code SQLAlchemy generates at runtime has "<string>" as file name
+        if (os.path.dirname(filename) == basedir
+                and filename.endswith('.py')
+                and filename != os.path.abspath(__file__)):
+            return (
+                f'{os.path.basename(filename)}:{frame.lineno} '
+                f'in {frame.name}'
+            )
+
+    return None
+
+
+def shorten(value):
+    '''
+    Cuts long strings down to MAX_PARAMETER_LENGTH characters for the log
+    '''
+    if isinstance(value, str) and len(value) > MAX_PARAMETER_LENGTH:
+        return value[:MAX_PARAMETER_LENGTH] + '...'
+
+    return value
+
+
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    '''
+    Remembers when a query started
+
+    The time is kept on the execution context of the statement, which goes
+    away with it, so a statement that fails (and never gets to end_query())
+    leaves nothing behind on the pooled connection
+    '''
+    if context is not None:
+        context.slow_query_start = time.perf_counter()
+
+
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    '''
+    Logs the query if it was slower than the threshold
+    '''
+    start = getattr(context, 'slow_query_start', None)
+    if start is None:
+        return
+
+    duration = time.perf_counter() - start
+    if duration < app.config['SLOW_QUERY_THRESHOLD']:
+        return
+
+    # executemany() ran the statement once per parameter set, explain it
+    # with the first one
+    first = parameters[0] if executemany and parameters else parameters
+    plan = None
+    if isinstance(conn.connection.connection, sqlite3.Connection):
+        plan = explain(conn.connection.connection, statement, first)
+
+    if isinstance(first, dict):
+        logged = {key: shorten(value) for key, value in first.items()}
+    else:
+        logged = [shorten(value) for value in first or ()]
+
+    logger.warning('slow query', extra={'slow_query': {
+        'duration_ms': round(duration * 1000, 3),
+        'operation': operation_name() if has_request_context() else None,
+        'caller': find_caller(),
+        'statement': statement,
+        'parameters': logged,
+        'executemany': executemany,
+        'parameter_sets': len(parameters) if executemany else None,
+        'plan': plan,
+        'full_scan': any(map(is_full_scan, plan or ())),
+        'temp_btree': any('TEMP B-TREE' in step for step in plan or ()),
+    }})
+
+
+def init_app(app):
+    '''
+    Starts logging the slow queries of an app, unless SLOW_QUERY_THRESHOLD
+    is None
+
+    Parameters
+    ----------
+    app : Flask
+        The Flask app
+    '''
+    if app.config['SLOW_QUERY_THRESHOLD'] is None:
+        return
+
+    handler = RotatingFileHandler(
+        app.config['SLOW_QUERY_LOG'],
+        maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+        backupCount=app.config['SLOW_QUERY_LOG_BACKUPS'],
+    )
+    handler.setFormatter(JSONFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING)
+    # Keep the entries out of the app's normal log
+    logger.propagate = False
+
+    event.listen(Engine, 'before_cursor_execute', start_query)
+    event.listen(Engine, 'after_cursor_execute', end_query)
@@ -0,0 +1,221 @@
+# This module keeps a validated, ref-resolved copy of swagger.yml on disk so
+# server.py doesn't have to parse and validate the spec on every start
+#
+# NOTE: connex_app.add_api('swagger.yml') renders the file with Jinja2,
+#       parses the YAML, validates it with openapi-spec-validator and resolves
+#       every $ref before registering a single route. The result only depends
+#       on the contents of swagger.yml and the Connexion version, so it is
+#       built once, pickled into SPEC_CACHE_DIR under a hash of both, and
+#       later starts unpickle it instead. Editing swagger.yml changes the hash,
+#       so a stale copy is never used
+#
+#       Connexion's API class builds the Specification itself, through the
+#       Specification name of connexion.apis.abstract. add_api() below puts
+#       PrebuiltSpecification there for the duration of its own call only,
+#       so other apps and APIs (e.g. in tests) get Connexion's behaviour
+#
+# Build the cache ahead of time (e.g. while building an image) with:
+#
+#     python spec_cache.py
+
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import connexion
+from connexion.apis import abstract
+from connexion.spec import Specification
+
+from config import app, basedir
+
+logger = logging.getLogger(__name__)
+
+SPEC_FILE = os.path.join(basedir, 'swagger.yml')
+
+
+class ValidatedSpec(dict):
+    '''
+    The raw spec, carrying the Specification Connexion built from it
+
+    add_api() only passes dicts on to the API class untouched, which is why
+    this is one
+    '''
+    def __init__(self, specification):
+        super().__init__(specification.raw)
+        self.specification = specification
+
+
+class PrebuiltSpecification(Specification):
+    '''
+    Lets the API class take a ValidatedSpec
+
+    Connexion's API class always builds (and validates) the Specification
+    itself. prebuilt_specification() installs this class in its place; it
+    hands the Specification of a ValidatedSpec through untouched and leaves
+    everything else to Connexion
+    '''
+    @classmethod
+    def load(cls, spec, arguments=None):
+        if isinstance(spec, ValidatedSpec):
+            return spec.specification
+
+        return Specification.load(spec, arguments=arguments)
+
+
+def spec_hash(path=SPEC_FILE):
+    '''
+    Hashes a spec file together with everything its cached form depends on
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the spec file (default is swagger.yml)
+
+    Returns
+    -------
+    str
+        Hex digest identifying the cached form of the spec
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as spec_file:
+        digest.update(spec_file.read())
+    # The pickle holds Connexion objects, so a different version of Connexion
+    # (or of pickle) needs a fresh copy
+    versions = f'{connexion.__version__} {pickle.HIGHEST_PROTOCOL}'
+    digest.update(versions.encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+def cache_path(path=SPEC_FILE):
+    '''
+    Returns where the cached form of a spec file is stored
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the spec file (default is swagger.yml)
+
+    Returns
+    -------
+    str
+        Path of the pickle, or None when SPEC_CACHE_DIR is empty
+    '''
+    cache_dir = app.config['SPEC_CACHE_DIR']
+    if not cache_dir:
+        return None
+
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    return os.path.join(cache_dir, f'{name}-{spec_hash(path)}.pickle')
+
+
+def build_spec(path=SPEC_FILE):
+    '''
+    Parses and validates a spec file and stores its cached form
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the spec file (default is swagger.yml)
+
+    Returns
+    -------
+    Specification
+        The validated spec with its refs resolved
+    '''
+    spec = Specification.load(path)
+
+    target = cache_path(path)
+    if target is None:
+        return spec
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Write to a temporary file and rename it, so workers starting at the
+    # same time never read a half written pickle
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(target))
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            pickle.dump(spec, temp_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, target)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    return spec
+
+
+def load_spec(path=SPEC_FILE):
+    '''
+    Returns the spec for add_api(), from the cache when it is up to date
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the spec file (default is swagger.yml)
+
+    Returns
+    -------
+    ValidatedSpec
+        The validated spec, ready to be passed to add_api()
+    '''
+    target = cache_path(path)
+    if target is not None:
+        try:
+            with open(target, 'rb') as cache_file:
+                return ValidatedSpec(pickle.load(cache_file))
+        except FileNotFoundError:
+            pass
+        except Exception:
+            # A corrupt or incompatible copy is rebuilt below
+            logger.warning('Ignoring unreadable spec cache %s', target,
+                           exc_info=True)
+
+    return ValidatedSpec(build_spec(path))
+
+
+@contextmanager
+def prebuilt_specification():
+    '''
+    Lets the API classes created in the block take a ValidatedSpec, and
+    restores Connexion's Specification afterwards
+    '''
+    original = abstract.Specification
+    abstract.Specification = PrebuiltSpecification
+    try:
+        yield
+    finally:
+        abstract.Specification = original
+
+
+def add_api(connex_app, path=SPEC_FILE, **kwargs):
+    '''
+    Registers the API of a spec file, from the cache when it is up to date
+
+    Parameters
+    ----------
+    connex_app : connexion.App
+        The app to register the API with
+    path : str, optional
+        Path of the spec file (default is swagger.yml)
+    **kwargs
+        Passed on to connex_app.add_api()
+
+    Returns
+    -------
+    AbstractAPI
+        The API add_api() created
+    '''
+    spec = load_spec(path)
+    with prebuilt_specification():
+        return connex_app.add_api(spec, **kwargs)
+
+
+if __name__ == '__main__':
+    spec_path = sys.argv[1] if len(sys.argv) > 1 else SPEC_FILE
+    build_spec(spec_path)
+    print(f'Validated {spec_path} into {cache_path(spec_path)}')
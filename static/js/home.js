@@ -4,6 +4,16 @@
 
 /* jshint esversion: 8 */
 
+/**
+ * Returns the URL of the next page named by the Link header of a list
+ * response, or null on the last page
+ */
+function nextPage(response) {
+    let link = response.headers.get("Link");
+    let match = link && link.match(/<([^>]*)>;\s*rel="next"/);
+    return match ? match[1] : null;
+}
+
 /**
  * This is the model class which provides access to the server REST API
  * @type {{}}
@@ -17,10 +27,28 @@ class Model {
                 "Content-Type": "application/json"
             }
         };
-        // call the REST endpoint and wait for data
-        let response = await fetch("/api/notes", options);
-        let data = await response.json();
-        return data;
+        // call the REST endpoint and wait for data, following the Link
+        // header to the next page until the last one
+        let notes = [];
+        let url = "/api/notes?limit=1000";
+        while (url) {
+            let response = await fetch(url, options);
+            notes = notes.concat(await response.json());
+            url = nextPage(response);
+        }
+        return notes;
+    }
+
+    subscribe(handlers) {
+        // Get every change to the notes pushed by the server, instead of
+        // polling the whole list
+        let source = new EventSource("/api/notes/stream");
+        Object.entries(handlers).forEach(([name, handler]) => {
+            source.addEventListener(name, (evt) => {
+                handler(JSON.parse(evt.data));
+            });
+        });
+        return source;
     }
 }
 
@@ -34,23 +62,40 @@ class View {
         this.error = document.querySelector(".error");
     }
 
-    buildTable(notes) {
-        let tbody = this.table.createTBody();
-        let html = "";
-
-        // Iterate over the notes and build the table
-        notes.forEach((note) => {
-            html += `
+    buildRow(note) {
+        return `
             <tr data-person_id="${note.person.person_id}" data-note_id="${note.note_id}">
                 <td class="timestamp">${note.timestamp}</td>
                 <td class="name">${note.person.fname} ${note.person.lname}</td>
                 <td class="content">${note.content}</td>
             </tr>`;
+    }
+
+    buildTable(notes) {
+        let tbody = this.table.tBodies[0] || this.table.createTBody();
+        let html = "";
+
+        // Iterate over the notes and build the table
+        notes.forEach((note) => {
+            html += this.buildRow(note);
         });
         // Replace the tbody with our new content
         tbody.innerHTML = html;
     }
 
+    addNote(note) {
+        // The newest notes are at the top
+        this.removeNote(note);
+        this.table.tBodies[0].insertAdjacentHTML("afterbegin", this.buildRow(note));
+    }
+
+    removeNote(note) {
+        let row = this.table.querySelector(`tr[data-note_id="${note.note_id}"]`);
+        if (row !== null) {
+            row.remove();
+        }
+    }
+
     errorMessage(message) {
         this.error.innerHTML = message;
         this.error.classList.remove("hidden");
@@ -81,6 +126,18 @@ class Controller {
             this.view.errorMessage(err);
         }
 
+        // Keep the table up to date with the changes the server pushes, when
+        // the way it is deployed can hold the stream open
+        if (document.querySelector(".blog").dataset.liveUpdates === "on") {
+            this.model.subscribe({
+                "note.created": (note) => this.view.addNote(note),
+                "note.updated": (note) => this.view.addNote(note),
+                "note.deleted": (note) => this.view.removeNote(note),
+                // Some changes were missed, read the whole list again
+                "reset": async () => this.view.buildTable(await this.model.read())
+            });
+        }
+
         // handle application events
         document.querySelector("table tbody").addEventListener("dblclick", (evt) => {
             let target = evt.target,
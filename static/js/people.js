@@ -4,6 +4,16 @@
 
 /* jshint esversion: 8 */
 
+/**
+ * Returns the URL of the next page named by the Link header of a list
+ * response, or null on the last page
+ */
+function nextPage(response) {
+    let link = response.headers.get("Link");
+    let match = link && link.match(/<([^>]*)>;\s*rel="next"/);
+    return match ? match[1] : null;
+}
+
 /**
  * This is the model class which provides access to the server REST API
  * @type {{}}
@@ -18,10 +28,18 @@ class Model {
                 "accepts": "application/json"
             }
         };
-        // Call the REST endpoint and wait for data
-        let response = await fetch("/api/people", options);
-        let data = await response.json();
-        return data;
+        // Call the REST endpoint and wait for data, the table only needs
+        // the counts of each person's notes, not the notes themselves.
+        // The API answers a page at a time, so follow the Link header to
+        // the next page until the last one
+        let people = [];
+        let url = "/api/people?include=counts&limit=1000";
+        while (url) {
+            let response = await fetch(url, options);
+            people = people.concat(await response.json());
+            url = nextPage(response);
+        }
+        return people;
     }
 
     async readOne(personId) {
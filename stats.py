@@ -0,0 +1,123 @@
+# This module holds the helpers used by people.stats and notes.stats to
+# answer with counts and aggregates of the people and notes
+#
+# NOTE: Nothing here counts or scans the tables. The row counts come from
+#       table_version and the note statistics of each person from the
+#       note_count and last_note_at columns of person, which the triggers in
+#       models.py (or the batch endpoints, once per batch) keep up to date in
+#       the same transaction as every insert, update and delete of a note, so
+#       they can't drift from the rows they describe
+
+from config import db
+from models import Note, Person, TableVersion
+from serializers import format_timestamp
+
+
+def totals():
+    '''
+    Returns the number of people and notes
+
+    Returns
+    -------
+    dict
+        The people and notes counts and the mean number of notes per person
+    '''
+    counts = dict(
+        db.session.query(TableVersion.name, TableVersion.row_count)
+        .filter(TableVersion.name.in_(('person', 'note')))
+        .all()
+    )
+    people = counts.get('person', 0)
+    notes = counts.get('note', 0)
+
+    return {
+        'people': people,
+        'notes': notes,
+        'notes_per_person': round(notes / people, 2) if people else 0,
+    }
+
+
+# Columns of the per-person statistics, see dump_person_stats()
+PERSON_STATS_COLUMNS = (
+    Person.person_id, Person.fname, Person.lname, Person.timestamp,
+    Person.note_count, Person.last_note_at,
+)
+
+
+def person_stats_query():
+    '''
+    Returns a query of every person with their note statistics, in
+    person_id order
+
+    Returns
+    -------
+    Query
+        Rows of PERSON_STATS_COLUMNS
+    '''
+    return (
+        db.session.query(*PERSON_STATS_COLUMNS).order_by(Person.person_id)
+    )
+
+
+def busiest_people(limit):
+    '''
+    Returns the people with the most notes, read backwards from the
+    note_count index
+
+    Parameters
+    ----------
+    limit : int
+        Maximum number of people to return
+
+    Returns
+    -------
+    list
+        Rows of PERSON_STATS_COLUMNS, most notes first
+    '''
+    return (
+        db.session.query(*PERSON_STATS_COLUMNS)
+        .order_by(db.desc(Person.note_count), db.desc(Person.person_id))
+        .limit(limit)
+        .all()
+    )
+
+
+def newest_note_timestamp():
+    '''
+    Returns the timestamp of the newest note, read from the end of the
+    timestamp index
+
+    Returns
+    -------
+    datetime
+        The timestamp, or None without notes
+    '''
+    return db.session.query(db.func.max(Note.timestamp)).scalar()
+
+
+def dump_person_stats(row):
+    '''
+    Turns a row of person_stats_query() into a JSON-friendly dict
+
+    Parameters
+    ----------
+    row : Row
+        The person and their note statistics
+
+    Returns
+    -------
+    dict
+        The person_id, names, note_count, last_note_at and last_activity,
+        which is the newest of the person's own timestamp and last_note_at
+    '''
+    activity = [row.timestamp, row.last_note_at]
+    activity = [timestamp for timestamp in activity if timestamp is not None]
+
+    return {
+        'person_id': row.person_id,
+        'fname': row.fname,
+        'lname': row.lname,
+        'note_count': row.note_count,
+        'last_note_at': format_timestamp(row.last_note_at),
+        'last_activity': format_timestamp(max(activity, default=None)),
+    }
@@ -0,0 +1,70 @@
+# This module holds the helpers used by the list endpoints in people.py and
+# notes.py to stream their whole result set as newline delimited JSON
+# (NDJSON, one JSON object per line)
+#
+# NOTE: A normal response builds the full list in memory and serializes it in
+#       one go, so the peak memory of the server grows with the size of the
+#       table and the client waits until all of it is done. Streaming writes
+#       each row to the client as soon as it is serialized, so memory stays
+#       flat and the first bytes go out right away
+
+import json
+
+from flask import Response, request, stream_with_context
+
+NDJSON = 'application/x-ndjson'
+
+# Number of rows fetched from the database at a time while streaming
+BATCH_SIZE = 1000
+
+
+def wants_stream(stream):
+    '''
+    Decides whether a list request should be answered with a stream
+
+    Parameters
+    ----------
+    stream : bool
+        The value of the stream query parameter
+
+    Returns
+    -------
+    bool
+        True if the caller passed stream=true or prefers NDJSON in its Accept
+        header
+    '''
+    if stream:
+        return True
+
+    return request.accept_mimetypes.best_match(
+        ['application/json', NDJSON]
+    ) == NDJSON
+
+
+def ndjson_response(rows, dump, headers=None):
+    '''
+    Builds a streaming NDJSON response
+
+    Parameters
+    ----------
+    rows : iterable
+        The objects to send, consumed lazily as the response is written
+    dump : callable
+        Function turning one object into a JSON-friendly dict
+    headers : dict, optional
+        Extra response headers (default is None)
+
+    Returns
+    -------
+    Response
+        The streaming response
+    '''
+    def generate():
+        for row in rows:
+            yield json.dumps(dump(row), separators=(',', ':')) + '\n'
+
+    # stream_with_context() keeps the request (and with it the database
+    # session) alive until the last row has been written
+    return Response(
+        stream_with_context(generate()), mimetype=NDJSON, headers=headers
+    )
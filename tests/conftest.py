@@ -0,0 +1,61 @@
+# Shared fixtures of the tests
+#
+# The tests run against a scratch SQLite database in a temporary directory,
+# built from the sample PEOPLE of build_database.py before every test, never
+# against people.db
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRATCH_DIR = tempfile.mkdtemp(prefix='people_tests_')
+SCRATCH_DB = os.path.join(SCRATCH_DIR, 'people.db')
+
+# These have to be set before config.py is imported
+os.environ['PEOPLE_DATABASE_URL'] = 'sqlite:////' + SCRATCH_DB
+os.environ['PEOPLE_SLOW_QUERY_LOG'] = os.path.join(SCRATCH_DIR, 'slow.log')
+os.environ['PEOPLE_SPEC_CACHE_DIR'] = ''
+# The EXPLAIN of a slow query would show up in the query counts
+os.environ['PEOPLE_SLOW_QUERY_MS'] = ''
+sys.path.insert(0, ROOT)
+
+import pytest  # noqa: E402
+
+from build_database import (  # noqa: E402
+    PEOPLE, build_database, remove_database
+)
+from cache import cache  # noqa: E402
+from config import app, db  # noqa: E402
+
+# Importing server registers the API routes on the app
+import server  # noqa: E402, F401
+
+
+def reset_database(people=PEOPLE):
+    '''
+    Rebuilds the scratch database with people and empties the cache
+
+    Parameters
+    ----------
+    people : list, optional
+        The people to insert (default is the PEOPLE of build_database.py)
+    '''
+    db.session.remove()
+    db.engine.dispose()
+    remove_database(SCRATCH_DB)
+    build_database(people)
+    db.session.remove()
+    cache.clear()
+
+
+@pytest.fixture
+def client():
+    '''
+    A test client of the app, on a freshly built database and an empty cache
+    '''
+    reset_database()
+
+    yield app.test_client()
+
+    db.session.remove()
@@ -0,0 +1,51 @@
+# Tests of the bulk loader of build_database.py
+
+from build_database import bulk_load, read_csv, remove_database
+from cache import cache
+from conftest import SCRATCH_DB
+from config import db
+
+CSV = '''fname,lname,content,timestamp
+Doug,Farrell,"Cool, a mini-blogging application!",2019-01-06 22:17:54
+Doug,Farrell,This could be useful,2019-01-08 22:17:54
+Kent,Brockman,,
+Bunny,Easter,Has anyone seen my Easter eggs?,2019-01-07 22:47:54
+'''
+
+
+def test_bulk_load_builds_a_working_database(client, tmp_path):
+    '''
+    A bulk loaded database has its indexes, counts and triggers back
+    '''
+    path = tmp_path / 'people.csv'
+    path.write_text(CSV, encoding='utf-8')
+
+    db.session.remove()
+    db.engine.dispose()
+    remove_database(SCRATCH_DB)
+    db.create_all()
+    assert bulk_load(read_csv(str(path)), batch_size=2) == (3, 3)
+    cache.clear()
+
+    people = client.get('/api/people?include=counts').get_json()
+    assert [
+        (person['lname'], person['note_count']) for person in people
+    ] == [('Brockman', 0), ('Easter', 1), ('Farrell', 2)]
+
+    results = client.get('/api/notes/search?q=eggs').get_json()
+    assert [result['person']['lname'] for result in results] == ['Easter']
+
+    # The unique (lname, fname) constraint survived the load
+    response = client.post(
+        '/api/people', json={'fname': 'Kent', 'lname': 'Brockman'}
+    )
+    assert response.status_code == 409
+
+    # And the triggers are back: a new note is counted and searchable
+    person_id = people[0]['person_id']
+    client.post(
+        f'/api/people/{person_id}/notes', json={'content': 'Profound'}
+    )
+    person = client.get(f'/api/people/{person_id}').get_json()
+    assert person['note_count'] == 1
+    assert client.get('/api/notes/search?q=profound').get_json()
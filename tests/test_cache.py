@@ -0,0 +1,54 @@
+# Tests of the read-through cache in cache.py
+
+from cache import LocalCache, cache
+
+
+def test_writes_invalidate_cached_entries(client):
+    '''
+    A cached person or note is read again once a write changed it, also
+    when a batch wrote it with Core statements
+    '''
+    assert client.get('/api/people/1').get_json()['fname'] == 'Doug'
+    assert client.get('/api/people/1/notes/1').status_code == 200
+    assert cache.stats()['entries'] >= 2
+
+    client.put('/api/people/1', json={'fname': 'Douglas'})
+    assert client.get('/api/people/1').get_json()['fname'] == 'Douglas'
+    # The note embeds its person
+    note = client.get('/api/people/1/notes/1').get_json()
+    assert note['person']['fname'] == 'Douglas'
+
+    client.post('/api/people/1/notes:batch', json={
+        'update': [{'note_id': 1, 'content': 'changed'}],
+    })
+    note = client.get('/api/people/1/notes/1').get_json()
+    assert note['content'] == 'changed'
+    # The person embeds their notes
+    person = client.get('/api/people/1').get_json()
+    assert 'changed' in [note['content'] for note in person['notes']]
+
+
+def test_set_after_invalidation_is_dropped():
+    '''
+    A value read before an invalidation isn't stored after it
+    '''
+    local = LocalCache(max_entries=2)
+
+    token = local.token()
+    local.delete(['person:1'])
+    local.set('person:1', {'fname': 'old'}, token)
+    assert local.get('person:1') is None
+
+    # Other keys are not affected
+    local.set('person:2', {'fname': 'new'}, token)
+    assert local.get('person:2') == {'fname': 'new'}
+
+    # A token older than the invalidations remembered can't be checked
+    token = local.token()
+    local.delete(['a', 'b', 'c'])
+    local.set('person:3', {'fname': 'old'}, token)
+    assert local.get('person:3') is None
+
+    token = local.token()
+    local.set('person:3', {'fname': 'new'}, token)
+    assert local.get('person:3') == {'fname': 'new'}
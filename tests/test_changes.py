@@ -0,0 +1,62 @@
+# Tests of the change feed in changes.py
+
+
+def sync(client, since=None):
+    '''
+    Reads every change since a cursor, following the pages
+
+    Returns
+    -------
+    tuple
+        (type, id, action, data is None) of each change, and the cursor of
+        the last page
+    '''
+    query = {'limit': 4}
+    changes = []
+    while True:
+        if since is not None:
+            query['since'] = since
+        response = client.get('/api/changes', query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        changes += [
+            (change['type'], change['id'], change['action'],
+             change['data'] is None)
+            for change in body['changes']
+        ]
+        since = body['cursor']
+        if 'Link' not in response.headers:
+            return changes, since
+
+
+def test_sync_returns_each_change_once_with_tombstones(client):
+    '''
+    A sync returns every row changed since the cursor once, in the order of
+    their last change, and the deleted rows as tombstones
+    '''
+    changes, cursor = sync(client)
+    assert len(changes) == 10
+    assert {action for _, _, action, _ in changes} == {'upsert'}
+
+    client.put('/api/people/1/notes/1', json={'content': 'first'})
+    client.put('/api/people/1/notes/1', json={'content': 'second'})
+    client.delete('/api/people/1/notes/2')
+    # With their notes
+    client.delete('/api/people/3')
+    client.post('/api/people/2/notes:batch', json={'delete': [4]})
+
+    # The people whose note counts changed are changes too
+    changes, cursor = sync(client, cursor)
+    assert changes == [
+        ('note', 1, 'upsert', False),
+        ('note', 2, 'delete', True),
+        ('person', 1, 'upsert', False),
+        ('person', 3, 'delete', True),
+        ('note', 6, 'delete', True),
+        ('note', 7, 'delete', True),
+        ('note', 4, 'delete', True),
+        ('person', 2, 'upsert', False),
+    ]
+
+    # Nothing changed since
+    assert sync(client, cursor) == ([], cursor)
@@ -0,0 +1,85 @@
+# Tests of the Server-Sent Events of /api/notes/stream, see events.py
+
+import json
+
+
+def read_events(response, count):
+    '''
+    Reads events from an open stream until it has count of them
+
+    Returns
+    -------
+    list
+        (id, kind, data) of each event, without the retry and keep-alive
+        frames
+    '''
+    events = []
+    chunks = iter(response.response)
+    while len(events) < count:
+        for frame in next(chunks).decode('utf-8').split('\n\n'):
+            fields = dict(
+                line.split(': ', 1) for line in frame.splitlines()
+                if not line.startswith(':') and ': ' in line
+            )
+            if 'event' in fields:
+                events.append((
+                    fields.get('id'), fields['event'],
+                    json.loads(fields['data']),
+                ))
+
+    return events
+
+
+def test_stream_sends_every_note_write(client):
+    '''
+    Every write of a note, by whatever endpoint, reaches a subscriber with
+    the same payload
+    '''
+    stream = client.get('/api/notes/stream', buffered=False)
+    assert stream.mimetype == 'text/event-stream'
+
+    created = client.post(
+        '/api/people/2/notes', json={'content': 'single'}
+    ).get_json()
+    client.put(
+        f"/api/people/2/notes/{created['note_id']}", json={'content': 'put'}
+    )
+    client.post('/api/people/2/notes:batch', json={
+        'create': [{'content': 'batch'}],
+        'update': [{'note_id': 4, 'content': 'batch put'}],
+        'delete': [5],
+    })
+    # With their notes
+    client.delete('/api/people/3')
+
+    events = read_events(stream, 7)
+    stream.close()
+    kinds = [(kind, data['note_id']) for _, kind, data in events]
+    assert kinds[:2] == [
+        ('note.created', created['note_id']),
+        ('note.updated', created['note_id']),
+    ]
+    assert sorted(kinds[2:5]) == [
+        ('note.created', created['note_id'] + 1),
+        ('note.deleted', 5),
+        ('note.updated', 4),
+    ]
+    assert sorted(kinds[5:]) == [('note.deleted', 6), ('note.deleted', 7)]
+
+    # The batch sends what the single note handlers send
+    payloads = {}
+    for _, kind, data in events:
+        payloads.setdefault(kind, set()).add(frozenset(data))
+    assert all(len(keys) == 1 for keys in payloads.values())
+    assert created == {
+        key: value for key, value in events[0][2].items()
+        if key != 'person_id'
+    }
+
+    # A reconnecting browser gets the events it missed
+    resumed = client.get(
+        '/api/notes/stream', buffered=False,
+        headers={'Last-Event-ID': events[4][0]},
+    )
+    assert read_events(resumed, 2) == events[5:]
+    resumed.close()
@@ -0,0 +1,94 @@
+# Tests of the group-commit writer of group_commit.py and of note creation
+# through it
+
+import threading
+
+from config import app
+from group_commit import GroupCommitWriter
+
+
+def in_threads(function, count):
+    '''
+    Calls function(i) for i in range(count), each in its own thread
+
+    Returns
+    -------
+    list
+        What each call returned, in the order of i
+    '''
+    results = [None] * count
+
+    def run(i):
+        results[i] = function(i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results
+
+
+def test_writer_batches_concurrent_items():
+    '''
+    Items queued together are written in one call, and every submitter gets
+    the result of its own item, or the error of its batch
+    '''
+    batches = []
+
+    def write(items):
+        batches.append(items)
+        if 'fail' in items:
+            raise ValueError('batch failed')
+        return [item * 2 for item in items]
+
+    def started(max_items):
+        # Requests racing to start the writer may each start one, so start
+        # it with a first item. The window is long enough that only
+        # max_items closes the batches after that
+        writer = GroupCommitWriter(write, window=0.5, max_items=max_items)
+        writer.submit(0)
+        batches.clear()
+        return writer
+
+    writer = started(10)
+    assert in_threads(writer.submit, 10) == [i * 2 for i in range(10)]
+    assert [len(batch) for batch in batches] == [10]
+
+    writer = started(3)
+
+    def submit(i):
+        try:
+            return writer.submit('fail' if i == 0 else 'ok')
+        except ValueError as error:
+            return str(error)
+
+    assert in_threads(submit, 3) == ['batch failed'] * 3
+
+
+def test_group_committed_notes_are_stored(client, monkeypatch):
+    '''
+    Notes created concurrently with GROUP_COMMIT on are all stored, counted
+    and indexed, under the ids their responses report
+    '''
+    monkeypatch.setitem(app.config, 'GROUP_COMMIT', True)
+
+    def create(i):
+        person_id = 999 if i == 0 else 2
+        response = app.test_client().post(
+            f'/api/people/{person_id}/notes',
+            json={'content': f'grouped {i}'},
+        )
+        return response.status_code, response.get_json()
+
+    results = in_threads(create, 20)
+    assert results[0][0] == 404
+    assert {status for status, _ in results[1:]} == {201}
+
+    for status, note in results[1:]:
+        read = client.get(f"/api/people/2/notes/{note['note_id']}")
+        assert read.get_json()['content'] == note['content']
+    assert client.get('/api/people/2').get_json()['note_count'] == 21
+    results = client.get('/api/notes/search?q=grouped&limit=100').get_json()
+    assert len(results) == 19
@@ -0,0 +1,198 @@
+# Tests of the notes endpoints in notes.py
+
+import json
+
+
+def note_ids(response):
+    return [note['note_id'] for note in response.get_json()]
+
+
+def test_name_filter_follows_renamed_person(client):
+    '''
+    A list filtered on the names of the people changes when a person is
+    renamed, even when it doesn't embed the people
+    '''
+    path = '/api/notes?include=none&lname=Far'
+    first = client.get(path)
+    assert first.status_code == 200
+    assert note_ids(first) == [3, 2, 1]
+
+    response = client.put('/api/people/1', json={'lname': 'Smith'})
+    assert response.status_code == 200
+
+    # Neither the list cache nor the ETag may answer with the old page
+    response = client.get(path)
+    assert response.status_code == 200
+    assert note_ids(response) == []
+    assert response.headers['ETag'] != first.headers['ETag']
+
+    response = client.get(
+        path, headers={'If-None-Match': first.headers['ETag']}
+    )
+    assert response.status_code == 200
+
+
+def test_batch_keeps_note_counts(client):
+    '''
+    A batch of notes keeps the note count of their person up to date
+    '''
+    response = client.post('/api/people/1/notes:batch', json={
+        'create': [{'content': 'one'}, {'content': 'two'}],
+        'update': [{'note_id': 1, 'content': 'changed'}],
+        'delete': [2, 4],
+    })
+    assert response.status_code == 200
+    results = response.get_json()
+    assert [item['status'] for item in results['create']] == [201, 201]
+    assert [item['status'] for item in results['update']] == [200]
+    # Note 4 belongs to another person
+    assert [item['status'] for item in results['delete']] == [200, 404]
+
+    for item in results['create']:
+        note = item['note']
+        read = client.get(f"/api/people/1/notes/{note['note_id']}")
+        assert read.get_json()['content'] == note['content']
+    assert client.get('/api/people/1/notes/1').get_json()['content'] == (
+        'changed'
+    )
+    assert client.get('/api/people/1/notes/2').status_code == 404
+    assert client.get('/api/people/1').get_json()['note_count'] == 4
+
+
+def test_stream_matches_the_list(client):
+    '''
+    The NDJSON stream has every note, one per line, as the list has them
+    '''
+    listed = client.get('/api/notes')
+
+    response = client.get(
+        '/api/notes?limit=2', headers={'Accept': 'application/x-ndjson'}
+    )
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.headers['Vary'] == 'Accept'
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == listed.get_json()
+
+    # The JSON and the NDJSON of the same list are told apart by the ETag
+    assert response.headers['ETag'] != listed.headers['ETag']
+
+
+def test_search_ranks_and_follows_writes(client):
+    '''
+    Search puts the best matches first and sees created, updated and
+    deleted notes
+    '''
+    for content in (
+        'A quokka among a long list of many other words in this note',
+        'Quokka, quokka, quokka',
+    ):
+        client.post('/api/people/2/notes', json={'content': content})
+
+    response = client.get('/api/notes/search?q=quokka')
+    assert response.status_code == 200
+    results = response.get_json()
+    assert [result['content'] for result in results] == [
+        'Quokka, quokka, quokka',
+        'A quokka among a long list of many other words in this note',
+    ]
+    assert results[0]['person']['lname'] == 'Brockman'
+
+    results = client.get('/api/notes/search?q=useful').get_json()
+    assert {result['note_id'] for result in results} == {2, 3}
+
+    client.put('/api/people/1/notes/2', json={'content': 'Not any more'})
+    client.delete('/api/people/1/notes/3')
+    assert client.get('/api/notes/search?q=useful').get_json() == []
+
+
+def test_search_rejects_bad_syntax(client):
+    '''
+    A query FTS5 can't parse is the caller's mistake
+    '''
+    response = client.get('/api/notes/search', query_string={'q': '"eggs'})
+    assert response.status_code == 400
+
+
+def test_stats_follow_creates_and_deletes(client):
+    '''
+    The counts of the stats change with every note and person written
+    '''
+    first = client.get('/api/notes/stats?top=1')
+    assert first.get_json()['notes'] == 7
+    assert first.get_json()['most_notes'][0]['lname'] == 'Farrell'
+
+    for content in ('one', 'two'):
+        client.post('/api/people/2/notes', json={'content': content})
+    client.delete('/api/people/1/notes/1')
+
+    response = client.get(
+        '/api/notes/stats?top=1',
+        headers={'If-None-Match': first.headers['ETag']},
+    )
+    assert response.status_code == 200
+    stats = response.get_json()
+    assert (stats['people'], stats['notes']) == (3, 8)
+    assert [
+        (person['lname'], person['note_count'])
+        for person in stats['most_notes']
+    ] == [('Brockman', 4)]
+
+    client.delete('/api/people/2')
+    response = client.get('/api/people/stats')
+    stats = response.get_json()
+    assert (stats['people'], stats['notes']) == (2, 4)
+    assert [
+        (person['person_id'], person['note_count'])
+        for person in stats['per_person']
+    ] == [(1, 2), (3, 2)]
+
+    # Unchanged since
+    etag = response.headers['ETag']
+    response = client.get('/api/people/stats', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_time_and_person_filters_with_fields(client):
+    '''
+    The list filters notes by person and time and returns only the fields
+    asked for
+    '''
+    response = client.get(
+        '/api/notes?person_id=1&since=2019-01-07T00:00:00'
+        '&until=2019-03-06T22:17:54&include=none&fields=note_id,timestamp'
+    )
+    assert response.status_code == 200
+    assert response.get_json() == [
+        {'note_id': 2, 'timestamp': '2019-01-08T22:17:54'},
+    ]
+
+    # Pages of a filtered list only hold matching notes
+    response = client.get('/api/notes?since=2019-01-07T00:00:00&limit=3')
+    first = note_ids(response)
+    rest = note_ids(client.get(response.headers['Link'].split(';')[0][1:-1]))
+    assert first + rest == [7, 3, 5, 2, 6, 4]
+
+    response = client.get('/api/notes?since=yesterday')
+    assert response.status_code == 400
+
+
+def test_if_match_on_a_note_covers_its_person(client):
+    '''
+    The version of a note includes its person, so renaming the person makes
+    an If-Match on the note stale
+    '''
+    etag = client.get('/api/people/1/notes/1').headers['ETag']
+    client.put('/api/people/1', json={'fname': 'Douglas'})
+
+    response = client.put(
+        '/api/people/1/notes/1', json={'content': 'lost update'},
+        headers={'If-Match': etag},
+    )
+    assert response.status_code == 412
+
+    etag = client.get('/api/people/1/notes/1').headers['ETag']
+    response = client.delete(
+        '/api/people/1/notes/1', headers={'If-Match': etag}
+    )
+    assert response.status_code == 200
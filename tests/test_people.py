@@ -0,0 +1,105 @@
+# Tests of the people endpoints in people.py
+
+
+def test_one_person_has_one_shape(client):
+    '''
+    Reading, creating and updating a person return the same fields
+    '''
+    created = client.post(
+        '/api/people', json={'fname': 'Ada', 'lname': 'Lovelace'}
+    )
+    assert created.status_code == 201
+    person_id = created.get_json()['person_id']
+
+    read = client.get(f'/api/people/{person_id}')
+    updated = client.put(f'/api/people/{person_id}', json={'fname': 'Ad'})
+
+    fields = set(created.get_json())
+    assert 'note_count' in fields and 'last_note_at' in fields
+    assert set(read.get_json()) == fields
+    assert set(updated.get_json()) == fields
+
+
+def test_batch_writes_and_reports_each_item(client):
+    '''
+    A batch writes the items it can and reports the status of every item
+    '''
+    response = client.post('/api/people:batch', json={
+        'create': [
+            {'fname': 'Ada', 'lname': 'Lovelace'},
+            {'fname': 'Doug', 'lname': 'Farrell'},
+        ],
+        'update': [
+            {'person_id': 2, 'fname': 'Kenneth', 'lname': 'Brockman'},
+            {'person_id': 999, 'fname': 'No', 'lname': 'One'},
+        ],
+        'delete': [3, 999],
+    })
+    assert response.status_code == 200
+    results = response.get_json()
+    assert [item['status'] for item in results['create']] == [201, 409]
+    assert [item['status'] for item in results['update']] == [200, 404]
+    assert [item['status'] for item in results['delete']] == [200, 404]
+
+    person_id = results['create'][0]['person']['person_id']
+    assert client.get(f'/api/people/{person_id}').get_json()['lname'] == (
+        'Lovelace'
+    )
+    assert client.get('/api/people/2').get_json()['fname'] == 'Kenneth'
+    assert client.get('/api/people/3').status_code == 404
+
+    # The notes of the deleted person went with them
+    notes = client.get('/api/notes?include=none').get_json()
+    assert {note['note_id'] for note in notes} == {1, 2, 3, 4, 5}
+
+
+def test_filters_and_fields(client):
+    '''
+    The list filters people by name prefix and returns only the fields
+    asked for
+    '''
+    response = client.get(
+        '/api/people?lname=B&include=none&fields=person_id,lname'
+    )
+    assert response.status_code == 200
+    assert response.get_json() == [{'person_id': 2, 'lname': 'Brockman'}]
+
+    response = client.get('/api/people?fname=Bun&lname=East&include=counts')
+    assert [
+        (person['fname'], person['note_count'])
+        for person in response.get_json()
+    ] == [('Bunny', 2)]
+
+    response = client.get('/api/people?fields=password')
+    assert response.status_code == 400
+
+
+def test_if_match_guards_updates_and_deletes(client):
+    '''
+    An update or delete naming an old version of the person fails with 412
+    and changes nothing
+    '''
+    old = client.get('/api/people/1').headers['ETag']
+
+    response = client.put(
+        '/api/people/1', json={'fname': 'Douglas'}, headers={'If-Match': old}
+    )
+    assert response.status_code == 200
+    current = client.get('/api/people/1').headers['ETag']
+    assert current != old
+
+    response = client.put(
+        '/api/people/1', json={'fname': 'Dougie'}, headers={'If-Match': old}
+    )
+    assert response.status_code == 412
+    response = client.delete('/api/people/1', headers={'If-Match': old})
+    assert response.status_code == 412
+    assert client.get('/api/people/1').get_json()['fname'] == 'Douglas'
+
+    # A missing person stays a 404
+    response = client.delete('/api/people/999', headers={'If-Match': old})
+    assert response.status_code == 404
+
+    response = client.delete('/api/people/1', headers={'If-Match': current})
+    assert response.status_code == 200
+    assert client.get('/api/people/1').status_code == 404
@@ -0,0 +1,65 @@
+# Tests of the number of queries the list endpoints send, which must not
+# grow with the number of rows they return (no lazy load per row)
+
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from build_database import generate_people
+from cache import cache
+from conftest import reset_database
+from config import db
+
+
+@contextmanager
+def count_queries():
+    '''
+    Records the statements sent to the database in the with block
+
+    Yields
+    ------
+    list
+        The SQL of every statement, filled in as they are sent
+    '''
+    statements = []
+
+    def record(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def queries_for(client, path, people):
+    '''
+    Counts the queries of an uncached request on a database of people
+    '''
+    reset_database(generate_people(people, notes_per_person=3, seed=1))
+    cache.clear()
+    with count_queries() as statements:
+        response = client.get(path)
+    assert response.status_code == 200
+    assert len(response.get_json()) > 0
+
+    return len(statements)
+
+
+@pytest.mark.parametrize('path', [
+    '/api/people?limit=1000',
+    '/api/people?limit=1000&include=counts',
+    '/api/notes?limit=1000',
+    '/api/notes?limit=1000&include=none',
+    '/api/notes?limit=1000&lname=Last',
+])
+def test_list_queries_dont_grow_with_rows(client, path):
+    few = queries_for(client, path, 5)
+    many = queries_for(client, path, 100)
+
+    assert few == many
+    # The table versions of the ETag, the page, and at most one query per
+    # eager loaded relationship
+    assert many <= 3
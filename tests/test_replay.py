@@ -0,0 +1,147 @@
+# Tests of recording traffic with recorder.py and replaying it with
+# replay.py
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from werkzeug.serving import make_server
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from cache import cache
+from config import app, db
+from conftest import SCRATCH_DB, reset_database
+from recorder import TrafficRecorder
+from replay import Replayer, load_traffic
+
+
+def record(path, requests):
+    '''
+    Sends requests to the app through a TrafficRecorder writing to path
+
+    Parameters
+    ----------
+    path : str
+        The file to record to
+    requests : list
+        (method, path, keyword arguments of the test client) of each request
+    '''
+    client = Client(TrafficRecorder(app.wsgi_app, path), Response)
+    for method, url, kwargs in requests:
+        client.open(url, method=method, **kwargs)
+
+
+@contextmanager
+def serving():
+    '''
+    Serves the app on a free local port in a thread
+
+    Yields
+    ------
+    str
+        The base URL of the server
+    '''
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}'
+    finally:
+        server.shutdown()
+        thread.join()
+
+
+def copy_database(source, target):
+    '''
+    Copies the SQLite database at source over the one at target
+    '''
+    db.session.remove()
+    db.engine.dispose()
+    with sqlite3.connect(source) as source, sqlite3.connect(target) as target:
+        source.backup(target)
+    cache.clear()
+
+
+def replay(records, snapshot=None):
+    '''
+    Replays records one at a time against the app
+
+    Parameters
+    ----------
+    records : list
+        The recorded requests
+    snapshot : str, optional
+        A copy of the database to replay on (default is None, a freshly
+        built one)
+
+    Returns
+    -------
+    list
+        The status of every replayed request, in the order of records
+    '''
+    if snapshot is None:
+        reset_database()
+    else:
+        copy_database(snapshot, SCRATCH_DB)
+    with serving() as url:
+        replayer = Replayer(url)
+        replayer.replay(records, speed=0, clients=1)
+
+    statuses = {id(record): status for record, status, *_ in replayer.results}
+
+    return [statuses[id(record)] for record in records]
+
+
+def test_replay_repeats_recorded_requests(client, tmp_path):
+    '''
+    The recorded requests replay with the statuses they were recorded with
+    '''
+    path = str(tmp_path / 'traffic.jsonl')
+    record(path, [
+        ('GET', '/api/people', {}),
+        ('POST', '/api/people', {
+            'json': {'fname': 'Ada', 'lname': 'Lovelace'},
+        }),
+        ('POST', '/api/people', {
+            'json': {'fname': 'Ada', 'lname': 'Lovelace'},
+        }),
+        ('GET', '/api/people/999', {}),
+        ('GET', '/', {}),
+    ])
+
+    records = load_traffic(path)
+    # Only the API is recorded
+    assert [record['status'] for record in records] == [200, 201, 409, 404]
+    assert records[1]['headers']['Content-Type'] == 'application/json'
+
+    assert replay(records) == [200, 201, 409, 404]
+
+
+def test_replay_keeps_if_match(client, tmp_path):
+    '''
+    Writes recorded with If-Match replay with it, so a stale version fails
+    again instead of overwriting
+    '''
+    snapshot = str(tmp_path / 'people.db')
+    copy_database(SCRATCH_DB, snapshot)
+
+    etag = client.get('/api/people/1').headers['ETag']
+    path = str(tmp_path / 'traffic.jsonl')
+    record(path, [
+        ('PUT', '/api/people/1', {
+            'json': {'fname': 'Douglas'}, 'headers': {'If-Match': etag},
+        }),
+        ('PUT', '/api/people/1', {
+            'json': {'fname': 'Dougie'}, 'headers': {'If-Match': etag},
+        }),
+    ])
+
+    records = load_traffic(path)
+    assert [record['headers']['If-Match'] for record in records] == [
+        etag, etag
+    ]
+    assert [record['status'] for record in records] == [200, 412]
+
+    assert replay(records, snapshot) == [200, 412]
+    assert client.get('/api/people/1').get_json()['fname'] == 'Douglas'